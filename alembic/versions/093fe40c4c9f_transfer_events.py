@@ -0,0 +1,41 @@
+"""transfer events
+
+Revision ID: 093fe40c4c9f
+Revises: 52810ef030b2
+Create Date: 2026-10-19 12:20:05.913462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '093fe40c4c9f'
+down_revision = '52810ef030b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'transfer_events',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('from_user_id', sa.Integer(), nullable=False),
+        sa.Column('to_user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['from_user_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['to_user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_transfer_events_from_user_id_id', 'transfer_events', ['from_user_id', 'id'], unique=False
+    )
+    op.create_index(
+        'ix_transfer_events_to_user_id_id', 'transfer_events', ['to_user_id', 'id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_transfer_events_to_user_id_id', table_name='transfer_events')
+    op.drop_index('ix_transfer_events_from_user_id_id', table_name='transfer_events')
+    op.drop_table('transfer_events')
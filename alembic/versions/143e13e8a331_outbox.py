@@ -0,0 +1,36 @@
+"""outbox
+
+Revision ID: 143e13e8a331
+Revises: 662ee4fbb6c6
+Create Date: 2026-10-19 17:05:41.530284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '143e13e8a331'
+down_revision = '662ee4fbb6c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Notifications written in the transaction of the change they announce,
+    # until the dispatcher has delivered them.
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('event', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('available_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_available_at', 'outbox', ['available_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_available_at', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,109 @@
+"""items partitioned
+
+Revision ID: 3adeed8af3cb
+Revises: e9357db9ca4b
+Create Date: 2026-10-19 14:31:09.518342
+
+"""
+from alembic import op
+
+
+revision = '3adeed8af3cb'
+down_revision = 'e9357db9ca4b'
+branch_labels = None
+depends_on = None
+
+
+# First step of moving `items` to a table hash-partitioned by user_id:
+#
+# 1. This migration creates the partitioned table as `items_partitioned` and
+#    a trigger that mirrors every later change of `items` into it.
+# 2. `python -m app.partitioning` copies the rows that existed before, in
+#    batches of short transactions, while the application keeps running.
+# 3. The next migration copies whatever step 2 has not copied yet and swaps
+#    the tables. On a small database steps 2 and 3 can be one `upgrade head`.
+PARTITIONS = 16
+
+# Postgres only allows unique constraints that contain the partition key, so
+# the primary key is (user_id, id); ids still come from items_id_seq.
+ITEMS_PARTITIONED_TABLE = '''
+CREATE TABLE items_partitioned (
+    id integer NOT NULL DEFAULT nextval('items_id_seq'),
+    user_id integer NOT NULL,
+    name varchar NOT NULL,
+    CONSTRAINT items_partitioned_pkey PRIMARY KEY (user_id, id),
+    CONSTRAINT items_partitioned_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)
+) PARTITION BY HASH (user_id)
+'''
+
+# Changing the owner of an item moves it to another partition, so an UPDATE
+# is mirrored as a delete and an insert.
+ITEMS_PARTITIONED_SYNC_FUNCTION = '''
+CREATE FUNCTION items_partitioned_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM items_partitioned WHERE user_id = OLD.user_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO items_partitioned (id, user_id, name)
+        VALUES (NEW.id, NEW.user_id, NEW.name)
+        ON CONFLICT (user_id, id) DO UPDATE SET name = EXCLUDED.name;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+def has_pg_trgm():
+    return op.get_bind().execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    ).scalar()
+
+
+def upgrade():
+    op.execute(ITEMS_PARTITIONED_TABLE)
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'CREATE TABLE items_p{remainder} PARTITION OF items_partitioned '
+            f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})'
+        )
+    # The primary key serves lookups by user; lookups by id alone probe the
+    # id index of every partition.
+    op.execute('CREATE INDEX ix_items_partitioned_id ON items_partitioned (id)')
+    op.execute(
+        'CREATE INDEX ix_items_partitioned_user_id_name_id '
+        'ON items_partitioned (user_id, name, id)'
+    )
+    if has_pg_trgm():
+        op.execute(
+            'CREATE INDEX ix_items_partitioned_name_trgm '
+            'ON items_partitioned USING gin (name gin_trgm_ops)'
+        )
+
+    op.execute(ITEMS_PARTITIONED_SYNC_FUNCTION)
+    # Creating the trigger waits for running writes to `items` and blocks new
+    # ones until the end of the migration: rows written from then on reach
+    # the new table through the trigger, and the backfill only has to copy
+    # ids up to target_id.
+    op.execute(
+        'CREATE TRIGGER items_partitioned_sync AFTER INSERT OR UPDATE OR DELETE ON items '
+        'FOR EACH ROW EXECUTE PROCEDURE items_partitioned_sync()'
+    )
+    op.execute('''
+        CREATE TABLE items_partitioned_backfill (
+            last_id integer NOT NULL,
+            target_id integer NOT NULL
+        )
+    ''')
+    op.execute('''
+        INSERT INTO items_partitioned_backfill (last_id, target_id)
+        SELECT 0, coalesce(max(id), 0) FROM items
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TABLE items_partitioned_backfill')
+    op.execute('DROP TRIGGER items_partitioned_sync ON items')
+    op.execute('DROP FUNCTION items_partitioned_sync()')
+    op.execute('DROP TABLE items_partitioned')
@@ -0,0 +1,155 @@
+"""user counters
+
+Revision ID: 52810ef030b2
+Revises: 607cc52ccb39
+Create Date: 2026-10-19 11:02:47.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '52810ef030b2'
+down_revision = '607cc52ccb39'
+branch_labels = None
+depends_on = None
+
+
+# Counters are maintained by statement-level triggers over transition tables,
+# so a multi-row statement (batched insert, bulk delete, COPY) updates each
+# affected counter row once. Deltas are applied in user_id order to keep lock
+# ordering stable between concurrent statements, and statements with a zero
+# net effect (an UPDATE that does not move items) do not touch counters.
+ITEMS_COUNTERS_FUNCTION = '''
+CREATE FUNCTION items_user_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, count(*) FROM new_rows
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, -count(*) FROM old_rows
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSE
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, sum(delta) FROM (
+            SELECT user_id, -1 AS delta FROM old_rows
+            UNION ALL
+            SELECT user_id, 1 AS delta FROM new_rows
+        ) AS deltas
+        GROUP BY user_id HAVING sum(delta) <> 0 ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+SENDINGS_COUNTERS_UPSERT = '''
+    INSERT INTO user_counters AS c (
+        user_id, outgoing_sendings_count, incoming_sendings_count
+    )
+    SELECT user_id, sum(outgoing), sum(incoming) FROM ({deltas}) AS deltas
+    GROUP BY user_id HAVING sum(outgoing) <> 0 OR sum(incoming) <> 0
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET outgoing_sendings_count = c.outgoing_sendings_count + EXCLUDED.outgoing_sendings_count,
+        incoming_sendings_count = c.incoming_sendings_count + EXCLUDED.incoming_sendings_count;
+'''
+
+SENDINGS_COUNTERS_NEW = '''
+    SELECT from_user_id AS user_id, 1 AS outgoing, 0 AS incoming FROM new_rows
+    UNION ALL
+    SELECT to_user_id, 0, 1 FROM new_rows
+'''
+
+SENDINGS_COUNTERS_OLD = '''
+    SELECT from_user_id AS user_id, -1 AS outgoing, 0 AS incoming FROM old_rows
+    UNION ALL
+    SELECT to_user_id, 0, -1 FROM old_rows
+'''
+
+SENDINGS_COUNTERS_FUNCTION = f'''
+CREATE FUNCTION sendings_user_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {SENDINGS_COUNTERS_UPSERT.format(deltas=SENDINGS_COUNTERS_NEW)}
+    ELSIF TG_OP = 'DELETE' THEN
+        {SENDINGS_COUNTERS_UPSERT.format(deltas=SENDINGS_COUNTERS_OLD)}
+    ELSE
+        {SENDINGS_COUNTERS_UPSERT.format(
+            deltas=f'{SENDINGS_COUNTERS_OLD} UNION ALL {SENDINGS_COUNTERS_NEW}'
+        )}
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+def create_counter_triggers(table, function):
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_insert AFTER INSERT ON {table} '
+        f'REFERENCING NEW TABLE AS new_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_update AFTER UPDATE ON {table} '
+        f'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_delete AFTER DELETE ON {table} '
+        f'REFERENCING OLD TABLE AS old_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+
+
+def drop_counter_triggers(table):
+    for event in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER {table}_user_counters_{event} ON {table}')
+
+
+def upgrade():
+    op.create_table(
+        'user_counters',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('items_count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('outgoing_sendings_count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('incoming_sendings_count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+    op.execute(ITEMS_COUNTERS_FUNCTION)
+    op.execute(SENDINGS_COUNTERS_FUNCTION)
+    # Creating the triggers locks out writers until the end of the migration,
+    # so the backfill below cannot miss concurrent changes.
+    create_counter_triggers('items', 'items_user_counters')
+    create_counter_triggers('sendings', 'sendings_user_counters')
+
+    op.execute('''
+        INSERT INTO user_counters (
+            user_id, items_count, outgoing_sendings_count, incoming_sendings_count
+        )
+        SELECT
+            users.id,
+            (SELECT count(*) FROM items WHERE items.user_id = users.id),
+            (SELECT count(*) FROM sendings WHERE sendings.from_user_id = users.id),
+            (SELECT count(*) FROM sendings WHERE sendings.to_user_id = users.id)
+        FROM users
+    ''')
+
+
+def downgrade():
+    drop_counter_triggers('sendings')
+    drop_counter_triggers('items')
+    op.execute('DROP FUNCTION sendings_user_counters()')
+    op.execute('DROP FUNCTION items_user_counters()')
+    op.drop_table('user_counters')
@@ -0,0 +1,57 @@
+"""items search indexes
+
+Revision ID: 607cc52ccb39
+Revises: 6f8e74f2b6e3
+Create Date: 2026-10-19 10:12:31.204518
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '607cc52ccb39'
+down_revision = '6f8e74f2b6e3'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    # Built concurrently so that existing inventories stay writable.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_items_user_id_id', 'items', ['user_id', 'id'],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_items_user_id_name_id', 'items', ['user_id', 'name', 'id'],
+            unique=False, postgresql_concurrently=True,
+        )
+
+        # pg_trgm ships with contrib and is not available on every server.
+        # Without it `?q=` is still answered from ix_items_user_id_name_id,
+        # filtering the index entries of a single user.
+        has_pg_trgm = op.get_bind().execute(
+            sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        ).scalar()
+        if has_pg_trgm:
+            op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            op.create_index(
+                'ix_items_name_trgm', 'items', ['name'],
+                unique=False, postgresql_concurrently=True,
+                postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+            )
+        else:
+            logger.warning(
+                'pg_trgm is not available: ix_items_name_trgm is not created and '
+                'substring searches scan the items of the user'
+            )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_items_name_trgm')
+    op.drop_index('ix_items_user_id_name_id', table_name='items')
+    op.drop_index('ix_items_user_id_id', table_name='items')
@@ -0,0 +1,47 @@
+"""shard transfers
+
+Revision ID: 662ee4fbb6c6
+Revises: 6b43f9120583
+Create Date: 2026-10-19 15:40:22.187903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '662ee4fbb6c6'
+down_revision = '6b43f9120583'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Items leaving the shard of the sender, until the shard of the
+    # recipient has them.
+    op.create_table(
+        'outgoing_transfers',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('from_user_id', sa.Integer(), nullable=False),
+        sa.Column('to_user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_outgoing_transfers_created_at', 'outgoing_transfers', ['created_at'], unique=False
+    )
+    # Ids of the transfers a shard has received, so that a transfer
+    # delivered twice adds its item once.
+    op.create_table(
+        'incoming_transfers',
+        sa.Column('id', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('incoming_transfers')
+    op.drop_index('ix_outgoing_transfers_created_at', table_name='outgoing_transfers')
+    op.drop_table('outgoing_transfers')
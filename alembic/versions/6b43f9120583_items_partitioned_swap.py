@@ -0,0 +1,203 @@
+"""items partitioned swap
+
+Revision ID: 6b43f9120583
+Revises: 3adeed8af3cb
+Create Date: 2026-10-19 14:52:37.208415
+
+"""
+from alembic import op
+
+
+revision = '6b43f9120583'
+down_revision = '3adeed8af3cb'
+branch_labels = None
+depends_on = None
+
+
+# Second step of partitioning `items`, see 3adeed8af3cb. Run it after
+# `python -m app.partitioning` has finished; otherwise the remaining rows are
+# copied here while writes to `items` wait.
+
+# sendings.item_id can no longer reference items: a foreign key needs a
+# unique constraint on items.id alone, which a table partitioned by user_id
+# cannot have. Triggers keep what the constraint did: deleting items removes
+# their pending sendings, and a sending must refer to an existing item.
+ITEMS_DELETE_SENDINGS_FUNCTION = '''
+CREATE FUNCTION items_delete_sendings() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM sendings WHERE item_id IN (SELECT id FROM old_rows);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# FOR KEY SHARE is the lock a foreign key check takes: it waits for a
+# concurrent delete of the item and keeps the item from being deleted until
+# the sending is committed.
+SENDINGS_CHECK_ITEM_FUNCTION = '''
+CREATE FUNCTION sendings_check_item() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM items WHERE id = NEW.item_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'item % of sending does not exist', NEW.item_id
+        USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+'''
+
+ITEMS_PARTITIONED_SYNC_FUNCTION = '''
+CREATE FUNCTION items_partitioned_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM items_partitioned WHERE user_id = OLD.user_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO items_partitioned (id, user_id, name)
+        VALUES (NEW.id, NEW.user_id, NEW.name)
+        ON CONFLICT (user_id, id) DO UPDATE SET name = EXCLUDED.name;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# Index and constraint names of the partitioned table before and after the swap.
+RENAMED_INDEXES = [
+    ('ix_items_partitioned_id', 'ix_items_id'),
+    ('ix_items_partitioned_user_id_name_id', 'ix_items_user_id_name_id'),
+    ('ix_items_partitioned_name_trgm', 'ix_items_name_trgm'),
+]
+RENAMED_CONSTRAINTS = [
+    ('items_partitioned_pkey', 'items_pkey'),
+    ('items_partitioned_user_id_fkey', 'items_user_id_fkey'),
+]
+
+
+def has_pg_trgm():
+    return op.get_bind().execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    ).scalar()
+
+
+def create_counter_triggers(table, function):
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_insert AFTER INSERT ON {table} '
+        f'REFERENCING NEW TABLE AS new_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_update AFTER UPDATE ON {table} '
+        f'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+    op.execute(
+        f'CREATE TRIGGER {table}_user_counters_delete AFTER DELETE ON {table} '
+        f'REFERENCING OLD TABLE AS old_rows '
+        f'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+    )
+
+
+def drop_counter_triggers(table):
+    for event in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER {table}_user_counters_{event} ON {table}')
+
+
+def upgrade():
+    # Readers go on; writers wait until the swap is committed.
+    op.execute('LOCK TABLE items IN EXCLUSIVE MODE')
+    op.execute('''
+        INSERT INTO items_partitioned (id, user_id, name)
+        SELECT items.id, items.user_id, items.name
+        FROM items, items_partitioned_backfill AS backfill
+        WHERE items.id > backfill.last_id AND items.id <= backfill.target_id
+        ON CONFLICT (user_id, id) DO NOTHING
+    ''')
+    op.execute('DROP TABLE items_partitioned_backfill')
+    op.execute('DROP TRIGGER items_partitioned_sync ON items')
+    op.execute('DROP FUNCTION items_partitioned_sync()')
+    drop_counter_triggers('items')
+    op.execute('ALTER TABLE sendings DROP CONSTRAINT sendings_item_id_fkey')
+
+    op.execute('ALTER SEQUENCE items_id_seq OWNED BY items_partitioned.id')
+    op.execute('DROP TABLE items')
+    op.execute('ALTER TABLE items_partitioned RENAME TO items')
+    for old_name, new_name in RENAMED_INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {old_name} RENAME TO {new_name}')
+    for old_name, new_name in RENAMED_CONSTRAINTS:
+        op.execute(f'ALTER TABLE items RENAME CONSTRAINT {old_name} TO {new_name}')
+
+    create_counter_triggers('items', 'items_user_counters')
+    op.execute(ITEMS_DELETE_SENDINGS_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER items_delete_sendings AFTER DELETE ON items '
+        'REFERENCING OLD TABLE AS old_rows '
+        'FOR EACH STATEMENT EXECUTE PROCEDURE items_delete_sendings()'
+    )
+    op.execute(SENDINGS_CHECK_ITEM_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER sendings_check_item BEFORE INSERT OR UPDATE OF item_id ON sendings '
+        'FOR EACH ROW EXECUTE PROCEDURE sendings_check_item()'
+    )
+
+
+def downgrade():
+    # Back to the state after 3adeed8af3cb with a completed backfill: a plain
+    # `items` mirrored into `items_partitioned`.
+    op.execute('LOCK TABLE items IN EXCLUSIVE MODE')
+    op.execute('''
+        CREATE TABLE items_unpartitioned (
+            id integer NOT NULL,
+            user_id integer NOT NULL,
+            name varchar NOT NULL
+        )
+    ''')
+    op.execute('INSERT INTO items_unpartitioned (id, user_id, name) SELECT id, user_id, name FROM items')
+
+    op.execute('DROP TRIGGER sendings_check_item ON sendings')
+    op.execute('DROP FUNCTION sendings_check_item()')
+    op.execute('DROP TRIGGER items_delete_sendings ON items')
+    op.execute('DROP FUNCTION items_delete_sendings()')
+    drop_counter_triggers('items')
+
+    for old_name, new_name in RENAMED_CONSTRAINTS:
+        op.execute(f'ALTER TABLE items RENAME CONSTRAINT {new_name} TO {old_name}')
+    for old_name, new_name in RENAMED_INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {new_name} RENAME TO {old_name}')
+    op.execute('ALTER TABLE items RENAME TO items_partitioned')
+
+    op.execute('ALTER TABLE items_unpartitioned RENAME TO items')
+    op.execute("ALTER TABLE items ALTER COLUMN id SET DEFAULT nextval('items_id_seq')")
+    op.execute('ALTER SEQUENCE items_id_seq OWNED BY items.id')
+    op.execute('ALTER TABLE items ADD CONSTRAINT items_pkey PRIMARY KEY (id)')
+    op.execute(
+        'ALTER TABLE items ADD CONSTRAINT items_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES users (id)'
+    )
+    op.execute('CREATE INDEX ix_items_id ON items (id)')
+    op.execute('CREATE INDEX ix_items_user_id_id ON items (user_id, id)')
+    op.execute('CREATE INDEX ix_items_user_id_name_id ON items (user_id, name, id)')
+    if has_pg_trgm():
+        op.execute('CREATE INDEX ix_items_name_trgm ON items USING gin (name gin_trgm_ops)')
+    create_counter_triggers('items', 'items_user_counters')
+    op.execute(
+        'ALTER TABLE sendings ADD CONSTRAINT sendings_item_id_fkey '
+        'FOREIGN KEY (item_id) REFERENCES items (id) ON DELETE CASCADE'
+    )
+
+    op.execute(ITEMS_PARTITIONED_SYNC_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER items_partitioned_sync AFTER INSERT OR UPDATE OR DELETE ON items '
+        'FOR EACH ROW EXECUTE PROCEDURE items_partitioned_sync()'
+    )
+    op.execute('''
+        CREATE TABLE items_partitioned_backfill (
+            last_id integer NOT NULL,
+            target_id integer NOT NULL
+        )
+    ''')
+    op.execute('''
+        INSERT INTO items_partitioned_backfill (last_id, target_id)
+        SELECT coalesce(max(id), 0), coalesce(max(id), 0) FROM items
+    ''')
@@ -0,0 +1,41 @@
+"""sendings item cascade
+
+Revision ID: 840f53c16504
+Revises: 093fe40c4c9f
+Create Date: 2026-10-19 13:05:41.426056
+
+"""
+from alembic import op
+
+
+revision = '840f53c16504'
+down_revision = '093fe40c4c9f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Deleting an item removes its pending sendings, which needs an index on
+    # sendings.item_id to avoid a scan of sendings per deleted item.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_sendings_item_id', 'sendings', ['item_id'],
+            unique=False, postgresql_concurrently=True,
+        )
+
+    # NOT VALID swaps the constraint without scanning sendings while holding
+    # the exclusive lock; VALIDATE then runs in its own transaction with a
+    # lock that allows writes.
+    op.execute(
+        'ALTER TABLE sendings DROP CONSTRAINT sendings_item_id_fkey, '
+        'ADD CONSTRAINT sendings_item_id_fkey FOREIGN KEY (item_id) '
+        'REFERENCES items (id) ON DELETE CASCADE NOT VALID'
+    )
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE sendings VALIDATE CONSTRAINT sendings_item_id_fkey')
+
+
+def downgrade():
+    op.drop_constraint('sendings_item_id_fkey', 'sendings', type_='foreignkey')
+    op.create_foreign_key('sendings_item_id_fkey', 'sendings', 'items', ['item_id'], ['id'])
+    op.drop_index('ix_sendings_item_id', table_name='sendings')
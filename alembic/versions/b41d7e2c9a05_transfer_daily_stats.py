@@ -0,0 +1,36 @@
+"""transfer daily stats
+
+Revision ID: b41d7e2c9a05
+Revises: f808cfd5a624
+Create Date: 2026-10-19 19:42:17.208561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b41d7e2c9a05'
+down_revision = 'f808cfd5a624'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled as transfer events are written. Events written before this
+    # migration are counted by `python -m app.rollups`, which knows the shard
+    # of each database.
+    op.create_table(
+        'transfer_daily_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('sent_count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('received_count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    op.create_index('ix_transfer_daily_stats_day', 'transfer_daily_stats', ['day'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_transfer_daily_stats_day', table_name='transfer_daily_stats')
+    op.drop_table('transfer_daily_stats')
@@ -0,0 +1,78 @@
+"""items user id name trgm
+
+Revision ID: d3a91f6c27e4
+Revises: b41d7e2c9a05
+Create Date: 2026-10-19 21:08:44.517302
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd3a91f6c27e4'
+down_revision = 'b41d7e2c9a05'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# ix_items_name_trgm holds the names of all users, so `?q=` searches match
+# the names of everyone and only then drop the other users' rows. With
+# btree_gin user_id is a key of the same GIN index and a search only reads
+# the entries of one user.
+TRGM_INDEX = ('ix_items_name_trgm', 'name gin_trgm_ops')
+USER_TRGM_INDEX = ('ix_items_user_id_name_trgm', 'user_id, name gin_trgm_ops')
+
+
+def has_extension(name):
+    return op.get_bind().execute(
+        sa.text('SELECT 1 FROM pg_extension WHERE extname = :name'), {'name': name}
+    ).scalar()
+
+
+def is_available(name):
+    return op.get_bind().execute(
+        sa.text('SELECT 1 FROM pg_available_extensions WHERE name = :name'), {'name': name}
+    ).scalar()
+
+
+def create_partitioned_index(name, columns):
+    # As in f808cfd5a624: an index on the partitioned table alone, then one
+    # per partition built concurrently and attached.
+    op.execute(f'CREATE INDEX {name} ON ONLY items USING gin ({columns}) WHERE deleted_at IS NULL')
+    partitions = op.get_bind().execute(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'items'::regclass"
+    ).fetchall()
+    for partition, in partitions:
+        with op.get_context().autocommit_block():
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{name} '
+                f'ON {partition} USING gin ({columns}) WHERE deleted_at IS NULL'
+            )
+        op.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition}_{name}')
+
+
+def upgrade():
+    if not has_extension('pg_trgm'):
+        logger.warning('pg_trgm is not installed: %s is not created', USER_TRGM_INDEX[0])
+        return
+    if not is_available('btree_gin'):
+        logger.warning(
+            'btree_gin is not available: %s stays on name only and searches '
+            'match the names of all users', TRGM_INDEX[0]
+        )
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    create_partitioned_index(*USER_TRGM_INDEX)
+    op.execute(f'DROP INDEX {TRGM_INDEX[0]}')
+
+
+def downgrade():
+    if not op.get_bind().execute(sa.text(f"SELECT to_regclass('{USER_TRGM_INDEX[0]}')")).scalar():
+        return
+
+    create_partitioned_index(*TRGM_INDEX)
+    op.execute(f'DROP INDEX {USER_TRGM_INDEX[0]}')
@@ -0,0 +1,34 @@
+"""sendings user indexes
+
+Revision ID: e9357db9ca4b
+Revises: 840f53c16504
+Create Date: 2026-10-19 13:48:12.730914
+
+"""
+from alembic import op
+
+
+revision = 'e9357db9ca4b'
+down_revision = '840f53c16504'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The included columns let GET /sendings/{incoming,outgoing} read a page
+    # of sendings with an index-only scan; only the item names are looked up
+    # in items. SQLAlchemy 1.3 cannot express INCLUDE, hence plain SQL.
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY ix_sendings_to_user_id_id ON sendings '
+            '(to_user_id, id) INCLUDE (item_id, from_user_id, item_token)'
+        )
+        op.execute(
+            'CREATE INDEX CONCURRENTLY ix_sendings_from_user_id_id ON sendings '
+            '(from_user_id, id) INCLUDE (item_id, to_user_id, item_token)'
+        )
+
+
+def downgrade():
+    op.drop_index('ix_sendings_from_user_id_id', table_name='sendings')
+    op.drop_index('ix_sendings_to_user_id_id', table_name='sendings')
@@ -0,0 +1,194 @@
+"""items soft delete
+
+Revision ID: f808cfd5a624
+Revises: 143e13e8a331
+Create Date: 2026-10-19 18:21:06.937415
+
+"""
+from alembic import op
+
+
+revision = 'f808cfd5a624'
+down_revision = '143e13e8a331'
+branch_labels = None
+depends_on = None
+
+
+# Deleting an item sets deleted_at; `python -m app.compaction` (or the
+# application's background compactor) deletes the rows later, in batches.
+# Counters only count live items, so compaction does not change them.
+ITEMS_COUNTERS_FUNCTION = '''
+CREATE OR REPLACE FUNCTION items_user_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, count(*) FROM new_rows WHERE deleted_at IS NULL
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, -count(*) FROM old_rows WHERE deleted_at IS NULL
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSE
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, sum(delta) FROM (
+            SELECT user_id, -1 AS delta FROM old_rows WHERE deleted_at IS NULL
+            UNION ALL
+            SELECT user_id, 1 AS delta FROM new_rows WHERE deleted_at IS NULL
+        ) AS deltas
+        GROUP BY user_id HAVING sum(delta) <> 0 ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+ITEMS_COUNTERS_FUNCTION_BEFORE = '''
+CREATE OR REPLACE FUNCTION items_user_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, count(*) FROM new_rows
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, -count(*) FROM old_rows
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    ELSE
+        INSERT INTO user_counters AS c (user_id, items_count)
+        SELECT user_id, sum(delta) FROM (
+            SELECT user_id, -1 AS delta FROM old_rows
+            UNION ALL
+            SELECT user_id, 1 AS delta FROM new_rows
+        ) AS deltas
+        GROUP BY user_id HAVING sum(delta) <> 0 ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET items_count = c.items_count + EXCLUDED.items_count;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# Pending sendings of an item go when the item is deleted rather than when
+# it is compacted, so that they can no longer be confirmed. The sendings of
+# most items are none, found with one probe of ix_sendings_item_id.
+ITEMS_TOMBSTONE_SENDINGS_FUNCTION = '''
+CREATE FUNCTION items_tombstone_sendings() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM sendings WHERE item_id IN (
+        SELECT id FROM new_rows WHERE deleted_at IS NOT NULL
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# FOR SHARE instead of FOR KEY SHARE: setting deleted_at is not a key update,
+# and a sending must not slip in while its item is being deleted.
+SENDINGS_CHECK_ITEM_FUNCTION = '''
+CREATE OR REPLACE FUNCTION sendings_check_item() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM items WHERE id = NEW.item_id AND deleted_at IS NULL FOR SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'item % of sending does not exist', NEW.item_id
+        USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+'''
+
+SENDINGS_CHECK_ITEM_FUNCTION_BEFORE = '''
+CREATE OR REPLACE FUNCTION sendings_check_item() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM items WHERE id = NEW.item_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'item % of sending does not exist', NEW.item_id
+        USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# Queries of live items read partial indexes that leave tombstones out; the
+# compactor finds tombstones in one that holds nothing else.
+PARTIAL_INDEXES = [
+    ('ix_items_user_id_id', 'user_id, id', 'deleted_at IS NULL'),
+    ('ix_items_user_id_name_id_live', 'user_id, name, id', 'deleted_at IS NULL'),
+    ('ix_items_deleted_at', 'deleted_at', 'deleted_at IS NOT NULL'),
+]
+
+
+def has_pg_trgm():
+    return op.get_bind().execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    ).scalar()
+
+
+def create_partitioned_index(name, columns, where):
+    # An index on the partitioned table alone, then one per partition built
+    # concurrently and attached, so that items stay writable meanwhile.
+    op.execute(f'CREATE INDEX {name} ON ONLY items ({columns}) WHERE {where}')
+    partitions = op.get_bind().execute(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'items'::regclass"
+    ).fetchall()
+    for partition, in partitions:
+        with op.get_context().autocommit_block():
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{name} '
+                f'ON {partition} ({columns}) WHERE {where}'
+            )
+        op.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition}_{name}')
+
+
+def upgrade():
+    op.execute('ALTER TABLE items ADD COLUMN deleted_at timestamp')
+    op.execute(ITEMS_COUNTERS_FUNCTION)
+    op.execute(SENDINGS_CHECK_ITEM_FUNCTION)
+    op.execute(ITEMS_TOMBSTONE_SENDINGS_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER items_tombstone_sendings AFTER UPDATE ON items '
+        'REFERENCING NEW TABLE AS new_rows '
+        'FOR EACH STATEMENT EXECUTE PROCEDURE items_tombstone_sendings()'
+    )
+
+    for name, columns, where in PARTIAL_INDEXES:
+        create_partitioned_index(name, columns, where)
+    op.execute('DROP INDEX ix_items_user_id_name_id')
+    op.execute('ALTER INDEX ix_items_user_id_name_id_live RENAME TO ix_items_user_id_name_id')
+    if has_pg_trgm():
+        op.execute('DROP INDEX ix_items_name_trgm')
+        op.execute(
+            'CREATE INDEX ix_items_name_trgm ON items USING gin (name gin_trgm_ops) '
+            'WHERE deleted_at IS NULL'
+        )
+
+
+def downgrade():
+    # Compacting the tombstones leaves counters as they are.
+    op.execute('DELETE FROM items WHERE deleted_at IS NOT NULL')
+
+    if has_pg_trgm():
+        op.execute('DROP INDEX ix_items_name_trgm')
+        op.execute('CREATE INDEX ix_items_name_trgm ON items USING gin (name gin_trgm_ops)')
+    op.execute('DROP INDEX ix_items_deleted_at')
+    op.execute('DROP INDEX ix_items_user_id_id')
+    op.execute('DROP INDEX ix_items_user_id_name_id')
+    op.execute('CREATE INDEX ix_items_user_id_name_id ON items (user_id, name, id)')
+
+    op.execute('DROP TRIGGER items_tombstone_sendings ON items')
+    op.execute('DROP FUNCTION items_tombstone_sendings()')
+    op.execute(SENDINGS_CHECK_ITEM_FUNCTION_BEFORE)
+    op.execute(ITEMS_COUNTERS_FUNCTION_BEFORE)
+    op.execute('ALTER TABLE items DROP COLUMN deleted_at')
@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import logging
+from typing import Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_STOP = object()
+
+
+class WriteBatcher(Generic[T, R]):
+    """
+    Collects rows submitted within `window` seconds (or until `max_size` rows
+    are pending) and writes them with a single `flush` call. `flush` receives
+    the rows in submission order and must return one result per row.
+
+    `flush` runs in an empty context rather than in that of the submission
+    that started it, so that it does not use the connection of a request
+    (see `RequestConnection`), which may end before the flush does.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[T]], Awaitable[List[R]]],
+        window: float,
+        max_size: int,
+    ):
+        self.name = name
+        self.window = window
+        self.max_size = max_size
+        self._flush = flush
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: List[asyncio.Task] = []
+
+    async def submit(self, row: T) -> R:
+        loop = asyncio.get_event_loop()
+        result = loop.create_future()
+        self._pending.append((row, result))
+
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+
+        return await result
+
+    async def flush(self) -> None:
+        """
+        Write everything pending right away and wait for running flushes.
+        """
+        self._start_flush()
+        while self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = contextvars.Context().run(asyncio.ensure_future, self._write(batch))
+            self._flushing.append(task)
+            task.add_done_callback(self._flushing.remove)
+
+    async def _write(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        metrics.increment(f'batching.{self.name}.batches')
+        metrics.observe(f'batching.{self.name}.batch_size', len(batch))
+        try:
+            results = await self._flush([row for row, _ in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                _set_exception(batch[0][1], exc)
+                return
+            # One bad row must not fail the whole batch: write rows one by
+            # one so that every caller gets its own result or error.
+            metrics.increment(f'batching.{self.name}.fallbacks')
+            for entry in batch:
+                await self._write([entry])
+            return
+
+        for (_, result), value in zip(batch, results):
+            if not result.done():
+                result.set_result(value)
+
+
+class WriteBehindQueue(Generic[T]):
+    """
+    Buffers rows in memory and writes them in the background, in batches of
+    up to `batch_size` rows collected for at most `interval` seconds.
+
+    Durability trade-off: a row is only in memory until its batch has been
+    written, so rows accepted by `put` are lost if the process dies before
+    that (at most `max_pending` + `batch_size` rows). `close` writes everything
+    that is still buffered on a graceful shutdown.
+
+    At most `max_pending` rows are buffered; `put` waits for the writer when
+    the buffer is full. Until `start` is called rows are written right away.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[T]], Awaitable[None]],
+        batch_size: int,
+        interval: float,
+        max_pending: int,
+        retries: int = 3,
+    ):
+        self.name = name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.retries = retries
+        self._flush = flush
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._worker = asyncio.ensure_future(self._run())
+        self._closing = False
+
+    async def close(self) -> None:
+        """
+        Write everything buffered and stop the background writer.
+        """
+        if self._worker is None:
+            return
+
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._worker
+        self._queue = self._worker = None
+
+    async def put(self, row: T) -> None:
+        if self._queue is None or self._closing:
+            await self._write([row])
+            return
+
+        if self._queue.full():
+            metrics.increment(f'write_behind.{self.name}.waits')
+        await self._queue.put(row)
+        metrics.set_value(f'write_behind.{self.name}.pending', self._queue.qsize())
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is _STOP:
+                return
+            if self._queue.qsize() + 1 < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+            batch = [row]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            metrics.set_value(f'write_behind.{self.name}.pending', self._queue.qsize())
+
+            await self._write(batch)
+
+    async def _write(self, batch: List[T]) -> None:
+        for attempt in range(self.retries):
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.warning(
+                    'Writing %s rows to %s failed', len(batch), self.name, exc_info=True
+                )
+                await asyncio.sleep(0.1 * 2 ** attempt)
+            else:
+                metrics.increment(f'write_behind.{self.name}.batches')
+                metrics.increment(f'write_behind.{self.name}.rows', len(batch))
+                return
+
+        if len(batch) > 1:
+            # Find the rows that cannot be written instead of dropping all of them.
+            for row in batch:
+                await self._write([row])
+            return
+
+        metrics.increment(f'write_behind.{self.name}.dropped')
+        logger.error('Dropped a row of %s: %r', self.name, batch[0])
+
+
+class PeriodicTask:
+    """
+    Calls `run` every `interval` seconds in the background until closed, the
+    first time after `delay` seconds (`interval` by default). Failures are
+    logged and counted; the next call comes all the same.
+    """
+
+    def __init__(
+        self, name: str, run: Callable[[], Awaitable[None]], interval: float, delay: Optional[float] = None
+    ):
+        self.name = name
+        self.interval = interval
+        self.delay = delay
+        self._run_once = run
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        delay = self.interval if self.delay is None else self.delay
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            try:
+                await self._run_once()
+            except Exception:
+                metrics.increment(f'periodic.{self.name}.failures')
+                logger.warning('Running %s failed', self.name, exc_info=True)
+
+
+def _set_exception(result: asyncio.Future, exc: Exception) -> None:
+    if not result.done():
+        result.set_exception(exc)
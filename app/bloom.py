@@ -0,0 +1,55 @@
+import hashlib
+import math
+from typing import Iterator
+
+
+class BloomFilter:
+    """
+    Set of strings that answers "maybe" or "definitely not": `key in filter`
+    is True for every added key and, for keys that were not added, False
+    except for about `error_rate` of them while at most `capacity` keys have
+    been added. Keys cannot be removed.
+
+    Takes -capacity * ln(error_rate) / ln(2)^2 bits, about 1.2 MB for a
+    million keys at 1%, and ln(2) * bits / capacity hashes per key, which
+    are derived from one BLAKE2b digest.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    @property
+    def size(self) -> int:
+        return len(self._array)
+
+    def add(self, key: str) -> None:
+        added = False
+        for position in self._positions(key):
+            if not self._array[position >> 3] & (1 << (position & 7)):
+                self._array[position >> 3] |= 1 << (position & 7)
+                added = True
+        # Keys added again are not counted, nor are the few that look added.
+        if added:
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_error_rate(self) -> float:
+        """
+        The false positive rate after `count` additions, which exceeds
+        `error_rate` once the filter holds more than `capacity` keys.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def _positions(self, key: str) -> Iterator[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        # Never 0, so that the hashes of a key differ.
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.bits for i in range(self.hashes))
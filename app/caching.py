@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, Set, Tuple, TypeVar
+
+from app import metrics
+
+V = TypeVar('V')
+
+
+class UserCache(Generic[V]):
+    """
+    In-process LRU cache of encoded values per user, bounded by the total size
+    of the values in bytes rather than by the number of entries. Entries
+    older than `ttl` seconds (if set) are treated as missing; this bounds how
+    long writes made by other processes go unnoticed.
+
+    To avoid caching a value read before a concurrent write, read
+    `generation(user_id)` before querying and pass it to `put`: values of a
+    user invalidated in between are not stored. Only the last
+    `max_invalidations` invalidations are remembered per user; values read
+    before older ones are not stored for any user.
+    """
+
+    def __init__(
+        self, name: str, max_bytes: int, ttl: Optional[float] = None, max_invalidations: int = 10000,
+    ):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_invalidations = max_invalidations
+        self.size = 0
+        self._entries: 'OrderedDict[Tuple[int, Hashable], Tuple[V, int, float]]' = OrderedDict()
+        self._keys: Dict[int, Set[Hashable]] = {}
+        # Invalidations are numbered; the number of the last one of each
+        # recently invalidated user, oldest first, and the last number that
+        # was forgotten.
+        self._generation = 0
+        self._invalidations: 'OrderedDict[int, int]' = OrderedDict()
+        self._forgotten = 0
+
+    def get(self, user_id: int, key: Hashable) -> Optional[V]:
+        entry = self._entries.get((user_id, key))
+        if entry is None or (self.ttl and time.monotonic() - entry[2] > self.ttl):
+            metrics.increment(f'cache.{self.name}.misses')
+            return None
+
+        self._entries.move_to_end((user_id, key))
+        metrics.increment(f'cache.{self.name}.hits')
+        return entry[0]
+
+    def generation(self, user_id: int) -> int:
+        return self._generation
+
+    def put(self, user_id: int, key: Hashable, value: V, size: int, generation: int) -> None:
+        if (
+            size > self.max_bytes
+            or generation < self._forgotten
+            or generation < self._invalidations.get(user_id, 0)
+        ):
+            return
+
+        self._remove((user_id, key))
+        self._entries[(user_id, key)] = (value, size, time.monotonic())
+        self._keys.setdefault(user_id, set()).add(key)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            (evicted_user_id, evicted_key), _ = next(iter(self._entries.items()))
+            self._remove((evicted_user_id, evicted_key))
+            metrics.increment(f'cache.{self.name}.evictions')
+        metrics.set_value(f'cache.{self.name}.bytes', self.size)
+
+    def invalidate(self, *user_ids: int) -> None:
+        # Nothing is stored while the cache is disabled.
+        if not self.max_bytes and not self._entries:
+            return
+
+        for user_id in user_ids:
+            self._generation += 1
+            self._invalidations.pop(user_id, None)
+            self._invalidations[user_id] = self._generation
+            for key in list(self._keys.get(user_id, ())):
+                self._remove((user_id, key))
+        while len(self._invalidations) > self.max_invalidations:
+            _, self._forgotten = self._invalidations.popitem(last=False)
+        metrics.set_value(f'cache.{self.name}.bytes', self.size)
+
+    def clear(self) -> None:
+        for user_id in list(self._keys):
+            self.invalidate(user_id)
+
+    def _remove(self, entry_key: Tuple[int, Any]) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+
+        user_id, key = entry_key
+        self.size -= entry[1]
+        keys = self._keys[user_id]
+        keys.discard(key)
+        if not keys:
+            del self._keys[user_id]
@@ -0,0 +1,75 @@
+"""
+Deletion of the tombstones that `ItemModel.delete_many` leaves in `items`:
+
+    DB_URI=postgresql://... python -m app.compaction --batch-size 1000 --pause 0.1
+
+compacts the database or, with DB_SHARD_URIS, every shard. The application
+does the same in the background, see ITEMS_COMPACTION_INTERVAL. Every batch
+is a transaction of its own and skips rows locked by another compactor, so
+several processes can compact at the same time. Counters only count live
+items and the pending sendings of an item are deleted with it, so compaction
+changes nothing that can be read.
+"""
+import argparse
+import asyncio
+import time
+from databases import Database
+
+from app import metrics, settings
+from .sharding import shard_databases
+
+COMPACT_BATCH_QUERY = '''
+WITH compacted AS (
+    DELETE FROM items
+    WHERE (user_id, id) IN (
+        SELECT user_id, id FROM items
+        WHERE deleted_at IS NOT NULL
+        ORDER BY deleted_at
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING 1
+)
+SELECT count(*) FROM compacted
+'''
+
+
+async def compact(database: Database, batch_size: int = 1000, pause: float = 0.0) -> int:
+    """
+    Delete the tombstones of `database`, oldest first, `batch_size` rows at a
+    time with `pause` seconds between batches, and return their number.
+    """
+    compacted = 0
+    while True:
+        rows = await database.fetch_val(COMPACT_BATCH_QUERY, {'batch_size': batch_size})
+        compacted += rows
+        metrics.increment('compaction.items.rows', rows)
+        if rows < batch_size:
+            return compacted
+
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=settings.ITEMS_COMPACTION_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=settings.ITEMS_COMPACTION_PAUSE)
+    args = parser.parse_args()
+
+    databases = shard_databases()
+    for database in databases:
+        await database.connect()
+    try:
+        started = time.perf_counter()
+        compacted = 0
+        for database in databases:
+            compacted += await compact(database, args.batch_size, args.pause)
+        print(f'Deleted {compacted} items in {time.perf_counter() - started:.1f} s')
+    finally:
+        for database in databases:
+            await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
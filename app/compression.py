@@ -0,0 +1,237 @@
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class Compressor(ABC):
+    """
+    Compresses a body chunk by chunk. `compress` returns everything that can
+    be decoded so far, so that a streamed chunk reaches the client right
+    away; `finish` ends the stream.
+    """
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        ...
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+# Encodings whose library is installed.
+COMPRESSORS: Dict[str, Callable[[int], Compressor]] = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+def negotiate(accept_encoding: str, encodings: Sequence[str]) -> Optional[str]:
+    """
+    Pick the encoding for an Accept-Encoding header: the one with the highest
+    q-value, the first of `encodings` among equals. `*` stands for the
+    encodings that are not listed.
+    """
+    weights: Dict[str, float] = {}
+    for entry in accept_encoding.split(','):
+        name, _, params = entry.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with gzip, br or zstd as negotiated by the
+    Accept-Encoding header. Streamed responses are compressed chunk by chunk.
+    Nothing is compressed until `minimum_size` bytes of the body are known,
+    so short responses are sent as they are. Responses to requests with
+    Accept-Encoding vary on it, compressed or not.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: Sequence[str] = ('br', 'zstd', 'gzip'),
+        minimum_size: int = 1024,
+        levels: Optional[Mapping[str, int]] = None,
+    ) -> None:
+        self.app = app
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        self.minimum_size = minimum_size
+        self.levels = {'gzip': 6, 'br': 4, 'zstd': 3, **(levels or {})}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http':
+            headers = Headers(scope=scope)
+            if 'accept-encoding' in headers:
+                encoding = negotiate(headers['Accept-Encoding'], self.encodings)
+                if encoding is None:
+                    await self.app(scope, receive, varying_send(send))
+                    return
+                responder = CompressionResponder(
+                    self.app, encoding, self.levels[encoding], self.minimum_size
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, level: int, minimum_size: int) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.send: Send = unattached_send
+        self.initial_message: Message = {}
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            # Headers are sent with the first part of the body, once it is
+            # known whether the body is compressed.
+            self.initial_message = message
+            headers = MutableHeaders(raw=message['headers'])
+            headers.add_vary_header('Accept-Encoding')
+            self.passthrough = 'content-encoding' in headers
+            return
+
+        if message['type'] != 'http.response.body' or self.passthrough:
+            if self.initial_message:
+                await self.send(self.initial_message)
+                self.initial_message = {}
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            self.pending.append(body)
+            self.pending_size += len(body)
+            if self.pending_size < self.minimum_size:
+                if more_body:
+                    return
+                # The whole body is short: send it uncompressed.
+                message['body'] = b''.join(self.pending)
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            self.start(streaming=more_body)
+            body = b''.join(self.pending)
+            self.pending = []
+
+        if more_body:
+            compressed = self.compressor.compress(body)
+        else:
+            compressed = self.compressor.compress(body) + self.compressor.finish()
+        metrics.increment(f'compression.{self.encoding}.bytes_in', len(body))
+        metrics.increment(f'compression.{self.encoding}.bytes_out', len(compressed))
+
+        if self.initial_message:
+            if not more_body:
+                MutableHeaders(raw=self.initial_message['headers'])['Content-Length'] = (
+                    str(len(compressed))
+                )
+            await self.send(self.initial_message)
+            self.initial_message = {}
+        message['body'] = compressed
+        await self.send(message)
+
+    def start(self, streaming: bool) -> None:
+        self.compressor = COMPRESSORS[self.encoding](self.level)
+        metrics.increment(f'compression.{self.encoding}.responses')
+
+        headers = MutableHeaders(raw=self.initial_message['headers'])
+        headers['Content-Encoding'] = self.encoding
+        if streaming and 'content-length' in headers:
+            del headers['Content-Length']
+
+
+def varying_send(send: Send) -> Send:
+    async def send_varying(message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            MutableHeaders(raw=message['headers']).add_vary_header('Accept-Encoding')
+        await send(message)
+
+    return send_varying
+
+
+async def unattached_send(message: Message) -> None:
+    raise RuntimeError('send awaitable not set')  # pragma: no cover
@@ -0,0 +1,213 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from databases import Database
+from databases.core import Connection, Transaction
+from types import TracebackType
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Mapping, Optional, Type, Union
+
+from app import deadlines, metrics, settings
+
+
+async def set_statement_timeout(connection: Connection, local: bool = False) -> None:
+    """
+    Set what is left of the deadline as statement_timeout of `connection`, for
+    the current transaction only if `local`. The pool resets the setting when
+    the connection is released.
+    """
+    timeout = deadlines.statement_timeout()
+    if timeout is not None:
+        await connection.execute(f'SET {"LOCAL " if local else ""}statement_timeout = {timeout}')
+
+
+class TimedConnection(Connection):
+    """
+    Records the time spent waiting for the pool in `db.pool.wait`. Its count
+    is the number of connections checked out. Checked out for a query with a
+    deadline but without a `RequestConnection` (DB_REQUEST_CONNECTION=0), the
+    connection times out with the deadline.
+    """
+
+    async def __aenter__(self) -> 'TimedConnection':
+        if self._connection_counter:
+            return await super().__aenter__()
+
+        started = time.perf_counter()
+        connection = await super().__aenter__()
+        metrics.observe('db.pool.wait', time.perf_counter() - started)
+        if _request_connections.get() is None:
+            try:
+                await set_statement_timeout(connection)
+            except BaseException:
+                await super().__aexit__()
+                raise
+        return connection
+
+
+class InstrumentedDatabase(Database):
+    def connection(self) -> Connection:
+        # Same as `Database.connection`, with a `TimedConnection` per task.
+        if self._global_connection is not None:
+            return self._global_connection
+
+        try:
+            return self._connection_context.get()
+        except LookupError:
+            connection = TimedConnection(self._backend)
+            self._connection_context.set(connection)
+            return connection
+
+
+class RequestConnection:
+    """
+    A pool connection checked out on first use and kept until the end of the
+    request, so that all model calls of a request share it instead of
+    checking out a connection each. Offers the query methods of `Database`.
+    Queries of a request with a deadline time out with what was left of it
+    when the connection was checked out or when the transaction they run in
+    started.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self._connection: Optional[Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> Connection:
+        async with self._lock:
+            if self._connection is None:
+                connection = self.database.connection()
+                await connection.__aenter__()
+                self._connection = connection
+                await set_statement_timeout(connection)
+        return self._connection
+
+    async def release(self) -> None:
+        async with self._lock:
+            if self._connection is not None:
+                await self._connection.__aexit__()
+                self._connection = None
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        # Entering the connection once more keeps it checked out while a task
+        # other than the request's, e.g. a streamed body, still uses it.
+        connection = await self.acquire()
+        async with connection:
+            yield connection
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> List[Mapping]:
+        async with self.connection() as connection:
+            return await connection.fetch_all(query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Optional[Mapping]:
+        async with self.connection() as connection:
+            return await connection.fetch_one(query, values)
+
+    async def fetch_val(self, query: Any, values: Optional[dict] = None, column: Any = 0) -> Any:
+        async with self.connection() as connection:
+            return await connection.fetch_val(query, values, column=column)
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        async with self.connection() as connection:
+            return await connection.execute(query, values)
+
+    async def execute_many(self, query: Any, values: list) -> None:
+        async with self.connection() as connection:
+            await connection.execute_many(query, values)
+
+    async def iterate(self, query: Any, values: Optional[dict] = None) -> AsyncGenerator[Mapping, None]:
+        async with self.connection() as connection:
+            async for record in connection.iterate(query, values):
+                yield record
+
+    def transaction(self, **options: Any) -> 'RequestTransaction':
+        return RequestTransaction(self, options)
+
+
+class RequestTransaction:
+    """
+    A transaction on a `RequestConnection`. Like `Database.transaction()` it
+    is used as `async with` block or started with `await`.
+    """
+
+    def __init__(self, request_connection: RequestConnection, options: Mapping[str, Any]):
+        self._request_connection = request_connection
+        self._options = options
+        self._transaction: Optional[Transaction] = None
+
+    async def start(self) -> Transaction:
+        connection = await self._request_connection.acquire()
+        self._transaction = connection.transaction(**self._options)
+        transaction = await self._transaction.start()
+        await set_statement_timeout(connection, local=True)
+        return transaction
+
+    def __await__(self) -> Any:
+        return self.start().__await__()
+
+    async def __aenter__(self) -> Transaction:
+        return await self.start()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]] = None,
+        exc_value: Optional[BaseException] = None,
+        traceback: Optional[TracebackType] = None,
+    ) -> None:
+        await self._transaction.__aexit__(exc_type, exc_value, traceback)
+
+
+@asynccontextmanager
+async def locked_raw_connection(connection: Connection) -> AsyncIterator[Any]:
+    """
+    The asyncpg connection of `connection`, for what `Connection` does not
+    offer (COPY), held like a query for the block: other tasks that share
+    `connection` wait instead of failing with "another operation is in
+    progress".
+    """
+    # The lock of `Connection`'s own query methods; `databases` has no public
+    # way to hold it.
+    async with connection._query_lock:
+        yield connection.raw_connection
+
+
+_request_connections: ContextVar[Optional[Dict[Database, RequestConnection]]] = ContextVar(
+    'request_connections', default=None
+)
+
+
+def current_database(database: Optional[Database] = None) -> Union[Database, RequestConnection]:
+    """
+    The connection of the current request to `database`, the directory
+    database by default, if there is a request; the pool otherwise.
+    """
+    if database is None:
+        database = settings.database
+    connections = _request_connections.get()
+    if connections is None:
+        return database
+
+    connection = connections.get(database)
+    if connection is None:
+        connection = connections[database] = RequestConnection(database)
+    return connection
+
+
+async def request_connection() -> AsyncIterator[Optional[Dict[Database, RequestConnection]]]:
+    """
+    Dependency that makes the model calls of a request share one connection
+    per database.
+    """
+    if not settings.DB_REQUEST_CONNECTION:
+        yield None
+        return
+
+    connections: Dict[Database, RequestConnection] = {}
+    token = _request_connections.set(connections)
+    try:
+        yield connections
+    finally:
+        _request_connections.reset(token)
+        await asyncio.gather(*[connection.release() for connection in connections.values()])
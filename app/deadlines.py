@@ -0,0 +1,115 @@
+"""
+Per-route deadlines, see REQUEST_DEADLINE and ROUTE_DEADLINES.
+
+A handler, its dependencies included, is cancelled when the deadline of its
+route passes and the client gets 504. Cancelling a handler cancels the query
+it waits for, which asyncpg cancels on the server too. Postgres is also told
+the remaining budget as statement_timeout whenever the request checks out a
+connection and when it starts a transaction, so that it gives up on its own.
+Queries that follow on a connection the request keeps have the budget of the
+checkout or of the transaction start, never less than what is left.
+"""
+import asyncio
+import asyncpg
+import math
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from typing import Any, Callable, Coroutine, Iterator, Optional
+
+from app import metrics, settings
+
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Set the deadline of the current task `seconds` from now, unless an
+    earlier one is set already.
+    """
+    at = asyncio.get_event_loop().time() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the deadline, None without one."""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return max(at - asyncio.get_event_loop().time(), 0.0)
+
+
+def statement_timeout() -> Optional[int]:
+    """
+    The remaining budget in milliseconds, rounded up so that Postgres does not
+    give up before the deadline, and at least 1 since 0 disables the timeout.
+    """
+    seconds = remaining()
+    if seconds is None:
+        return None
+    return max(math.ceil(seconds * 1000), 1)
+
+
+def route_deadline(name: str) -> float:
+    return settings.ROUTE_DEADLINES.get(name, settings.REQUEST_DEADLINE)
+
+
+class DeadlineRoute(APIRoute):
+    """
+    Route that answers 504 once its deadline has passed and counts those
+    requests in `deadline.{route name}.expired`.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def deadline_handler(request: Request) -> Response:
+            seconds = route_deadline(self.name)
+            if not seconds:
+                return await handler(request)
+
+            # The handler is cancelled in its own task rather than run in
+            # another one by `asyncio.wait_for`, so that context variables its
+            # dependencies set are still theirs when they are torn down.
+            task = asyncio.current_task()
+            expired = False
+
+            def expire() -> None:
+                nonlocal expired
+                expired = True
+                task.cancel()
+
+            timer = asyncio.get_event_loop().call_later(seconds, expire)
+            try:
+                with deadline(seconds):
+                    response = await handler(request)
+                    if expired:
+                        # The handler finished after the task was cancelled;
+                        # the cancellation is raised at the next await.
+                        await asyncio.sleep(0)
+                    return response
+            except asyncio.CancelledError:
+                if not expired:
+                    raise
+            except asyncpg.QueryCanceledError:
+                # statement_timeout may fire just before the timer.
+                if asyncio.get_event_loop().time() < timer.when():
+                    raise
+            finally:
+                timer.cancel()
+
+            metrics.increment(f'deadline.{self.name}.expired')
+            return JSONResponse(
+                {'detail': 'Deadline exceeded'}, status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            )
+
+        return deadline_handler
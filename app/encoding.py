@@ -0,0 +1,113 @@
+"""
+MessagePack as an alternative to JSON on the item endpoints, chosen by the
+`Accept` header for responses and by `Content-Type` for request bodies.
+Without the optional `msgpack` package the endpoints speak JSON only.
+"""
+import json
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+# Media types clients use for MessagePack, which has no registered one.
+MSGPACK_ALIASES = (MSGPACK, 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+def _media_type(value: str) -> str:
+    return value.split(';', 1)[0].strip().lower()
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return msgpack is not None and bool(content_type) and _media_type(content_type) in MSGPACK_ALIASES
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    MSGPACK if msgpack is installed and `accept` prefers it to JSON, JSON
+    otherwise. More specific media ranges take precedence, as in RFC 7231.
+    """
+    if msgpack is None or not accept:
+        return JSON
+
+    qualities: Dict[str, float] = {}
+    for media_range in accept.split(','):
+        media_type, *params = media_range.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[_media_type(media_type)] = quality
+
+    def quality_of(*media_types: str) -> float:
+        for candidates in (media_types, ('application/*',), ('*/*',)):
+            found = [qualities[media_type] for media_type in candidates if media_type in qualities]
+            if found:
+                return max(found)
+        return 0.0
+
+    return MSGPACK if quality_of(*MSGPACK_ALIASES) > quality_of(JSON) else JSON
+
+
+def encode(content: Any, media_type: str) -> bytes:
+    """Encode plain data (dicts, lists, strings, numbers) as `media_type`."""
+    if media_type == MSGPACK:
+        return msgpack.packb(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class MessagePackResponse(Response):
+    media_type = MSGPACK
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+
+class MessagePackRequest(Request):
+    """
+    A request with a MessagePack body, which FastAPI reads with `json()`
+    like a JSON body.
+    """
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            try:
+                self._json = msgpack.unpackb(await self.body())
+            except ValueError as exc:
+                raise json.JSONDecodeError(f'Invalid MessagePack: {exc}', '', 0)
+        return self._json
+
+
+class MessagePackRoute(APIRoute):
+    """
+    Route that accepts MessagePack request bodies wherever it accepts JSON
+    ones; the body is validated against the same models.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def msgpack_handler(request: Request) -> Response:
+            if not is_msgpack(request.headers.get('content-type')):
+                return await handler(request)
+
+            # FastAPI only parses bodies it takes for JSON.
+            headers = [
+                (name, value) for name, value in request.scope['headers'] if name != b'content-type'
+            ]
+            headers.append((b'content-type', JSON.encode()))
+            scope = dict(request.scope, headers=headers)
+            return await handler(MessagePackRequest(scope, request.receive))
+
+        return msgpack_handler
@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Iterable, List, Mapping, Sequence
+
+from .encoding import MSGPACK, msgpack
+from .schemas import DataFormat
+
+MEDIA_TYPES = {
+    DataFormat.CSV: 'text/csv',
+    DataFormat.NDJSON: 'application/x-ndjson',
+    DataFormat.MSGPACK: MSGPACK,
+}
+
+
+def encode_csv(rows: Iterable[Sequence[Any]], quoting: int = csv.QUOTE_MINIMAL) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=quoting).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows: Iterable[Mapping[str, Any]]) -> bytes:
+    return ''.join(f'{json.dumps(dict(row))}\n' for row in rows).encode()
+
+
+def encode_msgpack(rows: Iterable[Mapping[str, Any]]) -> bytes:
+    packer = msgpack.Packer()
+    return b''.join(packer.pack(dict(row)) for row in rows)
+
+
+async def encode_chunks(
+    chunks: AsyncIterator[List[Mapping[str, Any]]],
+    format_: DataFormat,
+    columns: Sequence[str],
+) -> AsyncIterator[bytes]:
+    """
+    Encode chunks of rows one by one. CSV output starts with a header row;
+    MessagePack output is a sequence of maps, one per row.
+    """
+    if format_ == DataFormat.CSV:
+        yield encode_csv([columns])
+
+    async for rows in chunks:
+        if format_ == DataFormat.CSV:
+            yield encode_csv(row.values() for row in rows)
+        elif format_ == DataFormat.MSGPACK:
+            yield encode_msgpack(rows)
+        else:
+            yield encode_ndjson(rows)
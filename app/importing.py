@@ -0,0 +1,126 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from .encoding import msgpack
+from .schemas import DataFormat
+
+
+class ImportFormatError(Exception):
+    """
+    The body cannot be read any further, e.g. it is not UTF-8.
+    """
+
+
+class LineParser:
+    """
+    Parses an uploaded body line by line into item names. Lines that cannot
+    be parsed are skipped and recorded in `errors` (at most `max_errors` of
+    them, `rejected` counts all). A MessagePack body is a sequence of maps,
+    numbered like lines.
+    """
+
+    def __init__(self, format_: DataFormat, max_line_length: int, max_errors: int):
+        self.format = format_
+        self.max_line_length = max_line_length
+        self.max_errors = max_errors
+        self.errors: List[Tuple[int, str]] = []
+        self.rejected = 0
+        self._name_column = None
+
+    async def names(self, body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+        if self.format == DataFormat.MSGPACK:
+            async for name in self._unpack(body):
+                yield name
+            return
+
+        async for line_number, line in self._lines(body):
+            if not line.strip():
+                continue
+            try:
+                name = self._parse(line)
+            except ValueError as exc:
+                self._reject(line_number, str(exc))
+            else:
+                if name is not None:
+                    yield name
+
+    async def _lines(self, body: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        line_number = 0
+        pending = ''
+        try:
+            async for chunk in body:
+                pending += decoder.decode(chunk)
+                *lines, pending = pending.split('\n')
+                for line in lines:
+                    line_number += 1
+                    yield line_number, line.rstrip('\r')
+                if len(pending) > self.max_line_length:
+                    raise ImportFormatError(f'Line {line_number + 1} is too long')
+            pending += decoder.decode(b'', final=True)
+        except UnicodeDecodeError as exc:
+            valid = exc.object[:exc.start].decode(errors='ignore')
+            invalid_line_number = line_number + valid.count('\n') + 1
+            raise ImportFormatError(f'Line {invalid_line_number} is not valid UTF-8')
+
+        if pending:
+            yield line_number + 1, pending.rstrip('\r')
+
+    async def _unpack(self, body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+        unpacker = msgpack.Unpacker(max_str_len=self.max_line_length)
+        number = 0
+        received = 0
+        try:
+            async for chunk in body:
+                unpacker.feed(chunk)
+                received += len(chunk)
+                for row in unpacker:
+                    number += 1
+                    try:
+                        if not isinstance(row, dict):
+                            raise ValueError('Expected a MessagePack map')
+                        name = _validate_name(row.get('name'))
+                    except ValueError as exc:
+                        self._reject(number, str(exc))
+                    else:
+                        yield name
+        except ValueError:
+            raise ImportFormatError(f'Line {number + 1} is not valid MessagePack')
+
+        if unpacker.tell() != received:
+            raise ImportFormatError(f'Line {number + 1} is incomplete')
+
+    def _parse(self, line: str) -> Optional[str]:
+        if self.format == DataFormat.NDJSON:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError('Invalid JSON')
+            if not isinstance(row, dict):
+                raise ValueError('Expected a JSON object')
+            return _validate_name(row.get('name'))
+
+        fields = next(csv.reader([line]))
+        if self._name_column is None:
+            if 'name' not in fields:
+                raise ImportFormatError('The CSV header has no name column')
+            self._name_column = fields.index('name')
+            return None
+        if len(fields) <= self._name_column:
+            raise ValueError('Missing name column')
+        return _validate_name(fields[self._name_column])
+
+    def _reject(self, line_number: int, detail: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, detail))
+
+
+def _validate_name(name: object) -> str:
+    if not isinstance(name, str) or not name:
+        raise ValueError('Name must be a non-empty string')
+    if '\x00' in name:
+        raise ValueError('Name must not contain NUL characters')
+    return name
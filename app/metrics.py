@@ -0,0 +1,33 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, Union
+
+Number = Union[int, float]
+
+_values: DefaultDict[str, Number] = defaultdict(int)
+
+
+def increment(name: str, value: Number = 1) -> None:
+    _values[name] += value
+
+
+def set_value(name: str, value: Number) -> None:
+    _values[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    _values[f'{name}.count'] += 1
+    _values[f'{name}.sum'] += value
+    if value > _values.get(f'{name}.max', 0):
+        _values[f'{name}.max'] = value
+
+
+def get(name: str) -> Number:
+    return _values.get(name, 0)
+
+
+def snapshot() -> Dict[str, Number]:
+    return dict(sorted(_values.items()))
+
+
+def reset() -> None:
+    _values.clear()
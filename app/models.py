@@ -1,14 +1,40 @@
+import asyncio
+import csv
 import hashlib
+import logging
 import sqlalchemy
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from enum import Enum
-from sqlalchemy import ForeignKey, and_, select
+from sqlalchemy import ForeignKey, and_, any_, bindparam, select, tuple_, union_all
+from databases import Database
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
-from typing import Any, List, Mapping, Optional
+from sqlalchemy.sql import Select
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
 
-from app import settings
-from .schemas import ItemSchema
+from app import metrics, settings
+from .batching import PeriodicTask, WriteBatcher, WriteBehindQueue
+from .bloom import BloomFilter
+from .caching import UserCache
+from .compaction import compact
+from .connections import current_database, locked_raw_connection
+from .encoding import JSON, encode
+from .export import encode_csv
+from .outbox import OutboxDispatcher, WebhookSender
+from .pagination import decode_cursor, encode_cursor
+from .sharding import is_sharded, shard, shard_database, shard_databases
+from .schemas import (
+    ItemSchema,
+    ItemSort,
+    PendingSendingSchema,
+    SearchMode,
+    SendingDirection,
+    TransferEventSchema,
+)
+from .singleflight import single_flight
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -40,13 +66,37 @@ class UserModel:
     @classmethod
     async def create(cls, login: str, password: str) -> int:
         insert_user_query = users.insert().values(login=login, password=password)
-        user_id = await settings.database.execute(insert_user_query)
+        if not is_sharded():
+            user_id = await current_database().execute(insert_user_query)
+            login_filter.add(login)
+            return user_id
+
+        # Shards only need the id for their foreign keys. The directory
+        # commits the user once every shard has it, so that a failed
+        # registration can be retried.
+        async with current_database().transaction():
+            user_id = await current_database().execute(insert_user_query)
+            insert_placeholder_query = (
+                pg_insert(users)
+                .values(id=user_id, login=str(user_id), password='')
+                .on_conflict_do_nothing(index_elements=[users.c.id])
+            )
+            await asyncio.gather(*[
+                current_database(database).execute(insert_placeholder_query)
+                for database in shard_databases()
+            ])
+        login_filter.add(login)
         return user_id
 
     @classmethod
     async def is_registered(cls, login: str) -> bool:
+        if not login_filter.might_exist(login):
+            return False
+
         select_user_query = users.select().where(users.c.login == login)
-        user = await settings.database.fetch_one(select_user_query)
+        user = await current_database().fetch_one(select_user_query)
+        if not user:
+            login_filter.false_positive()
         return bool(user)
 
     @classmethod
@@ -57,7 +107,7 @@ class UserModel:
         select_user_query = users.select().where(
             and_(users.c.login == login, users.c.password == password)
         )
-        user = await settings.database.execute(select_user_query)
+        user = await current_database().execute(select_user_query)
         if user:
 
             set_token_query = (
@@ -65,29 +115,114 @@ class UserModel:
                 .where(and_(users.c.login == login, users.c.password == password))
                 .values(token=token, token_expired_at=token_expired_at)
             )
-            await settings.database.execute(set_token_query)
+            await current_database().execute(set_token_query)
             return token
 
     @classmethod
+    @single_flight
     async def get_authorized(cls, token: str) -> Optional[Mapping[str, Any]]:
         select_user_query = users.select().where(
             and_(users.c.token == token, datetime.now() < users.c.token_expired_at)
         )
-        user = await settings.database.fetch_one(select_user_query)
+        user = await current_database().fetch_one(select_user_query)
         return user
 
-    @classmethod
-    async def get_by_login(cls, login: str) -> Optional[Mapping[str, Any]]:
-        select_user_query = users.select().where(users.c.login == login)
-        user = await settings.database.fetch_one(select_user_query)
-        return user
 
+class LoginFilter:
+    """
+    The logins of the directory in a `BloomFilter`, for lookups of logins
+    that are not registered. `refresh` loads the filter the first time and
+    then adds the logins registered since, in pages of `page_size` users;
+    registrations of this process are added right away. Until it is loaded
+    every login might exist.
+
+    Users are paged by id, and ids are taken before their registration is
+    committed: a refresh reads again the ids read by the refresh before it
+    (but not those of the load), so that a registration committing after a
+    user with a larger id does not go unnoticed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, page_size: int = 10000):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self._filter: Optional[BloomFilter] = None
+        self._loading: Optional[BloomFilter] = None
+        self._last_ids = (0, 0)
+
+    def might_exist(self, login: str) -> bool:
+        if self._filter is None or login in self._filter:
+            return True
+
+        metrics.increment('login_filter.negatives')
+        return False
+
+    def false_positive(self) -> None:
+        metrics.increment('login_filter.false_positives')
+
+    def add(self, login: str) -> None:
+        for filter_ in (self._filter, self._loading):
+            if filter_ is not None:
+                filter_.add(login)
+
+    def clear(self) -> None:
+        self._filter = self._loading = None
+        self._last_ids = (0, 0)
 
+    async def refresh(self) -> None:
+        if not self.capacity:
+            return
+
+        filter_ = self._filter
+        if filter_ is None:
+            filter_ = self._loading = BloomFilter(self.capacity, self.error_rate)
+        after_id, last_id = self._last_ids
+        try:
+            while True:
+                select_logins_query = (
+                    select([users.c.id, users.c.login])
+                    .where(users.c.id > after_id)
+                    .order_by(users.c.id)
+                    .limit(self.page_size)
+                )
+                page = await current_database().fetch_all(select_logins_query)
+                for user in page:
+                    filter_.add(user['login'])
+                if page:
+                    after_id = page[-1]['id']
+                    last_id = max(last_id, after_id)
+                if len(page) < self.page_size:
+                    break
+        finally:
+            self._loading = None
+
+        # Loaded in full, the filter has no previous refresh to read again.
+        self._last_ids = (last_id, last_id) if self._filter is None else (self._last_ids[1], last_id)
+        self._filter = filter_
+        metrics.set_value('login_filter.bytes', filter_.size)
+        metrics.set_value('login_filter.logins', filter_.count)
+        metrics.set_value('login_filter.error_rate', filter_.estimated_error_rate())
+
+
+# Hash-partitioned by user_id, see the items partitioned migrations. The
+# primary key in the database is (user_id, id); `id` stays the primary key
+# here so that inserts return the id.
+#
+# Deleted items keep their row with `deleted_at` set until they are compacted
+# (app.compaction). Queries of live items must say `deleted_at IS NULL`, which
+# also lets them use the partial indexes below.
 class Item(Base):
     __tablename__ = 'items'
+    __table_args__ = (
+        sqlalchemy.Index('ix_items_user_id_id', 'user_id', 'id', postgresql_where=sqlalchemy.text('deleted_at IS NULL')),
+        sqlalchemy.Index('ix_items_user_id_name_id', 'user_id', 'name', 'id', postgresql_where=sqlalchemy.text('deleted_at IS NULL')),
+        sqlalchemy.Index('ix_items_deleted_at', 'deleted_at', postgresql_where=sqlalchemy.text('deleted_at IS NOT NULL')),
+        {'postgresql_partition_by': 'HASH (user_id)'},
+    )
     id = sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, index=True)
     user_id = sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False)
     name = sqlalchemy.Column('name', sqlalchemy.String, nullable=False)
+    deleted_at = sqlalchemy.Column('deleted_at', sqlalchemy.DateTime)
 
 
 items = sqlalchemy.Table(
@@ -96,13 +231,31 @@ items = sqlalchemy.Table(
     sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, index=True),
     sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False),
     sqlalchemy.Column('name', sqlalchemy.String, nullable=False),
+    sqlalchemy.Column('deleted_at', sqlalchemy.DateTime),
+    sqlalchemy.Index('ix_items_user_id_id', 'user_id', 'id', postgresql_where=sqlalchemy.text('deleted_at IS NULL')),
+    sqlalchemy.Index('ix_items_user_id_name_id', 'user_id', 'name', 'id', postgresql_where=sqlalchemy.text('deleted_at IS NULL')),
+    sqlalchemy.Index('ix_items_deleted_at', 'deleted_at', postgresql_where=sqlalchemy.text('deleted_at IS NOT NULL')),
+    postgresql_partition_by='HASH (user_id)',
 )
 
 
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
 class Sending(Base):
     __tablename__ = 'sendings'
+    __table_args__ = (
+        sqlalchemy.Index('ix_sendings_item_id', 'item_id'),
+        # The migration (e9357db9ca4b) adds INCLUDE columns to both, so that
+        # listing pending sendings is an index-only scan.
+        sqlalchemy.Index('ix_sendings_to_user_id_id', 'to_user_id', 'id'),
+        sqlalchemy.Index('ix_sendings_from_user_id_id', 'from_user_id', 'id'),
+    )
     id = sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, index=True)
-    item_id = sqlalchemy.Column('item_id', sqlalchemy.Integer, ForeignKey('items.id'), nullable=False)
+    # Not a foreign key since `items` is partitioned: triggers check that the
+    # item exists and delete the sendings of deleted items.
+    item_id = sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False)
     from_user_id = sqlalchemy.Column('from_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False)
     to_user_id = sqlalchemy.Column('to_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False)
     item_token = sqlalchemy.Column('item_token', sqlalchemy.String, nullable=False)
@@ -112,10 +265,32 @@ sendings = sqlalchemy.Table(
     'sendings',
     settings.metadata,
     sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, index=True),
-    sqlalchemy.Column('item_id', sqlalchemy.Integer, ForeignKey('items.id'), nullable=False),
+    sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False),
     sqlalchemy.Column('from_user_id', sqlalchemy.Integer, ForeignKey('users.id'),nullable=False),
     sqlalchemy.Column('to_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False,),
     sqlalchemy.Column('item_token', sqlalchemy.String, nullable=False),
+    sqlalchemy.Index('ix_sendings_item_id', 'item_id'),
+    sqlalchemy.Index('ix_sendings_to_user_id_id', 'to_user_id', 'id'),
+    sqlalchemy.Index('ix_sendings_from_user_id_id', 'from_user_id', 'id'),
+)
+
+
+class UserCounter(Base):
+    __tablename__ = 'user_counters'
+    user_id = sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    items_count = sqlalchemy.Column('items_count', sqlalchemy.BigInteger, nullable=False, server_default='0')
+    outgoing_sendings_count = sqlalchemy.Column('outgoing_sendings_count', sqlalchemy.BigInteger, nullable=False, server_default='0')
+    incoming_sendings_count = sqlalchemy.Column('incoming_sendings_count', sqlalchemy.BigInteger, nullable=False, server_default='0')
+
+
+# Maintained by triggers on `items` and `sendings`, see the user counters migration.
+user_counters = sqlalchemy.Table(
+    'user_counters',
+    settings.metadata,
+    sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+    sqlalchemy.Column('items_count', sqlalchemy.BigInteger, nullable=False, server_default='0'),
+    sqlalchemy.Column('outgoing_sendings_count', sqlalchemy.BigInteger, nullable=False, server_default='0'),
+    sqlalchemy.Column('incoming_sendings_count', sqlalchemy.BigInteger, nullable=False, server_default='0'),
 )
 
 
@@ -125,40 +300,249 @@ class ItemModel:
 
     @classmethod
     async def create(cls, name: str, user_id: int) -> int:
+        if settings.ITEMS_BATCH_ENABLED:
+            return await items_batcher.submit((name, user_id))
+
         insert_item_query = items.insert().values(name=name, user_id=user_id)
-        item_id = await settings.database.execute(insert_item_query)
+        item_id = await shard(user_id).execute(insert_item_query)
+        items_cache.invalidate(user_id)
         return item_id
 
     @classmethod
-    async def get(cls, item_id: int) -> Optional[Mapping[str, Any]]:
-        select_item_query = items.select().where(items.c.id == item_id)
-        item = await settings.database.fetch_one(select_item_query)
-        return item
+    async def create_many(cls, rows: List[Tuple[str, int]]) -> List[int]:
+        # One INSERT per shard, with the positions of its rows in `rows`.
+        shard_rows: Dict[Database, List[int]] = {}
+        for position, (_, user_id) in enumerate(rows):
+            shard_rows.setdefault(shard_database(user_id), []).append(position)
+
+        async def insert(database: Database, positions: List[int]) -> List[int]:
+            insert_items_query = (
+                items.insert()
+                .values([{'name': rows[i][0], 'user_id': rows[i][1]} for i in positions])
+                .returning(items.c.id)
+            )
+            # Postgres returns the ids of a multi-row VALUES insert in the
+            # order of the rows.
+            item_ids = await current_database(database).fetch_all(insert_items_query)
+            return [item_id['id'] for item_id in item_ids]
+
+        shard_item_ids = await asyncio.gather(*[
+            insert(database, positions) for database, positions in shard_rows.items()
+        ])
+        item_ids = [0] * len(rows)
+        for positions, ids in zip(shard_rows.values(), shard_item_ids):
+            for position, item_id in zip(positions, ids):
+                item_ids[position] = item_id
+        items_cache.invalidate(*{user_id for _, user_id in rows})
+        return item_ids
 
     @classmethod
-    @settings.database.transaction()
-    async def delete(cls, item_id: int) -> Optional[int]:
-        delete_item_query = (
-            items.delete().where(items.c.id == item_id).returning(items.c.id)
-        )
-        deleted_item_id = await settings.database.execute(delete_item_query)
+    async def delete(cls, item_id: int, user_id: int) -> Optional[int]:
+        deleted_item_ids = await cls.delete_many([item_id], user_id)
+        return deleted_item_ids[0] if deleted_item_ids else None
 
-        delete_item_sending_query = (
-            sendings.delete().where(items.c.id == item_id).returning(items.c.id)
+    @classmethod
+    async def delete_many(cls, item_ids: List[int], user_id: int) -> List[int]:
+        """
+        Delete the items of `user_id` among `item_ids` with one statement and
+        return their ids. The rows are only marked deleted and compacted
+        later; pending sendings of the items are removed by a trigger on items.
+        """
+        delete_items_query = (
+            items.update()
+            .where(
+                and_(
+                    items.c.id == any_(bindparam('item_ids', item_ids, type_=ARRAY(sqlalchemy.Integer))),
+                    items.c.user_id == user_id,
+                    items.c.deleted_at.is_(None),
+                )
+            )
+            .values(deleted_at=sqlalchemy.func.now())
+            .returning(items.c.id)
         )
-        await settings.database.execute(delete_item_sending_query)
+        deleted_items = await shard(user_id).fetch_all(delete_items_query)
+        if deleted_items:
+            items_cache.invalidate(user_id)
+        return [item['id'] for item in deleted_items]
 
-        return deleted_item_id
+    @classmethod
+    @single_flight
+    async def list_encoded(
+        cls,
+        user_id: int,
+        q: Optional[str] = None,
+        match: SearchMode = SearchMode.SUBSTRING,
+        sort: ItemSort = ItemSort.ID,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        media_type: str = JSON,
+    ) -> Tuple[bytes, Optional[str]]:
+        """
+        Return items of a user whose name contains (or starts with) `q`,
+        case-insensitively, encoded as an array of `media_type` (JSON or
+        MessagePack), with the cursor of the next page if the page is full.
+        Pages are keyset-based: `cursor` is the one returned with the previous
+        page. Rows are encoded as they come from the database. Served from
+        `items_cache` when possible.
+        Raise ValueError if the cursor does not match the sort order.
+        """
+        key = (q, match, sort, cursor, limit, media_type)
+        cached = items_cache.get(user_id, key)
+        if cached is not None:
+            return cached
+
+        generation = items_cache.generation(user_id)
+        list_items_query = cls._list_query(user_id, q=q, match=match, sort=sort, cursor=cursor, limit=limit)
+        items_ = [
+            {'id': item['id'], 'name': item['name']}
+            for item in await shard(user_id).fetch_all(list_items_query)
+        ]
+        body = encode(items_, media_type)
+        next_cursor = None
+        if limit and len(items_) == limit:
+            next_cursor = encode_cursor(*[items_[-1][column.name] for column in cls._sort_key(sort)])
+        items_cache.put(user_id, key, (body, next_cursor), len(body), generation)
+        return body, next_cursor
 
     @classmethod
-    async def list(cls, user_id: int) -> List[ItemSchema]:
+    def _list_query(
+        cls,
+        user_id: int,
+        q: Optional[str],
+        match: SearchMode,
+        sort: ItemSort,
+        cursor: Optional[str],
+        limit: Optional[int],
+    ) -> Select:
+        conditions = [items.c.user_id == user_id, items.c.deleted_at.is_(None)]
+
+        if q:
+            pattern = f'{_escape_like(q)}%'
+            if match == SearchMode.SUBSTRING:
+                pattern = f'%{pattern}'
+            conditions.append(items.c.name.ilike(pattern, escape='\\'))
+
+        sort_key = cls._sort_key(sort)
+        descending = sort in (ItemSort.ID_DESC, ItemSort.NAME_DESC)
+
+        if cursor:
+            after = decode_cursor(cursor)
+            if len(after) != len(sort_key) or not all(
+                isinstance(value, column.type.python_type)
+                for value, column in zip(after, sort_key)
+            ):
+                raise ValueError(f'Cursor does not match sort order {sort.value}')
+            if descending:
+                conditions.append(tuple_(*sort_key) < tuple_(*after))
+            else:
+                conditions.append(tuple_(*sort_key) > tuple_(*after))
+
         list_items_query = (
             select([items.c.id, items.c.name])
-            .where(items.c.user_id == user_id)
-            .order_by('id')
+            .where(and_(*conditions))
+            .order_by(*[column.desc() if descending else column for column in sort_key])
+            .limit(limit)
         )
-        items_ = await settings.database.fetch_all(list_items_query)
-        return [Item(**item) for item in items_]
+        return list_items_query
+
+    @classmethod
+    async def iterate_chunks(
+        cls, user_id: int, chunk_size: int
+    ) -> AsyncIterator[List[Mapping[str, Any]]]:
+        """
+        Yield all items of a user in chunks of `chunk_size`, read through a
+        server-side cursor so that only one chunk is held in memory.
+        """
+        cursor = f'items_export_{uuid.uuid4().hex}'
+        async with shard(user_id).connection() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    f'DECLARE {cursor} NO SCROLL CURSOR FOR '
+                    f'SELECT id, name FROM items WHERE user_id = :user_id AND deleted_at IS NULL ORDER BY id',
+                    {'user_id': user_id},
+                )
+                while True:
+                    chunk = await connection.fetch_all(f'FETCH {int(chunk_size)} FROM {cursor}')
+                    if not chunk:
+                        break
+                    yield chunk
+                # Needed when the transaction is a savepoint of an outer one.
+                await connection.execute(f'CLOSE {cursor}')
+
+    @classmethod
+    async def import_names(
+        cls, user_id: int, names: AsyncIterator[str], chunk_size: int = 1000
+    ) -> int:
+        """
+        Create items for all `names` in one transaction: names are streamed
+        into a temporary staging table with COPY and moved into `items` with
+        a single INSERT. Return the number of created items.
+        """
+        staging_table = f'items_import_{uuid.uuid4().hex}'
+
+        # Quoted, so that a name `\.` is not taken for the end of the data.
+        async def csv_chunks() -> AsyncIterator[bytes]:
+            rows = []
+            async for name in names:
+                rows.append([name])
+                if len(rows) == chunk_size:
+                    yield encode_csv(rows, quoting=csv.QUOTE_ALL)
+                    rows = []
+            if rows:
+                yield encode_csv(rows, quoting=csv.QUOTE_ALL)
+
+        async with shard(user_id).connection() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    f'CREATE TEMPORARY TABLE {staging_table} (name varchar NOT NULL) ON COMMIT DROP'
+                )
+                async with locked_raw_connection(connection) as raw_connection:
+                    await raw_connection.copy_to_table(
+                        staging_table, source=csv_chunks(), format='csv'
+                    )
+                imported = await connection.fetch_val(
+                    f'WITH imported AS ('
+                    f'INSERT INTO items (user_id, name) SELECT :user_id, name FROM {staging_table} '
+                    f'RETURNING 1'
+                    f') SELECT count(*) FROM imported',
+                    {'user_id': user_id},
+                )
+                # ON COMMIT DROP does not fire when the transaction is a savepoint.
+                await connection.execute(f'DROP TABLE {staging_table}')
+        items_cache.invalidate(user_id)
+        return imported
+
+    @classmethod
+    async def summary(cls, user_id: int) -> Mapping[str, int]:
+        select_counters_query = select([
+            user_counters.c.items_count,
+            user_counters.c.outgoing_sendings_count,
+            user_counters.c.incoming_sendings_count,
+        ]).where(user_counters.c.user_id == user_id)
+        summary = {
+            'items_count': 0,
+            'outgoing_sendings_count': 0,
+            'incoming_sendings_count': 0,
+        }
+        # Incoming sendings are counted on the shards of their senders.
+        for counters in await asyncio.gather(*[
+            current_database(database).fetch_one(select_counters_query)
+            for database in shard_databases()
+        ]):
+            if counters:
+                for name in summary:
+                    summary[name] += counters[name]
+        return summary
+
+    @classmethod
+    def cursor(cls, item: ItemSchema, sort: ItemSort) -> str:
+        return encode_cursor(*[getattr(item, column.name) for column in cls._sort_key(sort)])
+
+    @classmethod
+    def _sort_key(cls, sort: ItemSort) -> List[sqlalchemy.Column]:
+        if sort in (ItemSort.NAME, ItemSort.NAME_DESC):
+            return [items.c.name, items.c.id]
+        return [items.c.id]
 
     @classmethod
     async def transfer(
@@ -171,18 +555,94 @@ class ItemModel:
                 and_(
                     items.c.id == item_id,
                     items.c.user_id == from_user_id,
+                    items.c.deleted_at.is_(None),
                 )
             )
             .values(user_id=to_user_id)
         )
-        transferred_item_id = await settings.database.execute(update_items_query)
+        transferred_item_id = await shard(from_user_id).execute(update_items_query)
+        items_cache.invalidate(from_user_id, to_user_id)
         return transferred_item_id
 
 
+items_cache: UserCache[Tuple[bytes, Optional[str]]] = UserCache(
+    'items', max_bytes=settings.ITEMS_CACHE_MAX_BYTES, ttl=settings.ITEMS_CACHE_TTL,
+)
+
+items_batcher = WriteBatcher(
+    'items',
+    ItemModel.create_many,
+    window=settings.ITEMS_BATCH_WINDOW,
+    max_size=settings.ITEMS_BATCH_MAX_SIZE,
+)
+
+
 class SendingStatus(Enum):
     NO_SENDING = 0
     COMPLETED = 1
     FAILED = 2
+    LOCKED = 3
+
+
+# What POST /send needs, resolved in one statement: the sender by token, the
+# recipient by login, the sender's item and an existing sending, inserting a
+# sending (and its notification) unless there is one or a check failed.
+SEND_USERS_CTE = '''
+sender AS (
+    SELECT id, login FROM users WHERE token = :token AND token_expired_at > :now
+),
+recipient AS (
+    SELECT id FROM users WHERE login = :recipient_login
+)'''
+
+# The same users, resolved by the directory beforehand.
+SEND_RESOLVED_USERS_CTE = '''
+sender AS (
+    SELECT CAST(:sender_id AS integer) AS id, CAST(:sender_login AS varchar) AS login
+),
+recipient AS (
+    SELECT CAST(:recipient_id AS integer) AS id WHERE CAST(:recipient_id AS integer) IS NOT NULL
+)'''
+
+# The notification of the created sending, see OUTBOX_INSERT_QUERY.
+SEND_OUTBOX_CTE = ''',
+notified AS ({insert})'''
+
+SEND_QUERY = '''
+WITH {users},
+item AS (
+    SELECT items.id FROM items JOIN sender ON items.user_id = sender.id
+    WHERE items.id = :item_id AND items.deleted_at IS NULL
+),
+existing AS (
+    SELECT sendings.item_token FROM sendings
+    JOIN sender ON sendings.from_user_id = sender.id
+    JOIN recipient ON sendings.to_user_id = recipient.id
+    WHERE sendings.item_id = :item_id
+    LIMIT 1
+),
+created AS (
+    INSERT INTO sendings (item_id, from_user_id, to_user_id, item_token)
+    SELECT item.id, sender.id, recipient.id, CAST(:item_token AS varchar)
+    FROM item, sender, recipient
+    WHERE sender.login <> :recipient_login AND NOT EXISTS (SELECT FROM existing)
+    RETURNING item_id, from_user_id, to_user_id, item_token
+){outbox}
+SELECT
+    (SELECT id FROM sender) AS sender_id,
+    (SELECT login FROM sender) AS sender_login,
+    (SELECT id FROM recipient) AS recipient_id,
+    EXISTS (SELECT FROM item) AS item_found,
+    coalesce((SELECT item_token FROM existing), (SELECT item_token FROM created)) AS item_token
+'''
+
+SEND_USERS_QUERY = '''
+WITH {users}
+SELECT
+    (SELECT id FROM sender) AS sender_id,
+    (SELECT login FROM sender) AS sender_login,
+    (SELECT id FROM recipient) AS recipient_id
+'''.format(users=SEND_USERS_CTE)
 
 
 class SendingModel:
@@ -190,77 +650,256 @@ class SendingModel:
         pass
 
     @classmethod
-    async def initiate_sending(
-        cls, from_user_id: int, to_user_id: int, item_id: int
-    ) -> str:
-        item_token = await cls.get_item_token(
-            from_user_id, to_user_id, item_id
-        )
-        if item_token:
-            return item_token
+    async def send(cls, token: str, item_id: int, recipient_login: str) -> Mapping[str, Any]:
+        """
+        Send the item `item_id` of the user authorized by `token` to the user
+        `recipient_login`, unless it is being sent to them already, in one
+        query; with shards, one to the directory and one to the sender's
+        shard. Return `sender_id`, `sender_login`, `recipient_id` (each None
+        if not found), `item_found` and the `item_token` of the sending,
+        which is None if any of them is missing or the recipient is the sender.
+        A recipient ruled out by `login_filter` is not looked up, and neither
+        is the item: only the sender is, and `item_found` is False.
+        """
+        if not login_filter.might_exist(recipient_login):
+            sender = await UserModel.get_authorized(token)
+            return {
+                'sender_id': sender['id'] if sender else None,
+                'sender_login': sender['login'] if sender else None,
+                'recipient_id': None,
+                'item_found': False,
+                'item_token': None,
+            }
 
-        url = uuid.uuid4().hex
-        item_token = await cls.create(from_user_id, to_user_id, item_id, url)
+        values = {'token': token, 'now': datetime.now(), 'recipient_login': recipient_login}
+        users_cte = SEND_USERS_CTE
+        database = current_database()
+        if is_sharded():
+            users = await database.fetch_one(SEND_USERS_QUERY, values)
+            if users['sender_id'] is None:
+                return {**users, 'item_found': False, 'item_token': None}
+            values = {**users, 'recipient_login': recipient_login}
+            users_cte = SEND_RESOLVED_USERS_CTE
+            database = shard(users['sender_id'])
 
-        return item_token
+        values.update(item_id=item_id, item_token=uuid.uuid4().hex)
+        outbox_cte = ''
+        if settings.OUTBOX_WEBHOOK_URL:
+            values.update(OutboxModel.values('item.sent'))
+            outbox_cte = SEND_OUTBOX_CTE.format(insert=OUTBOX_INSERT_QUERY.format(source='created'))
+        send_query = SEND_QUERY.format(users=users_cte, outbox=outbox_cte)
+        return await database.fetch_one(send_query, values)
 
     @classmethod
     async def complete_sending(cls, item_token: str) -> SendingStatus:
-        transaction = await settings.database.transaction()
+        database = await cls._locate(item_token)
+        if database is None:
+            return SendingStatus.NO_SENDING
 
-        sending = await cls.get(item_token)
+        transaction = await current_database(database).transaction()
+
+        sending = await cls.lock(item_token, database)
         if not sending:
             await transaction.rollback()
+            # Either there is no such sending or it is being confirmed right
+            # now; a losing confirmation returns instead of waiting.
+            if await cls.get(item_token):
+                metrics.increment('sendings.confirm.locked')
+                return SendingStatus.LOCKED
             return SendingStatus.NO_SENDING
 
         item_id = sending['item_id']
+        if sending['item_user_id'] != sending['from_user_id']:
+            await transaction.rollback()
+            return SendingStatus.FAILED
+
+        if shard_database(sending['to_user_id']) is not database:
+            return await cls._complete_between_shards(sending, transaction)
 
         transferred_item_id = await ItemModel.transfer(
             from_user_id=sending['from_user_id'],
             to_user_id=sending['to_user_id'],
             item_id=sending['item_id'],
         )
-        deleted_sending_id = await cls.delete(sending['item_id'])
+        deleted_sending_id = await cls.delete(sending['item_id'], database)
 
         if transferred_item_id == item_id and deleted_sending_id:
+            await OutboxModel.add(current_database(database), 'item.received', {
+                'item_id': item_id,
+                'from_user_id': sending['from_user_id'],
+                'to_user_id': sending['to_user_id'],
+            })
             await transaction.commit()
+            # Inventories read while the transaction was open were cached
+            # with the old owner.
+            items_cache.invalidate(sending['from_user_id'], sending['to_user_id'])
+            await transfer_log.put({
+                'item_id': item_id,
+                'from_user_id': sending['from_user_id'],
+                'to_user_id': sending['to_user_id'],
+                'created_at': datetime.now(),
+            })
             return SendingStatus.COMPLETED
 
         await transaction.rollback()
         return SendingStatus.FAILED
 
     @classmethod
-    async def get_item_token(
-        cls, from_user_id: int, to_user_id: int, item_id: int
-    ) -> Optional[str]:
-        select_url_query = select([sendings.c.item_token]).where(
-            and_(
-                sendings.c.from_user_id == from_user_id,
-                sendings.c.to_user_id == to_user_id,
-                sendings.c.item_id == item_id,
+    async def _complete_between_shards(
+        cls, sending: Mapping[str, Any], transaction: Any
+    ) -> SendingStatus:
+        """
+        Move the item of a locked sending to the shard of the recipient. The
+        item leaves the shard of the sender together with an outgoing transfer
+        in the locking transaction; the transfer is then delivered, right away
+        or by `transfer_retries`.
+        """
+        # Deleted for good rather than marked deleted: the item may come back
+        # to this shard, under the same primary key, before compaction.
+        delete_item_query = (
+            items.delete()
+            .where(
+                and_(
+                    items.c.id == sending['item_id'],
+                    items.c.user_id == sending['from_user_id'],
+                    items.c.deleted_at.is_(None),
+                )
             )
+            .returning(items.c.id)
         )
-        item_token = await settings.database.fetch_val(select_url_query)
-        return item_token
-
-    @classmethod
-    async def create(
-        cls, from_user_id: int, to_user_id: int, item_id: int, item_token: str
-    ) -> str:
-        insert_url_query = (
-            sendings.insert()
-            .values(
-                item_id=item_id,
-                from_user_id=from_user_id,
-                to_user_id=to_user_id,
-                item_token=item_token,
-            )
-            .returning(sendings.c.item_token)
+        if not await shard(sending['from_user_id']).execute(delete_item_query):
+            await transaction.rollback()
+            return SendingStatus.FAILED
+
+        transfer = {
+            'item_id': sending['item_id'],
+            'name': sending['item_name'],
+            'from_user_id': sending['from_user_id'],
+            'to_user_id': sending['to_user_id'],
+            'created_at': datetime.now(),
+        }
+        insert_transfer_query = (
+            outgoing_transfers.insert().values(**transfer).returning(outgoing_transfers.c.id)
         )
-        item_token = await settings.database.execute(insert_url_query)
-        return item_token
+        transfer['id'] = await shard(sending['from_user_id']).execute(insert_transfer_query)
+        await OutboxModel.add(shard(sending['from_user_id']), 'item.received', {
+            'item_id': sending['item_id'],
+            'from_user_id': sending['from_user_id'],
+            'to_user_id': sending['to_user_id'],
+        })
+        await transaction.commit()
+        metrics.increment('sendings.transfer.between_shards')
+
+        try:
+            await deliver_transfer(transfer)
+        except Exception:
+            metrics.increment('sendings.transfer.deferred')
+            logger.warning('Delivering transfer %s failed', transfer['id'], exc_info=True)
+        await transfer_log.put({
+            'item_id': transfer['item_id'],
+            'from_user_id': transfer['from_user_id'],
+            'to_user_id': transfer['to_user_id'],
+            'created_at': transfer['created_at'],
+        })
+        return SendingStatus.COMPLETED
+
+    @classmethod
+    async def _locate(cls, item_token: str) -> Optional[Database]:
+        """
+        The shard of a sending, which is the shard of its sender, or None if
+        there is no such sending.
+        """
+        if not is_sharded():
+            return shard_databases()[0]
+
+        sending = await cls.get(item_token)
+        return shard_database(sending['from_user_id']) if sending else None
 
     @classmethod
+    async def lock(
+        cls, item_token: str, database: Optional[Database] = None
+    ) -> Optional[Mapping[str, Any]]:
+        """
+        Lock a sending on the shard `database` and its item until the end of
+        the current transaction. Returns None if there is no such sending or
+        if another transaction holds either lock, e.g. a concurrent
+        confirmation of the same item.
+        """
+        # The item is joined by id alone, which probes every partition of
+        # items, so that a sending whose item has changed owners is found.
+        lock_sending_query = (
+            select([
+                *sendings.c,
+                items.c.user_id.label('item_user_id'),
+                items.c.name.label('item_name'),
+            ])
+            .select_from(sendings.join(items, items.c.id == sendings.c.item_id))
+            .where(and_(sendings.c.item_token == item_token, items.c.deleted_at.is_(None)))
+            .with_for_update(skip_locked=True)
+        )
+        sending = await current_database(database).fetch_one(lock_sending_query)
+        return sending
+
+    @classmethod
+    async def list(
+        cls,
+        user_id: int,
+        direction: SendingDirection,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[PendingSendingSchema]:
+        """
+        Return pending sendings to (incoming) or from (outgoing) a user with
+        their item names, newest first. `cursor` is the value of
+        `SendingModel.cursor` for the last sending of the previous page.
+        Raise ValueError if the cursor is malformed.
+        """
+        # Sendings are kept on the shard of their sender: incoming sendings
+        # are merged from every shard.
+        if direction == SendingDirection.INCOMING:
+            user_column = sendings.c.to_user_id
+            databases = shard_databases()
+        else:
+            user_column = sendings.c.from_user_id
+            databases = [shard_database(user_id)]
+
+        conditions = [user_column == user_id]
+        if cursor:
+            after = decode_cursor(cursor)
+            if len(after) != 1 or not isinstance(after[0], int):
+                raise ValueError(f'Invalid cursor: {cursor}')
+            conditions.append(sendings.c.id < after[0])
+
+        list_sendings_query = (
+            select([
+                sendings.c.id,
+                sendings.c.item_id,
+                items.c.name.label('item_name'),
+                sendings.c.from_user_id,
+                sendings.c.to_user_id,
+                sendings.c.item_token,
+            ])
+            .select_from(sendings.join(items, items.c.id == sendings.c.item_id))
+            .where(and_(*conditions))
+            .order_by(sendings.c.id.desc())
+            .limit(limit)
+        )
+        pages = await asyncio.gather(*[
+            current_database(database).fetch_all(list_sendings_query) for database in databases
+        ])
+        sendings_ = sorted(
+            (sending for page in pages for sending in page),
+            key=lambda sending: sending['id'],
+            reverse=True,
+        )[:limit]
+        return [PendingSendingSchema(**sending) for sending in sendings_]
+
+    @classmethod
+    def cursor(cls, sending: PendingSendingSchema) -> str:
+        return encode_cursor(sending.id)
+
+    @classmethod
+    @single_flight
     async def get(
         cls, item_token: str
     ) -> Optional[Mapping[str, Any]]:
@@ -271,11 +910,17 @@ class SendingModel:
             )
         )
 
-        sending = await settings.database.fetch_one(select_sending_query)
-        return sending
+        # Tokens do not tell the sender, so every shard is asked.
+        for sending in await asyncio.gather(*[
+            current_database(database).fetch_one(select_sending_query)
+            for database in shard_databases()
+        ]):
+            if sending:
+                return sending
+        return None
 
     @classmethod
-    async def delete(cls, item_id: int) -> int:
+    async def delete(cls, item_id: int, database: Optional[Database] = None) -> int:
 
         delete_sending_query = (
             sendings.delete()
@@ -283,5 +928,551 @@ class SendingModel:
             .where(sendings.c.item_id == item_id)
         )
 
-        deleted_sending_id = await settings.database.execute(delete_sending_query)
+        deleted_sending_id = await current_database(database).execute(delete_sending_query)
         return deleted_sending_id
+
+
+class OutgoingTransfer(Base):
+    __tablename__ = 'outgoing_transfers'
+    id = sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True)
+    item_id = sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False)
+    name = sqlalchemy.Column('name', sqlalchemy.String, nullable=False)
+    from_user_id = sqlalchemy.Column('from_user_id', sqlalchemy.Integer, nullable=False)
+    to_user_id = sqlalchemy.Column('to_user_id', sqlalchemy.Integer, nullable=False)
+    created_at = sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False, index=True)
+
+
+# Items that left the shard of their sender until the shard of the recipient
+# has them, see `deliver_transfer`.
+outgoing_transfers = sqlalchemy.Table(
+    'outgoing_transfers',
+    settings.metadata,
+    sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('name', sqlalchemy.String, nullable=False),
+    sqlalchemy.Column('from_user_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('to_user_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False, index=True),
+)
+
+
+class IncomingTransfer(Base):
+    __tablename__ = 'incoming_transfers'
+    id = sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True, autoincrement=False)
+    created_at = sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False)
+
+
+# Ids of the transfers a shard has received.
+incoming_transfers = sqlalchemy.Table(
+    'incoming_transfers',
+    settings.metadata,
+    sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True, autoincrement=False),
+    sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False),
+)
+
+
+async def deliver_transfer(transfer: Mapping[str, Any]) -> None:
+    """
+    Add the item of an outgoing transfer to the shard of the recipient and
+    forget the transfer. Delivering a transfer again adds nothing, so a
+    delivery that failed halfway can be repeated.
+    """
+    target = shard(transfer['to_user_id'])
+    async with target.transaction():
+        receive_transfer_query = (
+            pg_insert(incoming_transfers)
+            .values(id=transfer['id'], created_at=datetime.now())
+            .on_conflict_do_nothing(index_elements=[incoming_transfers.c.id])
+            .returning(incoming_transfers.c.id)
+        )
+        if await target.fetch_val(receive_transfer_query):
+            await target.execute(items.insert().values(
+                id=transfer['item_id'], user_id=transfer['to_user_id'], name=transfer['name'],
+            ))
+
+    delete_transfer_query = outgoing_transfers.delete().where(outgoing_transfers.c.id == transfer['id'])
+    await shard(transfer['from_user_id']).execute(delete_transfer_query)
+    items_cache.invalidate(transfer['from_user_id'], transfer['to_user_id'])
+    metrics.increment('sendings.transfer.delivered')
+
+
+async def redeliver_transfers(limit: int = 100) -> None:
+    """
+    Deliver the outgoing transfers of every shard that are older than
+    SHARD_TRANSFER_RETRY_INTERVAL, at most `limit` per shard.
+    """
+    created_before = datetime.now() - timedelta(seconds=settings.SHARD_TRANSFER_RETRY_INTERVAL)
+    select_transfers_query = (
+        outgoing_transfers.select()
+        .where(outgoing_transfers.c.created_at < created_before)
+        .order_by(outgoing_transfers.c.created_at)
+        .limit(limit)
+    )
+    for database in shard_databases():
+        for transfer in await current_database(database).fetch_all(select_transfers_query):
+            await deliver_transfer(transfer)
+
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    id = sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True)
+    event = sqlalchemy.Column('event', sqlalchemy.String, nullable=False)
+    payload = sqlalchemy.Column('payload', sqlalchemy.Text, nullable=False)
+    created_at = sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False)
+    attempts = sqlalchemy.Column('attempts', sqlalchemy.Integer, nullable=False, server_default='0')
+    available_at = sqlalchemy.Column('available_at', sqlalchemy.DateTime, nullable=False, server_default=sqlalchemy.text('now()'), index=True)
+
+
+# Notifications until they are delivered, see app.outbox.
+outbox = sqlalchemy.Table(
+    'outbox',
+    settings.metadata,
+    sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column('event', sqlalchemy.String, nullable=False),
+    sqlalchemy.Column('payload', sqlalchemy.Text, nullable=False),
+    sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column('attempts', sqlalchemy.Integer, nullable=False, server_default='0'),
+    sqlalchemy.Column('available_at', sqlalchemy.DateTime, nullable=False, server_default=sqlalchemy.text('now()'), index=True),
+)
+
+
+# Notifications tell that an item is sent or received, with one row for each
+# row of `{source}`, which has `item_id`, `from_user_id` and `to_user_id`. The
+# database builds the body, so that POST /send records its notification in its
+# one statement (SEND_OUTBOX_CTE) in the same format as OutboxModel.add.
+OUTBOX_INSERT_QUERY = '''
+INSERT INTO outbox (event, payload, created_at)
+SELECT CAST(:event AS varchar), json_build_object(
+    'id', CAST(:event_id AS text),
+    'event', CAST(:event AS text),
+    'created_at', CAST(:created_at_iso AS text),
+    'item_id', item_id,
+    'from_user_id', from_user_id,
+    'to_user_id', to_user_id
+)::text, CAST(:created_at AS timestamp)
+FROM {source}
+'''
+
+OUTBOX_ADD_SOURCE = '''(
+    SELECT
+        CAST(:item_id AS integer) AS item_id,
+        CAST(:from_user_id AS integer) AS from_user_id,
+        CAST(:to_user_id AS integer) AS to_user_id
+) AS notification'''
+
+
+class OutboxModel:
+    def __init__(self):
+        pass
+
+    @classmethod
+    def values(cls, event: str) -> Dict[str, Any]:
+        """
+        The values of OUTBOX_INSERT_QUERY for a notification of `event`, but
+        for those of its source.
+        """
+        created_at = datetime.now()
+        return {
+            'event': event,
+            'event_id': uuid.uuid4().hex,
+            'created_at': created_at,
+            'created_at_iso': created_at.isoformat(),
+        }
+
+    @classmethod
+    async def add(cls, database: Any, event: str, payload: Mapping[str, Any]) -> None:
+        """
+        Record a notification of the `item_id`, `from_user_id` and
+        `to_user_id` in `payload` with the connection `database`, inside the
+        transaction of the change it announces. Nothing is recorded without
+        OUTBOX_WEBHOOK_URL.
+        """
+        if not settings.OUTBOX_WEBHOOK_URL:
+            return
+
+        await database.execute(OUTBOX_INSERT_QUERY.format(source=OUTBOX_ADD_SOURCE), {
+            **cls.values(event),
+            'item_id': payload['item_id'],
+            'from_user_id': payload['from_user_id'],
+            'to_user_id': payload['to_user_id'],
+        })
+
+
+# Tables whose export is not the whole table.
+# The query of every exported table, with the columns that may leave the
+# database: no passwords, tokens or item tokens. A shard exports the rows of
+# its own users only, so that its placeholder rows and the copy of every
+# transfer event on the recipient's shard are not exported twice; the
+# directory exports the users.
+EXPORT_QUERIES = {
+    'users': 'SELECT id, login FROM users',
+    'items': (
+        'SELECT id, user_id, name FROM items '
+        'WHERE deleted_at IS NULL AND user_id % {shard_count} = {shard_index}'
+    ),
+    'sendings': (
+        'SELECT id, item_id, from_user_id, to_user_id FROM sendings '
+        'WHERE from_user_id % {shard_count} = {shard_index}'
+    ),
+    'user_counters': (
+        'SELECT user_id, items_count, outgoing_sendings_count, incoming_sendings_count '
+        'FROM user_counters WHERE user_id % {shard_count} = {shard_index}'
+    ),
+    'transfer_events': (
+        'SELECT id, item_id, from_user_id, to_user_id, created_at FROM transfer_events '
+        'WHERE from_user_id % {shard_count} = {shard_index}'
+    ),
+}
+
+
+class ExportModel:
+    def __init__(self):
+        pass
+
+    @classmethod
+    async def copy_table(cls, table: str, max_chunks: int = 16) -> AsyncIterator[bytes]:
+        """
+        Yield a whole table as CSV with a header, as produced by
+        `COPY ... TO STDOUT`. At most `max_chunks` chunks are buffered; COPY
+        waits for the consumer beyond that. Users come from the directory,
+        other tables from every shard in turn, with the columns and rows of
+        EXPORT_QUERIES.
+        """
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+        done = object()
+        databases = [settings.database] if table == 'users' else shard_databases()
+
+        async def copy() -> None:
+            try:
+                for number, database in enumerate(databases):
+                    async with current_database(database).connection() as connection:
+                        async with locked_raw_connection(connection) as raw_connection:
+                            await raw_connection.copy_from_query(
+                                EXPORT_QUERIES[table].format(shard_count=len(databases), shard_index=number),
+                                output=chunks.put, format='csv', header=number == 0,
+                            )
+            finally:
+                await chunks.put(done)
+
+        copying = asyncio.ensure_future(copy())
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                yield bytes(chunk)
+            await copying
+        finally:
+            copying.cancel()
+
+
+class TransferEvent(Base):
+    __tablename__ = 'transfer_events'
+    __table_args__ = (
+        sqlalchemy.Index('ix_transfer_events_from_user_id_id', 'from_user_id', 'id'),
+        sqlalchemy.Index('ix_transfer_events_to_user_id_id', 'to_user_id', 'id'),
+    )
+    id = sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True)
+    item_id = sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False)
+    from_user_id = sqlalchemy.Column('from_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False)
+    to_user_id = sqlalchemy.Column('to_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False)
+    created_at = sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False)
+
+
+transfer_events = sqlalchemy.Table(
+    'transfer_events',
+    settings.metadata,
+    sqlalchemy.Column('id', sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column('item_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('from_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False),
+    sqlalchemy.Column('to_user_id', sqlalchemy.Integer, ForeignKey('users.id'), nullable=False),
+    sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Index('ix_transfer_events_from_user_id_id', 'from_user_id', 'id'),
+    sqlalchemy.Index('ix_transfer_events_to_user_id_id', 'to_user_id', 'id'),
+)
+
+
+class TransferEventModel:
+    def __init__(self):
+        pass
+
+    @classmethod
+    async def create_many(cls, events: List[Mapping[str, Any]]) -> None:
+        # An event is listed on the shards of both users and counted in the
+        # daily stats of each user, on the user's shard.
+        shard_events: Dict[Database, List[Mapping[str, Any]]] = {}
+        shard_stats: Dict[Database, Dict[Tuple[int, date], List[int]]] = {}
+        for event in events:
+            for database in {shard_database(event['from_user_id']), shard_database(event['to_user_id'])}:
+                shard_events.setdefault(database, []).append(event)
+            day = event['created_at'].date()
+            for user_id, column in ((event['from_user_id'], 0), (event['to_user_id'], 1)):
+                stats = shard_stats.setdefault(shard_database(user_id), {})
+                stats.setdefault((user_id, day), [0, 0])[column] += 1
+
+        async def write(database: Database) -> None:
+            connection = current_database(database)
+            # Events first: `python -m app.rollups` locks them out while it
+            # recounts, so the stats are never added to a recount twice.
+            async with connection.transaction():
+                await connection.execute(transfer_events.insert().values(shard_events[database]))
+                await TransferStatsModel.add(connection, shard_stats[database])
+
+        await asyncio.gather(*[write(database) for database in shard_events])
+
+    @classmethod
+    async def list(
+        cls, user_id: int, cursor: Optional[str] = None, limit: int = 100
+    ) -> List[TransferEventSchema]:
+        """
+        Return transfers from or to a user, newest first. `cursor` is the value
+        of `TransferEventModel.cursor` for the last event of the previous page.
+        Raise ValueError if the cursor is malformed.
+        """
+        conditions = []
+        if cursor:
+            after = decode_cursor(cursor)
+            if len(after) != 1 or not isinstance(after[0], int):
+                raise ValueError(f'Invalid cursor: {cursor}')
+            conditions.append(transfer_events.c.id < after[0])
+
+        # Each side is read from its own (user, id) index in id order, which
+        # keeps a page cheap however long the history is.
+        pages = [
+            select([transfer_events])
+            .where(and_(user_column == user_id, *conditions))
+            .order_by(transfer_events.c.id.desc())
+            .limit(limit)
+            .alias()
+            for user_column in (transfer_events.c.from_user_id, transfer_events.c.to_user_id)
+        ]
+        events = union_all(*[select([page]) for page in pages]).alias()
+        list_events_query = (
+            select([events])
+            .order_by(events.c.id.desc())
+            .limit(limit)
+        )
+        events_ = await shard(user_id).fetch_all(list_events_query)
+        return [TransferEventSchema(**event) for event in events_]
+
+    @classmethod
+    def cursor(cls, event: TransferEventSchema) -> str:
+        return encode_cursor(event.id)
+
+
+class TransferDailyStats(Base):
+    __tablename__ = 'transfer_daily_stats'
+    __table_args__ = (
+        sqlalchemy.Index('ix_transfer_daily_stats_day', 'day'),
+    )
+    user_id = sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    day = sqlalchemy.Column('day', sqlalchemy.Date, primary_key=True)
+    sent_count = sqlalchemy.Column('sent_count', sqlalchemy.BigInteger, nullable=False, server_default='0')
+    received_count = sqlalchemy.Column('received_count', sqlalchemy.BigInteger, nullable=False, server_default='0')
+
+
+# Transfers per user and day, on the shard of the user. Maintained together
+# with `transfer_events` and recounted from it by `python -m app.rollups`.
+transfer_daily_stats = sqlalchemy.Table(
+    'transfer_daily_stats',
+    settings.metadata,
+    sqlalchemy.Column('user_id', sqlalchemy.Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+    sqlalchemy.Column('day', sqlalchemy.Date, primary_key=True),
+    sqlalchemy.Column('sent_count', sqlalchemy.BigInteger, nullable=False, server_default='0'),
+    sqlalchemy.Column('received_count', sqlalchemy.BigInteger, nullable=False, server_default='0'),
+    sqlalchemy.Index('ix_transfer_daily_stats_day', 'day'),
+)
+
+
+class TransferStatsModel:
+    def __init__(self):
+        pass
+
+    @classmethod
+    async def add(cls, database: Any, stats: Mapping[Tuple[int, date], List[int]]) -> None:
+        """
+        Add `[sent, received]` counts per `(user_id, day)` to the daily stats.
+        """
+        # In key order, so that concurrent writers lock rows in the same order.
+        insert_stats_query = pg_insert(transfer_daily_stats).values([
+            {'user_id': user_id, 'day': day, 'sent_count': sent, 'received_count': received}
+            for (user_id, day), (sent, received) in sorted(stats.items())
+        ])
+        insert_stats_query = insert_stats_query.on_conflict_do_update(
+            index_elements=[transfer_daily_stats.c.user_id, transfer_daily_stats.c.day],
+            set_={
+                'sent_count': transfer_daily_stats.c.sent_count + insert_stats_query.excluded.sent_count,
+                'received_count': transfer_daily_stats.c.received_count + insert_stats_query.excluded.received_count,
+            },
+        )
+        await database.execute(insert_stats_query)
+
+    @classmethod
+    async def daily(cls, user_id: int, start: date, end: date) -> List[Mapping[str, Any]]:
+        """
+        Return the days from `start` to `end` on which a user sent or received
+        items, with the counts, oldest first.
+        """
+        select_stats_query = (
+            select([
+                transfer_daily_stats.c.day,
+                transfer_daily_stats.c.sent_count,
+                transfer_daily_stats.c.received_count,
+            ])
+            .where(
+                and_(
+                    transfer_daily_stats.c.user_id == user_id,
+                    transfer_daily_stats.c.day >= start,
+                    transfer_daily_stats.c.day <= end,
+                )
+            )
+            .order_by(transfer_daily_stats.c.day)
+        )
+        return await shard(user_id).fetch_all(select_stats_query)
+
+    @classmethod
+    async def top_senders(cls, start: date, end: date, limit: int = 10) -> List[Mapping[str, Any]]:
+        """
+        Return the `limit` users who sent the most items from `start` to
+        `end`, as `login` and `sent_count`, most items first.
+        """
+        sent_count = sqlalchemy.func.sum(transfer_daily_stats.c.sent_count).label('sent_count')
+        select_senders_query = (
+            select([transfer_daily_stats.c.user_id, sent_count])
+            .where(
+                and_(
+                    transfer_daily_stats.c.day >= start,
+                    transfer_daily_stats.c.day <= end,
+                    transfer_daily_stats.c.sent_count > 0,
+                )
+            )
+            .group_by(transfer_daily_stats.c.user_id)
+            .order_by(sent_count.desc(), transfer_daily_stats.c.user_id)
+            .limit(limit)
+        )
+        # The stats of a user are on one shard only, so the top of every
+        # shard is all it takes.
+        senders = sorted(
+            [
+                sender
+                for senders_ in await asyncio.gather(*[
+                    current_database(database).fetch_all(select_senders_query)
+                    for database in shard_databases()
+                ])
+                for sender in senders_
+            ],
+            key=lambda sender: (-sender['sent_count'], sender['user_id']),
+        )[:limit]
+        if not senders:
+            return []
+
+        select_logins_query = select([users.c.id, users.c.login]).where(
+            users.c.id.in_([sender['user_id'] for sender in senders])
+        )
+        logins = {user['id']: user['login'] for user in await current_database().fetch_all(select_logins_query)}
+        return [
+            {'login': logins[sender['user_id']], 'sent_count': sender['sent_count']}
+            for sender in senders
+            if sender['user_id'] in logins
+        ]
+
+
+transfer_log = WriteBehindQueue(
+    'transfer_events',
+    TransferEventModel.create_many,
+    batch_size=settings.TRANSFER_LOG_BATCH_SIZE,
+    interval=settings.TRANSFER_LOG_INTERVAL,
+    max_pending=settings.TRANSFER_LOG_MAX_PENDING,
+)
+
+outbox_dispatcher = OutboxDispatcher(
+    shard_databases,
+    WebhookSender(settings.OUTBOX_WEBHOOK_URL, timeout=settings.OUTBOX_TIMEOUT),
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    concurrency=settings.OUTBOX_CONCURRENCY,
+    backoff=settings.OUTBOX_BACKOFF,
+    max_backoff=settings.OUTBOX_MAX_BACKOFF,
+    interval=settings.OUTBOX_INTERVAL,
+    lease=settings.OUTBOX_LEASE,
+)
+
+login_filter = LoginFilter(
+    capacity=settings.LOGIN_FILTER_CAPACITY, error_rate=settings.LOGIN_FILTER_ERROR_RATE,
+)
+
+login_filter_refresher = PeriodicTask(
+    'login_filter', login_filter.refresh, interval=settings.LOGIN_FILTER_REFRESH_INTERVAL, delay=0,
+)
+
+transfer_retries = PeriodicTask(
+    'shard_transfers', redeliver_transfers, interval=settings.SHARD_TRANSFER_RETRY_INTERVAL,
+)
+
+
+async def compact_items() -> None:
+    for database in shard_databases():
+        await compact(
+            database,
+            batch_size=settings.ITEMS_COMPACTION_BATCH_SIZE,
+            pause=settings.ITEMS_COMPACTION_PAUSE,
+        )
+
+
+items_compactor = PeriodicTask(
+    'items_compaction', compact_items, interval=settings.ITEMS_COMPACTION_INTERVAL,
+)
+
+
+def start_background_writers() -> None:
+    """
+    Apply the current settings to the background writers and the items cache,
+    empty the cache and start the writers.
+    """
+    items_cache.max_bytes = settings.ITEMS_CACHE_MAX_BYTES
+    items_cache.ttl = settings.ITEMS_CACHE_TTL
+    items_cache.clear()
+
+    login_filter.capacity = settings.LOGIN_FILTER_CAPACITY
+    login_filter.error_rate = settings.LOGIN_FILTER_ERROR_RATE
+    login_filter.clear()
+    login_filter_refresher.interval = settings.LOGIN_FILTER_REFRESH_INTERVAL
+    if settings.LOGIN_FILTER_CAPACITY:
+        login_filter_refresher.start()
+
+    items_batcher.window = settings.ITEMS_BATCH_WINDOW
+    items_batcher.max_size = settings.ITEMS_BATCH_MAX_SIZE
+
+    transfer_log.batch_size = settings.TRANSFER_LOG_BATCH_SIZE
+    transfer_log.interval = settings.TRANSFER_LOG_INTERVAL
+    transfer_log.max_pending = settings.TRANSFER_LOG_MAX_PENDING
+    transfer_log.start()
+
+    transfer_retries.interval = settings.SHARD_TRANSFER_RETRY_INTERVAL
+    if is_sharded():
+        transfer_retries.start()
+
+    outbox_dispatcher.send = WebhookSender(settings.OUTBOX_WEBHOOK_URL, timeout=settings.OUTBOX_TIMEOUT)
+    outbox_dispatcher.batch_size = settings.OUTBOX_BATCH_SIZE
+    outbox_dispatcher.concurrency = settings.OUTBOX_CONCURRENCY
+    outbox_dispatcher.backoff = settings.OUTBOX_BACKOFF
+    outbox_dispatcher.max_backoff = settings.OUTBOX_MAX_BACKOFF
+    outbox_dispatcher.interval = settings.OUTBOX_INTERVAL
+    outbox_dispatcher.lease = settings.OUTBOX_LEASE
+    if settings.OUTBOX_WEBHOOK_URL:
+        outbox_dispatcher.start()
+
+    items_compactor.interval = settings.ITEMS_COMPACTION_INTERVAL
+    if settings.ITEMS_COMPACTION_INTERVAL:
+        items_compactor.start()
+
+
+async def stop_background_writers() -> None:
+    """
+    Write everything the background writers still hold and stop them.
+    """
+    await items_batcher.flush()
+    await login_filter_refresher.close()
+    await transfer_log.close()
+    await transfer_retries.close()
+    await outbox_dispatcher.close()
+    await items_compactor.close()
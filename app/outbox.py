@@ -0,0 +1,179 @@
+"""
+Delivery of the notifications in the `outbox` table, see OUTBOX_WEBHOOK_URL.
+
+Notifications are written in the transaction of the change they announce, so
+none is lost and none announces a change that was rolled back. The dispatcher
+leases due rows, picked with FOR UPDATE SKIP LOCKED so that the dispatchers of
+several processes share the work, by moving their `available_at` past the
+lease and committing. It then POSTs their payloads outside any transaction
+and, in a short second one, deletes the rows that were delivered and
+reschedules the others. Rows of a dispatcher that dies are due again once
+their lease is over. Delivery is at least once: a receiver tells repeated
+notifications apart by the `id` in the payload.
+"""
+import asyncio
+import functools
+import logging
+import requests
+import threading
+from databases import Database
+from datetime import datetime
+from typing import Awaitable, Callable, List, Mapping, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+CLAIM_QUERY = '''
+WITH leased AS (
+    UPDATE outbox SET available_at = now() + :lease * interval '1 second'
+    WHERE id IN (
+        SELECT id FROM outbox
+        WHERE available_at <= now()
+        ORDER BY id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, event, payload, created_at, attempts
+)
+SELECT * FROM leased ORDER BY id
+'''
+
+DELETE_QUERY = 'DELETE FROM outbox WHERE id = ANY(:ids)'
+
+# The delay doubles with every attempt, with up to half of it taken off at
+# random so that rows that failed together are not retried together.
+RESCHEDULE_QUERY = '''
+UPDATE outbox SET
+    attempts = attempts + 1,
+    available_at = now() + least(:backoff * 2 ^ attempts, :max_backoff)
+        * (1 - random() / 2) * interval '1 second'
+WHERE id = ANY(:ids)
+'''
+
+
+class WebhookSender:
+    """
+    POSTs JSON bodies to `url`. Requests run in threads, each with a session
+    of its own so that connections are kept alive.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+        self._sessions = threading.local()
+
+    async def __call__(self, event: str, payload: str) -> None:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, functools.partial(self._post, event, payload))
+
+    def _post(self, event: str, payload: str) -> None:
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        response = session.post(
+            self.url,
+            data=payload.encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'X-Event': event},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+
+class OutboxDispatcher:
+    """
+    Delivers the outbox of every database returned by `databases` with
+    `send(event, payload)` in the background until closed. Claimed rows are
+    leased for `lease` seconds, which should outlast the delivery of a batch.
+    """
+
+    def __init__(
+        self,
+        databases: Callable[[], List[Database]],
+        send: Callable[[str, str], Awaitable[None]],
+        batch_size: int,
+        concurrency: int,
+        backoff: float,
+        max_backoff: float,
+        interval: float,
+        lease: float,
+    ):
+        self.send = send
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.interval = interval
+        self.lease = lease
+        self._databases = databases
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def dispatch(self, database: Database) -> int:
+        """
+        Deliver one batch of due notifications of `database` and return the
+        number of rows claimed. No transaction is open while the payloads are
+        POSTed.
+        """
+        # One statement, committed on its own.
+        rows = await database.fetch_all(CLAIM_QUERY, {'limit': self.batch_size, 'lease': self.lease})
+        if not rows:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        delivered = await asyncio.gather(*[self._deliver(row, semaphore) for row in rows])
+        delivered_ids = [row['id'] for row, ok in zip(rows, delivered) if ok]
+        failed_ids = [row['id'] for row, ok in zip(rows, delivered) if not ok]
+        async with database.transaction():
+            if delivered_ids:
+                await database.execute(DELETE_QUERY, {'ids': delivered_ids})
+            if failed_ids:
+                await database.execute(RESCHEDULE_QUERY, {
+                    'ids': failed_ids, 'backoff': self.backoff, 'max_backoff': self.max_backoff,
+                })
+
+        metrics.observe('outbox.batch_size', len(rows))
+        metrics.increment('outbox.delivered', len(delivered_ids))
+        metrics.increment('outbox.failures', len(failed_ids))
+        return len(rows)
+
+    async def _deliver(self, row: Mapping, semaphore: asyncio.Semaphore) -> bool:
+        async with semaphore:
+            try:
+                await self.send(row['event'], row['payload'])
+            except Exception:
+                logger.warning(
+                    'Delivering outbox row %s failed (attempt %s)', row['id'], row['attempts'] + 1,
+                    exc_info=True,
+                )
+                return False
+
+        metrics.observe('outbox.lag', (datetime.now() - row['created_at']).total_seconds())
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = 0
+                for database in self._databases():
+                    claimed += await self.dispatch(database)
+            except Exception:
+                metrics.increment('outbox.dispatch.failures')
+                logger.warning('Dispatching the outbox failed', exc_info=True)
+                claimed = 0
+            # A full batch suggests more due rows.
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,23 @@
+import base64
+import json
+from typing import Any, List
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Encode the sort key of the last returned row as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Decode a cursor made by `encode_cursor`, raise ValueError if it is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f'Invalid cursor: {cursor}') from exc
+    if not isinstance(values, list):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return values
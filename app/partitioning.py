@@ -0,0 +1,84 @@
+"""
+Online backfill of the partitioned items table, between the two migrations
+that partition `items` (3adeed8af3cb and 6b43f9120583):
+
+    DB_URI=postgresql://... python -m app.partitioning --batch-size 10000
+
+Rows are copied in id order, one short transaction per batch, so the
+application keeps writing to `items` meanwhile; the trigger installed by the
+first migration mirrors those writes. Progress is stored in the database: an
+interrupted backfill continues where it stopped.
+"""
+import argparse
+import asyncio
+import time
+from databases import Database
+
+from app import metrics, settings
+
+# FOR SHARE makes a concurrent transfer of a row wait for the batch (or the
+# batch for the transfer), so the mirrored move of an item cannot be undone
+# by copying its old version.
+COPY_BATCH_QUERY = '''
+WITH copied AS (
+    INSERT INTO items_partitioned (id, user_id, name)
+    SELECT id, user_id, name FROM items
+    WHERE id > :last_id AND id <= :upper_id
+    ORDER BY id
+    FOR SHARE
+    ON CONFLICT (user_id, id) DO NOTHING
+    RETURNING 1
+)
+SELECT count(*) FROM copied
+'''
+
+
+async def backfill(database: Database, batch_size: int = 10000, pause: float = 0.0) -> int:
+    """
+    Copy the items that existed when partitioning started into
+    `items_partitioned` and return the number of copied rows. Batches cover
+    `batch_size` ids; `pause` seconds between batches leave room for the
+    application's queries.
+    """
+    copied = 0
+    while True:
+        async with database.transaction():
+            progress = await database.fetch_one(
+                'SELECT last_id, target_id FROM items_partitioned_backfill FOR UPDATE'
+            )
+            if progress['last_id'] >= progress['target_id']:
+                return copied
+
+            upper_id = min(progress['last_id'] + batch_size, progress['target_id'])
+            rows = await database.fetch_val(
+                COPY_BATCH_QUERY, {'last_id': progress['last_id'], 'upper_id': upper_id}
+            )
+            await database.execute(
+                'UPDATE items_partitioned_backfill SET last_id = :upper_id',
+                {'upper_id': upper_id},
+            )
+
+        copied += rows
+        metrics.increment('partitioning.items.backfill.rows', rows)
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--pause', type=float, default=0.0)
+    args = parser.parse_args()
+
+    database = settings.database
+    await database.connect()
+    try:
+        started = time.perf_counter()
+        copied = await backfill(database, args.batch_size, args.pause)
+        print(f'Copied {copied} items in {time.perf_counter() - started:.1f} s')
+    finally:
+        await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import secrets
+import time
+import uuid
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import metrics
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # pragma: no cover
+    Profiler = SpeedscopeRenderer = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests with pyinstrument and writes each profile to
+    `directory` as a speedscope file (https://www.speedscope.app).
+
+    A request is profiled if it sends the `X-Profile` header with `token`, or
+    at random with probability `sample_rate`. Samples are taken every
+    `interval` seconds of wall time and follow the request across awaits, so
+    time spent waiting for the database shows up under the awaiting call.
+    At most `max_concurrent` requests are profiled at a time; others run
+    unprofiled. The response of a profiled request carries `X-Profile-Id`,
+    the name of its profile file.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        directory: str,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        max_concurrent: int = 1,
+        interval: float = 0.001,
+    ) -> None:
+        self.app = app
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_concurrent = max_concurrent
+        self.interval = interval
+        self.running = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or Profiler is None or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self.running >= self.max_concurrent:
+            metrics.increment('profiling.skipped')
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = '{}-{}-{}'.format(
+            time.strftime('%Y%m%dT%H%M%S'),
+            re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_') or 'root',
+            uuid.uuid4().hex[:8],
+        )
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                MutableHeaders(raw=message['headers'])[PROFILE_ID_HEADER] = profile_id
+            await send(message)
+
+        self.running += 1
+        profiler = Profiler(interval=self.interval, async_mode='enabled')
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            self.running -= 1
+            metrics.increment('profiling.profiles')
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.write, profile_id, profiler
+            )
+
+    def wants_profile(self, scope: Scope) -> bool:
+        if self.token:
+            header = Headers(scope=scope).get(PROFILE_HEADER)
+            if header is not None and secrets.compare_digest(header.encode(), self.token.encode()):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def write(self, profile_id: str, profiler: 'Profiler') -> None:
+        path = os.path.join(self.directory, f'{profile_id}.speedscope.json')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(profiler.output(renderer=SpeedscopeRenderer()))
+        except Exception:
+            logger.exception('Writing profile %s failed', path)
@@ -0,0 +1,108 @@
+"""
+Recount of the daily transfer stats (`transfer_daily_stats`) from the
+transfer events, e.g. after migrating a database that has events already:
+
+    DB_URI=postgresql://... python -m app.rollups --chunk-size 10000 --concurrency 4
+
+recounts the database or, with DB_SHARD_URIS, every shard. Users are recounted
+in chunks of `--chunk-size` consecutive ids, `--concurrency` chunks at a time,
+each in a transaction of its own. A chunk holds a SHARE lock on
+`transfer_events` while it runs: chunks run side by side, but new events and
+the stats counted with them wait for the chunks, which only holds up the
+background writer of the transfer log, not the confirmations.
+"""
+import argparse
+import asyncio
+import contextvars
+import time
+from databases import Database
+from typing import List
+
+from app import metrics
+from .sharding import shard_databases
+
+DELETE_CHUNK_QUERY = '''
+DELETE FROM transfer_daily_stats WHERE user_id >= :lower AND user_id < :upper
+'''
+
+# Every event is on the shards of both of its users; a shard only counts its
+# own users.
+COUNT_CHUNK_QUERY = '''
+WITH counted AS (
+    INSERT INTO transfer_daily_stats (user_id, day, sent_count, received_count)
+    SELECT user_id, day, sum(sent), sum(received) FROM (
+        SELECT from_user_id AS user_id, CAST(created_at AS date) AS day, 1 AS sent, 0 AS received
+        FROM transfer_events WHERE from_user_id >= :lower AND from_user_id < :upper
+        UNION ALL
+        SELECT to_user_id, CAST(created_at AS date), 0, 1
+        FROM transfer_events WHERE to_user_id >= :lower AND to_user_id < :upper
+    ) AS transfers
+    WHERE user_id % :shard_count = :shard_index
+    GROUP BY user_id, day
+    RETURNING 1
+)
+SELECT count(*) FROM counted
+'''
+
+
+async def rebuild_chunk(
+    database: Database, lower: int, upper: int, shard_index: int = 0, shard_count: int = 1
+) -> int:
+    """
+    Recount the stats of the users from `lower` to `upper` (exclusive) on
+    shard number `shard_index` of `shard_count`, and return the number of
+    stats rows.
+    """
+    async with database.transaction():
+        await database.execute('LOCK TABLE transfer_events IN SHARE MODE')
+        await database.execute(DELETE_CHUNK_QUERY, {'lower': lower, 'upper': upper})
+        return await database.fetch_val(COUNT_CHUNK_QUERY, {
+            'lower': lower, 'upper': upper, 'shard_index': shard_index, 'shard_count': shard_count,
+        })
+
+
+async def rebuild(databases: List[Database], chunk_size: int = 10000, concurrency: int = 4) -> int:
+    """
+    Recount the stats of all users on the shards `databases`, and return the
+    number of stats rows.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(database: Database, lower: int, shard_index: int) -> int:
+        async with semaphore:
+            rows = await rebuild_chunk(database, lower, lower + chunk_size, shard_index, len(databases))
+        metrics.increment('rollups.transfer_stats.rebuild.rows', rows)
+        return rows
+
+    chunks = []
+    for shard_index, database in enumerate(databases):
+        bounds = await database.fetch_one('SELECT min(id) AS lower, max(id) AS upper FROM users')
+        if bounds['lower'] is None:
+            continue
+        for lower in range(bounds['lower'], bounds['upper'] + 1, chunk_size):
+            # A task uses the connection of the task that created it unless
+            # it starts from an empty context.
+            chunks.append(contextvars.Context().run(asyncio.ensure_future, run(database, lower, shard_index)))
+    return sum(await asyncio.gather(*chunks))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    databases = shard_databases()
+    for database in databases:
+        await database.connect()
+    try:
+        started = time.perf_counter()
+        rows = await rebuild(databases, args.chunk_size, args.concurrency)
+        print(f'Counted {rows} daily stats in {time.perf_counter() - started:.1f} s')
+    finally:
+        for database in databases:
+            await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
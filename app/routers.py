@@ -1,18 +1,68 @@
-from fastapi import APIRouter, HTTPException
-from fastapi import FastAPI, Depends, HTTPException
+import asyncpg
+import secrets
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.requests import Request
 from starlette import status
-from starlette.responses import JSONResponse
-from typing import List
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from typing import Dict, List, Optional, Tuple, Union
 
 import app.schemas as sc
-from .models import ItemModel, SendingModel, SendingStatus, UserModel
-from .settings import HOST, PORT
+from app import metrics, settings
+from .connections import request_connection
+from .deadlines import DeadlineRoute
+from .encoding import MSGPACK, MessagePackResponse, MessagePackRoute, msgpack, negotiate
+from .export import MEDIA_TYPES, encode_chunks
+from .importing import ImportFormatError, LineParser
+from .models import (
+    ExportModel,
+    ItemModel,
+    SendingModel,
+    SendingStatus,
+    TransferEventModel,
+    TransferStatsModel,
+    UserModel,
+)
+
+
+class Route(DeadlineRoute, MessagePackRoute):
+    """Routes with a deadline, taking MessagePack bodies as well as JSON ones."""
 
-router = APIRouter()
+
+router = APIRouter(dependencies=[Depends(request_connection)], route_class=Route)
 
 bearer_scheme = HTTPBearer()
 
+MAX_DELETE_IDS = 1000
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 366
+
+
+def check_format(format_: sc.DataFormat) -> None:
+    if format_ == sc.DataFormat.MSGPACK and msgpack is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='MessagePack is not supported',
+        )
+
+
+def stats_range(start: Optional[date], end: Optional[date]) -> Tuple[date, date]:
+    end = end or date.today()
+    start = start or end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    if start > end or (end - start).days >= STATS_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid date range',
+        )
+    return start, end
+
+
+def is_admin(token: HTTPAuthorizationCredentials) -> bool:
+    return bool(settings.ADMIN_TOKEN) and secrets.compare_digest(
+        token.credentials, settings.ADMIN_TOKEN
+    )
+
 
 @router.post(
     '/registration',
@@ -25,9 +75,14 @@ bearer_scheme = HTTPBearer()
 async def register_user(request: sc.RegisterUserRequest) -> sc.RegisterUserResponse:
     already_registered = await UserModel.is_registered(request.login)
     if not already_registered:
-        await UserModel.create(request.login, request.password)
-
-        registration_succeeded = await UserModel.is_registered(request.login)
+        try:
+            await UserModel.create(request.login, request.password)
+        except asyncpg.UniqueViolationError:
+            # Registered meanwhile, or through another process before the
+            # login filter of this one has seen it.
+            registration_succeeded = False
+        else:
+            registration_succeeded = await UserModel.is_registered(request.login)
         if registration_succeeded:
             return sc.RegisterUserResponse(detail='User has been registered')
 
@@ -57,16 +112,22 @@ async def login_user(request: sc.AuthorizeUserRequest) -> sc.AuthorizeUserRespon
     status_code=status.HTTP_201_CREATED,
     response_model=sc.CreateItemResponse,
     description='''
-    Create an item for an authorized user.
+    Create an item for an authorized user. The body can be MessagePack
+    instead of JSON, and so can the response (`Accept: application/msgpack`).
     '''
 )
 async def create_item(
         request: sc.CreateItemRequest,
         token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-) -> sc.CreateItemResponse:
+        accept: Optional[str] = Header(None),
+) -> Union[sc.CreateItemResponse, Response]:
     user = await UserModel.get_authorized(token.credentials)
     if user:
         item_id = await ItemModel.create(name=request.name, user_id=user['id'])
+        if negotiate(accept) == MSGPACK:
+            return MessagePackResponse(
+                {'id': item_id, 'name': request.name}, status_code=status.HTTP_201_CREATED,
+            )
         return sc.CreateItemResponse(id=item_id, name=request.name)
 
     raise HTTPException(
@@ -75,6 +136,41 @@ async def create_item(
     )
 
 
+@router.delete(
+    '/items',
+    status_code=status.HTTP_200_OK,
+    response_model=sc.DeleteItemsResponse,
+    description='''
+    Remove items of an authorized user given as `?ids=1&ids=2`, together with
+    their pending sendings. Return the ids of the removed items; ids of
+    missing items or of items of other users are ignored. The response can
+    be MessagePack (`Accept: application/msgpack`).
+    '''
+)
+async def delete_items(
+        ids: List[int] = Query(...),
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+        accept: Optional[str] = Header(None),
+) -> Union[sc.DeleteItemsResponse, Response]:
+    user = await UserModel.get_authorized(token.credentials)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    if len(ids) > MAX_DELETE_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {MAX_DELETE_IDS} items can be removed at once',
+        )
+
+    deleted = await ItemModel.delete_many(ids, user_id=user['id'])
+    if negotiate(accept) == MSGPACK:
+        return MessagePackResponse({'deleted': deleted})
+    return sc.DeleteItemsResponse(deleted=deleted)
+
+
 @router.delete(
     '/items/{id}',
     status_code=status.HTTP_204_NO_CONTENT,
@@ -88,7 +184,7 @@ async def delete_item(
 ) -> JSONResponse:
     user = await UserModel.get_authorized(token.credentials)
     if user:
-        item_id = await ItemModel.delete(request.id)
+        item_id = await ItemModel.delete(request.id, user_id=user['id'])
         if item_id:
             return JSONResponse(
                 status_code=status.HTTP_204_NO_CONTENT,
@@ -110,16 +206,42 @@ async def delete_item(
     status_code=status.HTTP_200_OK,
     response_model=List[sc.ItemSchema],
     description='''
-    Return a list of items for an authorized user.
+    Return a list of items for an authorized user. Items can be searched by
+    name with `q` and sorted by `id` or `name` (prefix with `-` to reverse).
+    If `limit` is given and the page is full, the `X-Next-Cursor` header
+    holds the `cursor` of the next page. The list is MessagePack instead of
+    JSON with `Accept: application/msgpack`.
     '''
 )
 async def list_items(
+        q: Optional[str] = None,
+        match: sc.SearchMode = sc.SearchMode.SUBSTRING,
+        sort: sc.ItemSort = sc.ItemSort.ID,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
         token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-) -> List[sc.ItemSchema]:
+        accept: Optional[str] = Header(None),
+) -> Response:
     user = await UserModel.get_authorized(token.credentials)
     if user:
-        items = await ItemModel.list(user_id=user['id'])
-        return items
+        media_type = negotiate(accept)
+        try:
+            # Already encoded, and possibly cached, so the response bypasses
+            # `response_model`.
+            body, next_cursor = await ItemModel.list_encoded(
+                user_id=user['id'], q=q, match=match, sort=sort, cursor=cursor, limit=limit,
+                media_type=media_type,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Invalid cursor',
+            )
+
+        response = Response(content=body, media_type=media_type, headers={'Vary': 'Accept'})
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -127,6 +249,99 @@ async def list_items(
     )
 
 
+@router.get(
+    '/items/summary',
+    status_code=status.HTTP_200_OK,
+    response_model=sc.ItemsSummaryResponse,
+    description='''
+    Return the number of items and of pending outgoing and incoming sendings
+    of an authorized user.
+    '''
+)
+async def get_items_summary(
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> sc.ItemsSummaryResponse:
+    user = await UserModel.get_authorized(token.credentials)
+    if user:
+        summary = await ItemModel.summary(user_id=user['id'])
+        return sc.ItemsSummaryResponse(**summary)
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Token has not been authorized',
+    )
+
+
+@router.get(
+    '/items/export',
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    description='''
+    Stream all items of an authorized user as CSV, NDJSON or MessagePack.
+    '''
+)
+async def export_items(
+        format: sc.DataFormat = sc.DataFormat.CSV,
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> StreamingResponse:
+    check_format(format)
+    user = await UserModel.get_authorized(token.credentials)
+    if user:
+        chunks = ItemModel.iterate_chunks(user_id=user['id'], chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return StreamingResponse(
+            encode_chunks(chunks, format, columns=['id', 'name']),
+            media_type=MEDIA_TYPES[format],
+        )
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Token has not been authorized',
+    )
+
+
+@router.post(
+    '/items/import',
+    status_code=status.HTTP_201_CREATED,
+    response_model=sc.ImportItemsResponse,
+    description='''
+    Create items for an authorized user from a streamed CSV (with a `name`
+    column), NDJSON (objects with a `name` key) or MessagePack (maps with a
+    `name` key) body. Malformed lines are skipped and reported with their
+    line numbers; all other items are created in one transaction.
+    '''
+)
+async def import_items(
+        request: Request,
+        format: sc.DataFormat = sc.DataFormat.CSV,
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> sc.ImportItemsResponse:
+    check_format(format)
+    user = await UserModel.get_authorized(token.credentials)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    parser = LineParser(
+        format,
+        max_line_length=settings.IMPORT_MAX_LINE_LENGTH,
+        max_errors=settings.IMPORT_MAX_ERRORS,
+    )
+    try:
+        imported = await ItemModel.import_names(
+            user_id=user['id'], names=parser.names(request.stream()),
+        )
+    except ImportFormatError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    return sc.ImportItemsResponse(
+        imported=imported,
+        rejected=parser.rejected,
+        errors=[sc.ImportLineError(line=line, detail=detail) for line, detail in parser.errors],
+    )
+
+
 @router.post(
     '/send',
     status_code=status.HTTP_201_CREATED,
@@ -139,36 +354,30 @@ async def send_item(
         request: sc.SendItemRequest,
         token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
 ) -> sc.SendItemResponse:
-    sender = await UserModel.get_authorized(token.credentials)
-    if not sender:
+    sending = await SendingModel.send(token.credentials, request.id, request.recipient_login)
+    if sending['sender_id'] is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Token has not been authorized',
         )
-    if sender['login'] == request.recipient_login:
+    if sending['sender_login'] == request.recipient_login:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Cannot send an item to yourself',
         )
-
-    item = await ItemModel.get(request.id)
-    if not item:
+    if sending['recipient_id'] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail='Item has not been found',
+            detail='Recipient has not been found',
         )
-
-    recipient = await UserModel.get_by_login(request.recipient_login)
-    if not recipient:
+    if not sending['item_found']:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail='Recipient has not been found',
+            detail='Item has not been found',
         )
 
-    item_token = await SendingModel.initiate_sending(
-        from_user_id=sender['id'], to_user_id=recipient['id'], item_id=request.id
-    )
-    url = f'http://{HOST}:{PORT}/get/?item_token={item_token}'
+    item_token = sending['item_token']
+    url = f'http://{settings.HOST}:{settings.PORT}/get/?item_token={item_token}'
     return sc.SendItemResponse(confirmation_url=url)
 
 
@@ -210,6 +419,12 @@ async def confirm_sending(
             detail='Sending has not been found',
         )
 
+    if sending_status == SendingStatus.LOCKED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Sending is being confirmed',
+        )
+
     if sending_status == sending_status.COMPLETED:
         return JSONResponse(content={'detail': 'Item has been received'})
 
@@ -217,3 +432,171 @@ async def confirm_sending(
         status_code=status.HTTP_400_BAD_REQUEST,
         detail='Bad request',
     )
+
+
+@router.get(
+    '/transfers',
+    status_code=status.HTTP_200_OK,
+    response_model=List[sc.TransferEventSchema],
+    description='''
+    Return items sent and received by an authorized user, newest first. If the
+    page is full, the `X-Next-Cursor` header holds the `cursor` of the next
+    page. Transfers show up here shortly after they have been confirmed.
+    ''',
+)
+async def list_transfers(
+        response: Response,
+        cursor: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> List[sc.TransferEventSchema]:
+    user = await UserModel.get_authorized(token.credentials)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    try:
+        events = await TransferEventModel.list(user_id=user['id'], cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor',
+        )
+
+    if len(events) == limit:
+        response.headers['X-Next-Cursor'] = TransferEventModel.cursor(events[-1])
+    return events
+
+
+@router.get(
+    '/stats/daily',
+    status_code=status.HTTP_200_OK,
+    response_model=List[sc.DailyTransferStatsSchema],
+    description='''
+    Return the number of items an authorized user sent and received per day,
+    for the days from `start` to `end` (the last 30 days by default, at most
+    366 days) on which there were any. Transfers are counted shortly after
+    they have been confirmed.
+    ''',
+)
+async def get_daily_stats(
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> List[sc.DailyTransferStatsSchema]:
+    user = await UserModel.get_authorized(token.credentials)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    start, end = stats_range(start, end)
+    stats = await TransferStatsModel.daily(user_id=user['id'], start=start, end=end)
+    return [sc.DailyTransferStatsSchema(**day) for day in stats]
+
+
+@router.get(
+    '/stats/top-senders',
+    status_code=status.HTTP_200_OK,
+    response_model=List[sc.TopSenderSchema],
+    description='''
+    Return the users who sent the most items from `start` to `end` (the last
+    30 days by default, at most 366 days), most items first.
+    Requires the admin token.
+    ''',
+)
+async def get_top_senders(
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        limit: int = Query(10, ge=1, le=100),
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> List[sc.TopSenderSchema]:
+    if not is_admin(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    start, end = stats_range(start, end)
+    senders = await TransferStatsModel.top_senders(start=start, end=end, limit=limit)
+    return [sc.TopSenderSchema(**sender) for sender in senders]
+
+
+@router.get(
+    '/sendings/{direction}',
+    status_code=status.HTTP_200_OK,
+    response_model=List[sc.PendingSendingSchema],
+    description='''
+    Return sendings to (`incoming`) or from (`outgoing`) an authorized user
+    that have not been confirmed yet, newest first. `item_token` is the token
+    of the confirmation URL. If the page is full, the `X-Next-Cursor` header
+    holds the `cursor` of the next page.
+    ''',
+)
+async def list_sendings(
+        direction: sc.SendingDirection,
+        response: Response,
+        cursor: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> List[sc.PendingSendingSchema]:
+    user = await UserModel.get_authorized(token.credentials)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    try:
+        sendings = await SendingModel.list(
+            user_id=user['id'], direction=direction, cursor=cursor, limit=limit,
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor',
+        )
+
+    if len(sendings) == limit:
+        response.headers['X-Next-Cursor'] = SendingModel.cursor(sendings[-1])
+    return sendings
+
+
+@router.get(
+    '/admin/export/{table}',
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    description='''
+    Stream a whole table as CSV straight from `COPY ... TO STDOUT`.
+    Requires the admin token.
+    ''',
+)
+async def export_table(
+        table: sc.ExportTable,
+        token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> StreamingResponse:
+    if not is_admin(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token has not been authorized',
+        )
+
+    return StreamingResponse(
+        ExportModel.copy_table(table.value),
+        media_type=MEDIA_TYPES[sc.DataFormat.CSV],
+    )
+
+
+@router.get(
+    '/metrics',
+    status_code=status.HTTP_200_OK,
+    response_model=Dict[str, Union[int, float]],
+    description='''
+    Return internal counters of the running process.
+    ''',
+)
+async def get_metrics() -> Dict[str, Union[int, float]]:
+    return metrics.snapshot()
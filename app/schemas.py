@@ -1,4 +1,7 @@
+from datetime import date, datetime
+from enum import Enum
 from pydantic import BaseModel
+from typing import List
 
 
 class RegisterUserRequest(BaseModel):
@@ -53,6 +56,13 @@ class DeleteItemRequest(BaseModel):
         orm_mode = True
 
 
+class DeleteItemsResponse(BaseModel):
+    deleted: List[int]
+
+    class Config:
+        orm_mode = True
+
+
 class ItemSchema(BaseModel):
     id: int
     name: str
@@ -61,6 +71,63 @@ class ItemSchema(BaseModel):
         orm_mode = True
 
 
+class ItemsSummaryResponse(BaseModel):
+    items_count: int
+    outgoing_sendings_count: int
+    incoming_sendings_count: int
+
+    class Config:
+        orm_mode = True
+
+
+class ItemSort(str, Enum):
+    ID = 'id'
+    ID_DESC = '-id'
+    NAME = 'name'
+    NAME_DESC = '-name'
+
+
+class SearchMode(str, Enum):
+    SUBSTRING = 'substring'
+    PREFIX = 'prefix'
+
+
+class SendingDirection(str, Enum):
+    INCOMING = 'incoming'
+    OUTGOING = 'outgoing'
+
+
+class ImportLineError(BaseModel):
+    line: int
+    detail: str
+
+    class Config:
+        orm_mode = True
+
+
+class ImportItemsResponse(BaseModel):
+    imported: int
+    rejected: int
+    errors: List[ImportLineError]
+
+    class Config:
+        orm_mode = True
+
+
+class DataFormat(str, Enum):
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+    MSGPACK = 'msgpack'
+
+
+class ExportTable(str, Enum):
+    USERS = 'users'
+    ITEMS = 'items'
+    SENDINGS = 'sendings'
+    USER_COUNTERS = 'user_counters'
+    TRANSFER_EVENTS = 'transfer_events'
+
+
 class SendItemRequest(BaseModel):
     id: int
     recipient_login: str
@@ -74,3 +141,43 @@ class SendItemResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class PendingSendingSchema(BaseModel):
+    id: int
+    item_id: int
+    item_name: str
+    from_user_id: int
+    to_user_id: int
+    item_token: str
+
+    class Config:
+        orm_mode = True
+
+
+class TransferEventSchema(BaseModel):
+    id: int
+    item_id: int
+    from_user_id: int
+    to_user_id: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class DailyTransferStatsSchema(BaseModel):
+    day: date
+    sent_count: int
+    received_count: int
+
+    class Config:
+        orm_mode = True
+
+
+class TopSenderSchema(BaseModel):
+    login: str
+    sent_count: int
+
+    class Config:
+        orm_mode = True
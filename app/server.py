@@ -0,0 +1,62 @@
+"""
+Production server: gunicorn supervising uvicorn workers on uvloop and
+httptools, configured by the WEB_CONCURRENCY and SERVER_* settings.
+
+    python -m app.server
+
+Building the application opens neither connections nor event loops, so it
+is safe to build it in the master before forking (SERVER_PRELOAD): workers
+share its memory and each opens its own pools on startup. SIGHUP replaces
+the workers gracefully; with SERVER_PRELOAD new code needs a new master
+(SIGUSR2, then SIGTERM to the old one) or a restart.
+"""
+from gunicorn.app.base import BaseApplication
+from starlette.types import ASGIApp
+from typing import Any, Dict
+from uvicorn.workers import UvicornWorker
+
+from app import settings
+
+
+class Worker(UvicornWorker):
+    # Explicit rather than "auto", so that a missing package fails the start
+    # instead of silently falling back to asyncio and h11.
+    CONFIG_KWARGS = {'loop': 'uvloop', 'http': 'httptools'}
+
+
+class Server(BaseApplication):
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self) -> ASGIApp:
+        from main import create_app
+
+        return create_app()
+
+
+def options() -> Dict[str, Any]:
+    return {
+        'bind': f'{settings.HOST}:{settings.PORT}',
+        'workers': settings.WEB_CONCURRENCY,
+        'worker_class': 'app.server.Worker',
+        'backlog': settings.SERVER_BACKLOG,
+        'keepalive': settings.SERVER_KEEPALIVE,
+        'graceful_timeout': settings.SERVER_GRACEFUL_TIMEOUT,
+        'max_requests': settings.SERVER_MAX_REQUESTS,
+        # Workers started together are not all replaced together.
+        'max_requests_jitter': settings.SERVER_MAX_REQUESTS // 10,
+        'preload_app': settings.SERVER_PRELOAD,
+    }
+
+
+def main() -> None:
+    Server(options()).run()
+
+
+if __name__ == '__main__':
+    main()
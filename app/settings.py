@@ -1,12 +1,204 @@
 import os
+from typing import Any, Dict
 
 import sqlalchemy
-from databases import Database
 
-
-database = Database(os.environ['DB_URI'], max_size=20)
 metadata = sqlalchemy.MetaData()
 
+# The database is created on first use of `settings.database`, so importing
+# the application needs neither DB_URI nor the database driver. The pool
+# opens DB_MIN_SIZE connections on connect and grows up to DB_MAX_SIZE.
+DB_URI = os.environ.get('DB_URI')
+DB_MIN_SIZE = int(os.environ.get('DB_MIN_SIZE', 1))
+DB_MAX_SIZE = int(os.environ.get('DB_MAX_SIZE', 20))
+# Model calls of a request share one connection, checked out on first use.
+DB_REQUEST_CONNECTION = os.environ.get('DB_REQUEST_CONNECTION', '1') == '1'
+
+# With DB_SHARD_URIS (comma-separated) the data of a user (items, sendings,
+# counters, transfer events) lives on shard number `user_id % len(shards)`,
+# and DB_URI is the directory that maps logins and tokens to user ids. Every
+# shard has its own pool of DB_MIN_SIZE to DB_MAX_SIZE connections. Without
+# shards DB_URI holds everything. Transfers between shards that could not be
+# delivered right away are retried every SHARD_TRANSFER_RETRY_INTERVAL seconds.
+DB_SHARD_URIS = [uri for uri in os.environ.get('DB_SHARD_URIS', '').split(',') if uri]
+SHARD_TRANSFER_RETRY_INTERVAL = float(os.environ.get('SHARD_TRANSFER_RETRY_INTERVAL', 5))
+
+
+def parse_route_deadlines(value: str) -> Dict[str, float]:
+    """Parse comma-separated `route_name=seconds`."""
+    deadlines = {}
+    for route in value.split(','):
+        if not route:
+            continue
+        name, _, seconds = route.partition('=')
+        try:
+            if not name:
+                raise ValueError
+            deadlines[name] = float(seconds)
+        except ValueError:
+            raise ValueError(f'Invalid ROUTE_DEADLINES entry {route!r}, expected route_name=seconds') from None
+    return deadlines
+
+
+# A request gets 504 once it has run for REQUEST_DEADLINE seconds (0 for no
+# deadline), or for the seconds ROUTE_DEADLINES (comma-separated
+# `route_name=seconds`) gives its route. What is left of the deadline bounds
+# the request's queries as Postgres statement_timeout, set whenever a
+# connection is checked out and a transaction starts: with
+# DB_REQUEST_CONNECTION every query of a request that shares its connection
+# keeps the bound of the checkout, which the deadline itself enforces.
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 30))
+ROUTE_DEADLINES = parse_route_deadlines(
+    os.environ.get('ROUTE_DEADLINES', 'export_items=0,import_items=0,export_table=0')
+)
+
 TOKEN_TTL = 86400
-HOST = os.environ['HOST']
-PORT = os.environ['PORT']
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = os.environ.get('PORT', '8000')
+
+# `python -m app.server` runs WEB_CONCURRENCY workers (one per core by
+# default), each with its own pool, on one socket queueing up to
+# SERVER_BACKLOG connections. Idle keep-alive connections are closed after
+# SERVER_KEEPALIVE seconds, and stopped workers get SERVER_GRACEFUL_TIMEOUT
+# seconds to finish their requests. Workers are replaced after about
+# SERVER_MAX_REQUESTS requests (0 never). With SERVER_PRELOAD the application
+# is built once before the workers are forked.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', 2048))
+SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
+SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 0))
+SERVER_PRELOAD = os.environ.get('SERVER_PRELOAD', '1') == '1'
+
+# Logins of registered users are kept in a Bloom filter in every process, so
+# that looking up a login that is not registered needs no query. It is sized
+# for LOGIN_FILTER_CAPACITY logins (0 disables it) with
+# LOGIN_FILTER_ERROR_RATE false positives, 1.2 MB per million logins at 1%.
+# Logins registered through other processes are added every
+# LOGIN_FILTER_REFRESH_INTERVAL seconds.
+LOGIN_FILTER_CAPACITY = int(os.environ.get('LOGIN_FILTER_CAPACITY', 1000000))
+LOGIN_FILTER_ERROR_RATE = float(os.environ.get('LOGIN_FILTER_ERROR_RATE', 0.01))
+LOGIN_FILTER_REFRESH_INTERVAL = float(os.environ.get('LOGIN_FILTER_REFRESH_INTERVAL', 1))
+
+# Opt-in micro-batching of `ItemModel.create`: inserts arriving within
+# ITEMS_BATCH_WINDOW seconds, or up to ITEMS_BATCH_MAX_SIZE rows, are written
+# with one multi-row INSERT. Batches are written with a pool connection of
+# their own: the requests waiting for a batch keep the connections they hold
+# (DB_REQUEST_CONNECTION), so batching saves round trips and commits, not
+# connections.
+ITEMS_BATCH_ENABLED = os.environ.get('ITEMS_BATCH_ENABLED', '0') == '1'
+ITEMS_BATCH_WINDOW = float(os.environ.get('ITEMS_BATCH_WINDOW', 0.002))
+ITEMS_BATCH_MAX_SIZE = int(os.environ.get('ITEMS_BATCH_MAX_SIZE', 100))
+
+# GET /items responses can be cached per user in memory, up to
+# ITEMS_CACHE_MAX_BYTES bytes of JSON (0, the default, disables the cache).
+# Writes of this process invalidate them right away, but writes of other
+# processes go unnoticed for up to ITEMS_CACHE_TTL seconds: with several
+# workers a client may not read its own writes, so the cache is only for
+# deployments of a single process or that can live with stale lists.
+ITEMS_CACHE_MAX_BYTES = int(os.environ.get('ITEMS_CACHE_MAX_BYTES', 0))
+ITEMS_CACHE_TTL = float(os.environ.get('ITEMS_CACHE_TTL', 30))
+
+# Transfer events are written behind the confirmation request, in batches of
+# up to TRANSFER_LOG_BATCH_SIZE rows collected for TRANSFER_LOG_INTERVAL
+# seconds. At most TRANSFER_LOG_MAX_PENDING events are kept in memory.
+TRANSFER_LOG_BATCH_SIZE = int(os.environ.get('TRANSFER_LOG_BATCH_SIZE', 500))
+TRANSFER_LOG_INTERVAL = float(os.environ.get('TRANSFER_LOG_INTERVAL', 0.1))
+TRANSFER_LOG_MAX_PENDING = int(os.environ.get('TRANSFER_LOG_MAX_PENDING', 10000))
+
+# Deleted items stay in `items` as tombstones until a background compactor
+# deletes them, every ITEMS_COMPACTION_INTERVAL seconds (0 disables it), in
+# batches of ITEMS_COMPACTION_BATCH_SIZE rows with ITEMS_COMPACTION_PAUSE
+# seconds between batches.
+ITEMS_COMPACTION_INTERVAL = float(os.environ.get('ITEMS_COMPACTION_INTERVAL', 60))
+ITEMS_COMPACTION_BATCH_SIZE = int(os.environ.get('ITEMS_COMPACTION_BATCH_SIZE', 1000))
+ITEMS_COMPACTION_PAUSE = float(os.environ.get('ITEMS_COMPACTION_PAUSE', 0.1))
+
+# With OUTBOX_WEBHOOK_URL set, sent and received items are recorded in the
+# `outbox` table in the transaction of the change and POSTed to the URL by a
+# background dispatcher: OUTBOX_BATCH_SIZE rows at a time, at most
+# OUTBOX_CONCURRENCY requests in flight, each given OUTBOX_TIMEOUT seconds.
+# Failed deliveries are retried after OUTBOX_BACKOFF seconds, doubling up to
+# OUTBOX_MAX_BACKOFF. An idle dispatcher polls every OUTBOX_INTERVAL seconds.
+# Claimed rows are leased to a dispatcher for OUTBOX_LEASE seconds, after which
+# another one may deliver them again; it should outlast the POSTs of a batch.
+OUTBOX_WEBHOOK_URL = os.environ.get('OUTBOX_WEBHOOK_URL')
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', 10))
+OUTBOX_TIMEOUT = float(os.environ.get('OUTBOX_TIMEOUT', 5))
+OUTBOX_BACKOFF = float(os.environ.get('OUTBOX_BACKOFF', 1))
+OUTBOX_MAX_BACKOFF = float(os.environ.get('OUTBOX_MAX_BACKOFF', 300))
+OUTBOX_INTERVAL = float(os.environ.get('OUTBOX_INTERVAL', 1))
+OUTBOX_LEASE = float(os.environ.get('OUTBOX_LEASE', 60))
+
+# Rows fetched from the server-side cursor per chunk of GET /items/export.
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+# Bearer token of the /admin endpoints and GET /stats/top-senders, which are
+# disabled when it is not set.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# POST /items/import reports at most IMPORT_MAX_ERRORS rejected lines and
+# refuses lines longer than IMPORT_MAX_LINE_LENGTH characters.
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 100))
+IMPORT_MAX_LINE_LENGTH = int(os.environ.get('IMPORT_MAX_LINE_LENGTH', 65536))
+
+# Responses are compressed with the first of COMPRESSION_ENCODINGS that the
+# client accepts and that is installed (br needs `brotli`, zstd needs
+# `zstandard`). Bodies shorter than COMPRESSION_MINIMUM_SIZE bytes are sent
+# as they are. Levels are those of the respective library.
+COMPRESSION_ENCODINGS = os.environ.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip').split(',')
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+
+# Requests sending `X-Profile: <PROFILE_TOKEN>`, and a PROFILE_SAMPLE_RATE
+# fraction of all requests, are profiled with pyinstrument (if installed).
+# Profiles are written to PROFILE_DIR; at most PROFILE_MAX_CONCURRENT
+# requests are profiled at a time, sampling every PROFILE_INTERVAL seconds.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_MAX_CONCURRENT = int(os.environ.get('PROFILE_MAX_CONCURRENT', 1))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.001))
+
+
+def configure(**options: Any) -> None:
+    """
+    Override settings, e.g. `configure(DB_URI=..., ITEMS_BATCH_ENABLED=True)`.
+    A ready `database` and ready `shards` can be passed as well. Settings are
+    module globals, so they change for the whole process.
+    """
+    for name, value in options.items():
+        if name not in ('database', 'shards') and (not name.isupper() or name not in globals()):
+            raise ValueError(f'Unknown setting {name}')
+        globals()[name] = value
+
+    if 'database' not in options and options.keys() & {'DB_URI', 'DB_MIN_SIZE', 'DB_MAX_SIZE'}:
+        globals().pop('database', None)
+    if 'shards' not in options and options.keys() & {'DB_SHARD_URIS', 'DB_MIN_SIZE', 'DB_MAX_SIZE'}:
+        globals().pop('shards', None)
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'database':
+        from app.connections import InstrumentedDatabase
+
+        if DB_URI is None:
+            raise RuntimeError('DB_URI is not configured')
+        database = InstrumentedDatabase(DB_URI, min_size=DB_MIN_SIZE, max_size=DB_MAX_SIZE)
+        globals()['database'] = database
+        return database
+
+    if name == 'shards':
+        from app.connections import InstrumentedDatabase
+
+        shards = [
+            InstrumentedDatabase(uri, min_size=DB_MIN_SIZE, max_size=DB_MAX_SIZE)
+            for uri in DB_SHARD_URIS
+        ]
+        globals()['shards'] = shards
+        return shards
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
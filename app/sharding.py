@@ -0,0 +1,92 @@
+"""
+Routing of the data of a user to its shard, see DB_SHARD_URIS.
+
+Shards run the same migrations as the directory database. Users are kept in
+the directory; every shard has a placeholder row per user so that its
+foreign keys to `users` hold. Items keep their id when they move to another
+shard, so ids must not collide between shards:
+
+    DB_URI=... DB_SHARD_URIS=... python -m app.sharding
+
+sets the id sequences of shard number k to k, k + N, k + 2N, ... Run it
+once after migrating new shards.
+"""
+import asyncio
+from databases import Database
+from typing import List, Union
+
+from app import settings
+from .connections import RequestConnection, current_database
+
+SEQUENCES = ['items_id_seq', 'sendings_id_seq', 'transfer_events_id_seq', 'outgoing_transfers_id_seq']
+
+
+def shard_databases() -> List[Database]:
+    """
+    The shards, or the directory database alone if there are none.
+    """
+    return settings.shards or [settings.database]
+
+
+def is_sharded() -> bool:
+    return bool(settings.shards)
+
+
+def shard_database(user_id: int) -> Database:
+    databases = shard_databases()
+    return databases[user_id % len(databases)]
+
+
+def shard(user_id: int) -> Union[Database, RequestConnection]:
+    """
+    The connection to the shard of a user, see `current_database`.
+    """
+    return current_database(shard_database(user_id))
+
+
+async def prepare_sequences(databases: List[Database]) -> None:
+    count = len(databases)
+    for index, database in enumerate(databases):
+        for sequence in SEQUENCES:
+            last_value = await database.fetch_val(f'SELECT last_value FROM {sequence}')
+            # The first value after last_value that is `index` modulo `count`.
+            start = last_value + 1 + (index - last_value - 1) % count
+            await database.execute(
+                f'ALTER SEQUENCE {sequence} INCREMENT BY {count} RESTART WITH {start}'
+            )
+
+
+async def check_sequences(databases: List[Database]) -> None:
+    """
+    Raise RuntimeError if `prepare_sequences` has not been run for the shards.
+    """
+    if len(databases) < 2:
+        return
+
+    for database in databases:
+        increment = await database.fetch_val(
+            "SELECT increment_by FROM pg_sequences WHERE sequencename = 'items_id_seq'"
+        )
+        # A larger increment, e.g. of shards prepared for more shards than
+        # are in use, keeps ids apart as well.
+        if increment < len(databases):
+            raise RuntimeError(
+                f'Sequences of shard {database.url!r} are not prepared, '
+                f'run `python -m app.sharding`'
+            )
+
+
+async def main() -> None:
+    databases = shard_databases()
+    for database in databases:
+        await database.connect()
+    try:
+        await prepare_sequences(databases)
+        print(f'Prepared the sequences of {len(databases)} shards')
+    finally:
+        for database in databases:
+            await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
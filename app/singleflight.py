@@ -0,0 +1,56 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app import metrics
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    with the same key is in flight await it and share its result; nothing is
+    kept once the call has finished.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is not None and call.get_loop() is asyncio.get_event_loop():
+            metrics.increment(f'singleflight.{self.name}.coalesced')
+        else:
+            metrics.increment(f'singleflight.{self.name}.executed')
+            # The query runs in its own task, so a caller being cancelled
+            # does not cancel it for everybody else waiting on the same key.
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(functools.partial(self._forget, key))
+
+        return await asyncio.shield(call)
+
+    def _forget(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # Mark the exception as retrieved even if every caller is gone.
+            call.exception()
+
+
+def single_flight(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Coalesces concurrent calls of a model classmethod with identical arguments.
+    Only meant for plain reads.
+    """
+    group = SingleFlight(method.__qualname__)
+
+    @functools.wraps(method)
+    async def wrapper(cls: Any, *args: Any, **kwargs: Any) -> T:
+        key = (cls, args, tuple(sorted(kwargs.items())))
+        return await group.do(key, lambda: method(cls, *args, **kwargs))
+
+    wrapper.single_flight = group
+    return wrapper
@@ -0,0 +1,68 @@
+"""
+Time from starting uvicorn until the first request that needs the database is
+answered.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_cold_start
+    DB_URI=postgresql://... python -m benchmarks.bench_cold_start --app main:app
+
+The first request is `GET /items/summary` with an unknown token, which looks up
+the token and answers 401.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def first_response(url: str, timeout: float) -> float:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        request = urllib.request.Request(url, headers={'Authorization': 'Bearer cold-start'})
+        try:
+            urllib.request.urlopen(request, timeout=1)
+        except urllib.error.HTTPError:
+            return time.perf_counter()
+        except OSError:
+            time.sleep(0.005)
+        else:
+            return time.perf_counter()
+
+    raise TimeoutError(f'No response from {url} within {timeout} seconds')
+
+
+def run(app: str, factory: bool, port: int, timeout: float) -> float:
+    command = [sys.executable, '-m', 'uvicorn', app, '--port', str(port), '--log-level', 'warning']
+    if factory:
+        command.append('--factory')
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command)
+    try:
+        return first_response(f'http://127.0.0.1:{port}/items/summary', timeout) - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', default='main:create_app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    factory = args.app.endswith(':create_app')
+    timings = [run(args.app, factory, args.port, args.timeout) for _ in range(args.runs)]
+    print(
+        f'{args.app}: median {statistics.median(timings) * 1000:.0f} ms, '
+        f'min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms '
+        f'over {args.runs} runs'
+    )
+
+
+if __name__ == '__main__':
+    main()
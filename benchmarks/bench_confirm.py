@@ -0,0 +1,133 @@
+"""
+Throughput and correctness of `SendingModel.complete_sending` under concurrent
+confirmations.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_confirm
+
+Every sending is confirmed `--duplicates` times at once, as a client retrying
+or double-clicking would. Exactly one confirmation per sending must complete;
+the others must return LOCKED (still being confirmed) or NO_SENDING (already
+confirmed) without waiting for the winner.
+
+The database must be migrated; the benchmark creates its own users and removes
+them together with their items and transfers afterwards.
+"""
+import argparse
+import asyncio
+import collections
+import time
+import uuid
+from sqlalchemy import func, select
+from typing import List, Tuple
+
+from app import settings
+from app.models import (
+    SendingModel,
+    SendingStatus,
+    items,
+    sendings,
+    start_background_writers,
+    stop_background_writers,
+    transfer_events,
+    users,
+)
+
+
+async def prepare(sendings_count: int) -> Tuple[int, int, List[str]]:
+    database = settings.database
+    sender_id = await database.execute(
+        users.insert().values(login=f'bench-{uuid.uuid4().hex}', password='bench')
+    )
+    recipient_id = await database.execute(
+        users.insert().values(login=f'bench-{uuid.uuid4().hex}', password='bench')
+    )
+    item_ids = [
+        row['id'] for row in await database.fetch_all(
+            items.insert()
+            .values([{'name': f'item{i}', 'user_id': sender_id} for i in range(sendings_count)])
+            .returning(items.c.id)
+        )
+    ]
+    tokens = [uuid.uuid4().hex for _ in item_ids]
+    await database.execute(sendings.insert().values([
+        {
+            'item_id': item_id,
+            'from_user_id': sender_id,
+            'to_user_id': recipient_id,
+            'item_token': token,
+        }
+        for item_id, token in zip(item_ids, tokens)
+    ]))
+    return sender_id, recipient_id, tokens
+
+
+async def verify(recipient_id: int) -> Tuple[int, int, int]:
+    database = settings.database
+    received = await database.fetch_val(
+        select([func.count()]).where(items.c.user_id == recipient_id)
+    )
+    pending = await database.fetch_val(
+        select([func.count()]).where(sendings.c.to_user_id == recipient_id)
+    )
+    logged = await database.fetch_val(
+        select([func.count()]).where(transfer_events.c.to_user_id == recipient_id)
+    )
+    return received, pending, logged
+
+
+async def cleanup(*user_ids: int) -> None:
+    database = settings.database
+    await database.execute(transfer_events.delete().where(transfer_events.c.to_user_id.in_(user_ids)))
+    await database.execute(items.delete().where(items.c.user_id.in_(user_ids)))
+    await database.execute(users.delete().where(users.c.id.in_(user_ids)))
+
+
+async def run(confirms: int, duplicates: int, pool_size: int) -> None:
+    settings.configure(DB_MIN_SIZE=pool_size, DB_MAX_SIZE=pool_size)
+    await settings.database.connect()
+    try:
+        # `databases` keeps a task's connection in a context variable, which
+        # tasks inherit: setup and checks run in tasks of their own so that
+        # every confirmation below acquires its own connection.
+        sender_id, recipient_id, tokens = await asyncio.ensure_future(
+            prepare(confirms // duplicates)
+        )
+
+        start_background_writers()
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*[
+            SendingModel.complete_sending(token) for token in tokens for _ in range(duplicates)
+        ])
+        elapsed = time.perf_counter() - started
+        await stop_background_writers()
+
+        received, pending, logged = await asyncio.ensure_future(verify(recipient_id))
+        await asyncio.ensure_future(cleanup(sender_id, recipient_id))
+
+        counts = collections.Counter(status.name for status in statuses)
+        print(f'{len(statuses)} confirmations of {len(tokens)} sendings, pool {pool_size}')
+        print(f'{len(statuses) / elapsed:.0f} confirmations/s, {elapsed * 1000:.0f} ms')
+        for name, count in sorted(counts.items()):
+            print(f'{name:>12} {count:>6}')
+
+        assert counts[SendingStatus.COMPLETED.name] == len(tokens), 'lost confirmations'
+        assert received == len(tokens), 'items have not been transferred exactly once'
+        assert pending == 0, 'sendings have been left behind'
+        assert logged == len(tokens), 'transfers have not been logged exactly once'
+        print('correct')
+    finally:
+        await settings.database.disconnect()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--confirms', type=int, default=1000)
+    parser.add_argument('--duplicates', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=20)
+    args = parser.parse_args()
+
+    await run(args.confirms, args.duplicates, args.pool_size)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
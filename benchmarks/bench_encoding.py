@@ -0,0 +1,127 @@
+"""
+Payload size and server CPU of `GET /items` for a user with 10k items, as
+JSON and as MessagePack (`Accept: application/msgpack`, needs `msgpack`).
+
+    DB_URI=postgresql://... python -m benchmarks.bench_encoding
+
+Requests are made in-process against the ASGI application with the items
+cache disabled, so that every request queries and encodes the list; CPU is
+the process time per request, which includes the query's share of the
+driver. A second table compares encoding alone, including the per-row
+pydantic path the list used before. The database must be migrated; the
+benchmark creates its own user and removes it with its items afterwards.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import msgpack
+import time
+import uuid
+from async_asgi_testclient import TestClient
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from app import settings
+from app.encoding import JSON, MSGPACK, encode
+from app.models import Item, items, users
+from app.schemas import ItemSchema
+from main import create_app
+
+
+async def prepare(item_count: int) -> Tuple[int, str]:
+    database = settings.database
+    token = uuid.uuid4().hex
+    user_id = await database.execute(users.insert().values(
+        login=f'bench-{uuid.uuid4().hex}',
+        password='bench',
+        token=token,
+        token_expired_at=datetime.now() + timedelta(hours=1),
+    ))
+    await database.execute(
+        items.insert().values([
+            {'name': f'item {i} {uuid.uuid4().hex[:8]}', 'user_id': user_id} for i in range(item_count)
+        ])
+    )
+    return user_id, token
+
+
+async def cleanup(user_id: int) -> None:
+    database = settings.database
+    await database.execute(items.delete().where(items.c.user_id == user_id))
+    await database.execute(users.delete().where(users.c.id == user_id))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> float:
+    started = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - started) / repeat
+
+
+def encode_with_pydantic(rows: List[Dict[str, Any]]) -> bytes:
+    return json.dumps(
+        [ItemSchema.from_orm(Item(**row)).dict() for row in rows],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app({'ITEMS_CACHE_MAX_BYTES': 0})
+    await settings.database.connect()
+    try:
+        # Setup runs in a task of its own so that requests do not share its
+        # connection, see bench_request_connection.
+        user_id, token = await asyncio.ensure_future(prepare(args.items))
+        try:
+            async with TestClient(app) as client:
+                print(f'{"GET /items":>12} {"bytes":>10} {"gzip bytes":>11} {"CPU ms/request":>15} {"decode ms":>10}')
+                for media_type, decode in ((JSON, json.loads), (MSGPACK, msgpack.unpackb)):
+                    headers = {'Authorization': f'Bearer {token}', 'Accept': media_type}
+                    response = await client.get('/items', headers=headers)
+                    assert response.status_code == 200, response.text
+                    assert len(decode(response.content)) == args.items
+
+                    started = time.process_time()
+                    for _ in range(args.requests):
+                        await client.get('/items', headers=headers)
+                    cpu = (time.process_time() - started) / args.requests
+                    decoding = measure(lambda: decode(response.content), args.requests)
+                    print(
+                        f'{media_type.split("/")[1]:>12} '
+                        f'{len(response.content):>10} '
+                        f'{len(gzip.compress(response.content, 6)):>11} '
+                        f'{cpu * 1000:>15.2f} '
+                        f'{decoding * 1000:>10.2f}'
+                    )
+
+            rows = [
+                dict(row) for row in
+                await settings.database.fetch_all(
+                    items.select().with_only_columns([items.c.id, items.c.name])
+                    .where(items.c.user_id == user_id)
+                )
+            ]
+        finally:
+            await asyncio.ensure_future(cleanup(user_id))
+
+        print()
+        print(f'{"encode only":>12} {"ms":>10}')
+        for name, function in (
+            ('pydantic', lambda: encode_with_pydantic(rows)),
+            ('json', lambda: encode(rows, JSON)),
+            ('msgpack', lambda: encode(rows, MSGPACK)),
+        ):
+            print(f'{name:>12} {measure(function, args.requests) * 1000:>10.2f}')
+    finally:
+        await settings.database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
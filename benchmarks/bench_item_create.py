@@ -0,0 +1,71 @@
+"""
+Throughput of `ItemModel.create` with and without write batching for a range
+of pool sizes.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_item_create
+
+The database must be migrated; the benchmark creates its own user and removes
+it together with its items afterwards.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from app import settings
+from app.models import ItemModel, items, users
+
+
+async def create_user() -> int:
+    return await settings.database.execute(
+        users.insert().values(login=f'bench-{uuid.uuid4().hex}', password='bench')
+    )
+
+
+async def delete_user(user_id: int) -> None:
+    await settings.database.execute(items.delete().where(items.c.user_id == user_id))
+    await settings.database.execute(users.delete().where(users.c.id == user_id))
+
+
+async def run(pool_size: int, batched: bool, requests: int, concurrency: int) -> float:
+    settings.configure(
+        ITEMS_BATCH_ENABLED=batched, DB_MIN_SIZE=pool_size, DB_MAX_SIZE=pool_size
+    )
+    await settings.database.connect()
+    try:
+        # `databases` keeps a task's connection in a context variable, which
+        # tasks inherit: setup runs in a task of its own so that the creates
+        # below do not share one connection.
+        user_id = await asyncio.ensure_future(create_user())
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create(i: int) -> None:
+            async with semaphore:
+                await ItemModel.create(name=f'item{i}', user_id=user_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[create(i) for i in range(requests)])
+        elapsed = time.perf_counter() - started
+
+        await asyncio.ensure_future(delete_user(user_id))
+        return requests / elapsed
+    finally:
+        await settings.database.disconnect()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 5, 10, 20])
+    args = parser.parse_args()
+
+    print(f'{"pool":>6} {"unbatched rows/s":>18} {"batched rows/s":>16}')
+    for pool_size in args.pool_sizes:
+        unbatched = await run(pool_size, False, args.requests, args.concurrency)
+        batched = await run(pool_size, True, args.requests, args.concurrency)
+        print(f'{pool_size:>6} {unbatched:>18.0f} {batched:>16.0f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""
+Throughput of `UserModel.is_registered` for logins that are not registered,
+as during a registration storm, with and without the login filter, and the
+time and memory it takes to load the filter.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_login_filter
+    DB_URI=postgresql://... python -m benchmarks.bench_login_filter --users 10000000 --capacity 10000000
+
+The database must be migrated; the benchmark registers its own users and
+removes them afterwards.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from app import metrics, settings
+from app.models import UserModel, login_filter, users
+
+
+async def lookups_per_second(prefix: str, lookups: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def look_up(i: int) -> None:
+        async with semaphore:
+            assert not await UserModel.is_registered(f'{prefix}-missing{i}')
+
+    started = time.perf_counter()
+    await asyncio.gather(*[look_up(i) for i in range(lookups)])
+    return lookups / (time.perf_counter() - started)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--capacity', type=int, default=settings.LOGIN_FILTER_CAPACITY)
+    parser.add_argument('--error-rate', type=float, default=settings.LOGIN_FILTER_ERROR_RATE)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    prefix = f'bench-{uuid.uuid4().hex}'
+    database = settings.database
+    await database.connect()
+    try:
+        # In a task of its own, so that the lookups below do not inherit its
+        # connection and share it.
+        await asyncio.ensure_future(database.execute(
+            "INSERT INTO users (login, password) "
+            "SELECT :prefix || '-' || g, 'bench' FROM generate_series(1, :users) AS g",
+            {'prefix': prefix, 'users': args.users},
+        ))
+
+        without = await lookups_per_second(prefix, args.lookups, args.concurrency)
+
+        login_filter.capacity = args.capacity
+        login_filter.error_rate = args.error_rate
+        started = time.perf_counter()
+        await login_filter.refresh()
+        loaded = time.perf_counter() - started
+        with_filter = await lookups_per_second(prefix, args.lookups, args.concurrency)
+
+        print(f'Loaded {metrics.get("login_filter.logins")} logins in {loaded:.1f} s, '
+              f'{metrics.get("login_filter.bytes") / 1024 / 1024:.1f} MB, '
+              f'estimated false positives {metrics.get("login_filter.error_rate"):.2%}')
+        print(f'{"":>16} {"lookups/s":>10}')
+        print(f'{"without filter":>16} {without:>10.0f}')
+        print(f'{"with filter":>16} {with_filter:>10.0f}')
+    finally:
+        await database.execute(users.delete().where(users.c.login.like(f'{prefix}-%')))
+        await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""
+Latency of the items queries on a plain table and on a table hash-partitioned
+by user_id, as created by the items partitioned migrations.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_partitioning
+    DB_URI=postgresql://... python -m benchmarks.bench_partitioning --rows 100000000 --users 1000000 --keep
+
+Both tables are built with the same rows in the schema `bench_partitioning`
+and do not touch the application's tables. Loading 100M rows takes a while
+and about 25 GB of disk for both tables and their indexes; with `--keep` the
+schema is left in place and reused by the next run with the same `--users`.
+
+`transfer` runs in a transaction that is rolled back, so that every query
+sees the same data; `get` is the lookup by id alone, which has to probe every
+partition.
+"""
+import argparse
+import asyncio
+import asyncpg
+import os
+import random
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+SCHEMA = 'bench_partitioning'
+
+CREATE_TABLES = f'''
+CREATE SCHEMA {SCHEMA};
+CREATE TABLE {SCHEMA}.items_plain (
+    id integer NOT NULL,
+    user_id integer NOT NULL,
+    name varchar NOT NULL
+);
+CREATE TABLE {SCHEMA}.items_hash (
+    id integer NOT NULL,
+    user_id integer NOT NULL,
+    name varchar NOT NULL
+) PARTITION BY HASH (user_id);
+'''
+
+CREATE_INDEXES = f'''
+ALTER TABLE {SCHEMA}.items_plain ADD PRIMARY KEY (id);
+CREATE INDEX ON {SCHEMA}.items_plain (user_id, id);
+CREATE INDEX ON {SCHEMA}.items_plain (user_id, name, id);
+ALTER TABLE {SCHEMA}.items_hash ADD PRIMARY KEY (user_id, id);
+CREATE INDEX ON {SCHEMA}.items_hash (id);
+CREATE INDEX ON {SCHEMA}.items_hash (user_id, name, id);
+'''
+
+# Queries with a function that picks their arguments from
+# (owner, other user, item id).
+QUERIES = {
+    'list': (
+        'SELECT id, name FROM {table} WHERE user_id = $1 ORDER BY id LIMIT 100',
+        lambda owner_id, to_user_id, item_id: (owner_id,),
+    ),
+    'transfer': (
+        'UPDATE {table} SET user_id = $1 WHERE id = $2 AND user_id = $3 RETURNING id',
+        lambda owner_id, to_user_id, item_id: (to_user_id, item_id, owner_id),
+    ),
+    'get': (
+        'SELECT id, user_id, name FROM {table} WHERE id = $1',
+        lambda owner_id, to_user_id, item_id: (item_id,),
+    ),
+}
+
+
+def owner(item_id: int, users: int) -> int:
+    return item_id % users + 1
+
+
+async def load(connection: asyncpg.Connection, rows: int, users: int, partitions: int) -> None:
+    await connection.execute(CREATE_TABLES)
+    for remainder in range(partitions):
+        await connection.execute(
+            f'CREATE TABLE {SCHEMA}.items_hash_p{remainder} PARTITION OF {SCHEMA}.items_hash '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        )
+    # In slices, so that a 100M row load does not run as one huge statement.
+    for start in range(1, rows + 1, 1000000):
+        end = min(start + 999999, rows)
+        await connection.execute(
+            f"INSERT INTO {SCHEMA}.items_plain "
+            f"SELECT g, g % {users} + 1, 'item' || g FROM generate_series({start}, {end}) AS g"
+        )
+        await connection.execute(
+            f'INSERT INTO {SCHEMA}.items_hash SELECT * FROM {SCHEMA}.items_plain '
+            f'WHERE id BETWEEN {start} AND {end}'
+        )
+    await connection.execute(CREATE_INDEXES)
+    await connection.execute(f'VACUUM ANALYZE {SCHEMA}.items_plain')
+    await connection.execute(f'VACUUM ANALYZE {SCHEMA}.items_hash')
+
+
+async def measure(
+    connection: asyncpg.Connection, query: str, arguments: Callable[[], Tuple[int, ...]], queries: int
+) -> List[float]:
+    statement = await connection.prepare(query)
+    latencies = []
+    for _ in range(queries):
+        values = arguments()
+        transaction = connection.transaction()
+        await transaction.start()
+        started = time.perf_counter()
+        await statement.fetch(*values)
+        latencies.append(time.perf_counter() - started)
+        await transaction.rollback()
+    return latencies
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+
+    connection = await asyncpg.connect(os.environ['DB_URI'])
+    try:
+        exists = await connection.fetchval(
+            'SELECT 1 FROM information_schema.schemata WHERE schema_name = $1', SCHEMA
+        )
+        if not exists:
+            started = time.perf_counter()
+            await load(connection, args.rows, args.users, args.partitions)
+            print(f'Loaded {args.rows} rows in {time.perf_counter() - started:.0f} s')
+        rows = await connection.fetchval(f'SELECT max(id) FROM {SCHEMA}.items_plain')
+
+        def sample() -> Tuple[int, int, int]:
+            item_id = random.randint(1, rows)
+            owner_id = owner(item_id, args.users)
+            return owner_id, owner_id % args.users + 1, item_id
+
+        print(f'{"":>9} {"plain p50 ms":>13} {"plain p99 ms":>13} {"hash p50 ms":>12} {"hash p99 ms":>12}')
+        for name, (query, pick) in QUERIES.items():
+            columns = []
+            for table in ('items_plain', 'items_hash'):
+                latencies = await measure(
+                    connection,
+                    query.format(table=f'{SCHEMA}.{table}'),
+                    lambda: pick(*sample()),
+                    args.queries,
+                )
+                latencies.sort()
+                columns.append(statistics.median(latencies) * 1000)
+                columns.append(latencies[int(len(latencies) * 0.99)] * 1000)
+            print(
+                f'{name:>9} {columns[0]:>13.3f} {columns[1]:>13.3f} '
+                f'{columns[2]:>12.3f} {columns[3]:>12.3f}'
+            )
+    finally:
+        if not args.keep:
+            await connection.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await connection.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Pool checkouts and pool wait of `POST /send` with and without a connection
+shared by the model calls of a request (DB_REQUEST_CONNECTION).
+
+    DB_URI=postgresql://... python -m benchmarks.bench_request_connection
+
+Requests are made in-process against the ASGI application with a small pool,
+so that checkouts queue behind each other. The database must be migrated;
+the benchmark creates its own users and removes them together with their
+items and sendings afterwards.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from async_asgi_testclient import TestClient
+from typing import List, Tuple
+
+from app import metrics, settings
+from app.models import items, users
+from main import create_app
+
+
+async def prepare(requests: int) -> Tuple[int, int, str, str, List[int]]:
+    database = settings.database
+    token = uuid.uuid4().hex
+    sender_id = await database.execute(users.insert().values(
+        login=f'bench-{uuid.uuid4().hex}',
+        password='bench',
+        token=token,
+        token_expired_at=datetime.now() + timedelta(hours=1),
+    ))
+    recipient_login = f'bench-{uuid.uuid4().hex}'
+    recipient_id = await database.execute(
+        users.insert().values(login=recipient_login, password='bench')
+    )
+    item_ids = [
+        row['id'] for row in await database.fetch_all(
+            items.insert()
+            .values([{'name': f'item{i}', 'user_id': sender_id} for i in range(requests)])
+            .returning(items.c.id)
+        )
+    ]
+    return sender_id, recipient_id, token, recipient_login, item_ids
+
+
+async def cleanup(*user_ids: int) -> None:
+    database = settings.database
+    await database.execute(items.delete().where(items.c.user_id.in_(user_ids)))
+    await database.execute(users.delete().where(users.c.id.in_(user_ids)))
+
+
+async def run(request_connection: bool, requests: int, concurrency: int, pool_size: int) -> None:
+    app = create_app({
+        'DB_MIN_SIZE': pool_size,
+        'DB_MAX_SIZE': pool_size,
+        'DB_REQUEST_CONNECTION': request_connection,
+    })
+    await settings.database.connect()
+    try:
+        # `databases` keeps a task's connection in a context variable, which
+        # tasks inherit: setup runs in a task of its own so that requests do
+        # not share its connection.
+        sender_id, recipient_id, token, recipient_login, item_ids = await asyncio.ensure_future(
+            prepare(requests)
+        )
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with TestClient(app) as client:
+            async def send(item_id: int) -> None:
+                async with semaphore:
+                    response = await client.post(
+                        '/send',
+                        json={'id': item_id, 'recipient_login': recipient_login},
+                        headers={'Authorization': f'Bearer {token}'},
+                    )
+                    assert response.status_code == 201, response.text
+
+            metrics.reset()
+            started = time.perf_counter()
+            await asyncio.gather(*[send(item_id) for item_id in item_ids])
+            elapsed = time.perf_counter() - started
+
+        await asyncio.ensure_future(cleanup(sender_id, recipient_id))
+
+        checkouts = metrics.get('db.pool.wait.count')
+        wait = metrics.get('db.pool.wait.sum')
+        print(
+            f'{"shared" if request_connection else "per call":>9} '
+            f'{requests / elapsed:>12.0f} '
+            f'{checkouts / requests:>18.1f} '
+            f'{wait / requests * 1000:>21.1f} '
+            f'{metrics.get("db.pool.wait.max") * 1000:>15.1f}'
+        )
+    finally:
+        await settings.database.disconnect()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"":>9} {"requests/s":>12} {"checkouts/request":>18} {"pool wait ms/request":>21} {"max wait ms":>15}')
+    for request_connection in (False, True):
+        await run(request_connection, args.requests, args.concurrency, args.pool_size)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+"""
+Requests per second of `GET /items` served by a single uvicorn process on
+asyncio and h11, as docker-compose used to run it (without --reload), and by
+`python -m app.server` with WEB_CONCURRENCY workers on uvloop and httptools.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_server
+    DB_URI=postgresql://... python -m benchmarks.bench_server --workers 4 --clients 4
+
+Load comes from `--clients` processes holding `--connections` keep-alive
+connections each, so that the client is not the bottleneck; on a machine
+with few cores client and server compete for them, which understates the
+gain of more workers. The database must be migrated; the benchmark creates
+its own user with some items and removes them afterwards.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import psycopg2
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import List, Tuple
+
+
+def prepare(db_uri: str, item_count: int) -> Tuple[int, str]:
+    token = uuid.uuid4().hex
+    with psycopg2.connect(db_uri) as connection, connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO users (login, password, token, token_expired_at) "
+            "VALUES (%s, 'bench', %s, now() + interval '1 hour') RETURNING id",
+            (f'bench-{token}', token),
+        )
+        user_id = cursor.fetchone()[0]
+        cursor.execute(
+            'INSERT INTO items (user_id, name) SELECT %s, %s || i FROM generate_series(1, %s) AS i',
+            (user_id, 'item', item_count),
+        )
+    return user_id, token
+
+
+def cleanup(db_uri: str, user_id: int) -> None:
+    with psycopg2.connect(db_uri) as connection, connection.cursor() as cursor:
+        cursor.execute('DELETE FROM items WHERE user_id = %s', (user_id,))
+        cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+
+
+def wait_until_ready(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/openapi.json', timeout=1)
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.05)
+    raise TimeoutError(f'The server on port {port} did not start within {timeout} seconds')
+
+
+async def keep_requesting(port: int, request: bytes, until: float) -> int:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = 0
+    try:
+        while time.monotonic() < until:
+            writer.write(request)
+            headers = await reader.readuntil(b'\r\n\r\n')
+            assert headers.startswith(b'HTTP/1.1 200'), headers
+            length = next(
+                int(line.split(b':', 1)[1])
+                for line in headers.split(b'\r\n')
+                if line.lower().startswith(b'content-length:')
+            )
+            await reader.readexactly(length)
+            responses += 1
+    finally:
+        writer.close()
+    return responses
+
+
+def client(port: int, token: str, connections: int, until: float, results: 'multiprocessing.Queue[int]') -> None:
+    request = (
+        f'GET /items HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+        f'Authorization: Bearer {token}\r\n\r\n'
+    ).encode()
+
+    async def run() -> List[int]:
+        return await asyncio.gather(*[keep_requesting(port, request, until) for _ in range(connections)])
+
+    results.put(sum(asyncio.run(run())))
+
+
+def measure(command: List[str], env: dict, port: int, token: str, args: argparse.Namespace) -> float:
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port)
+        results: 'multiprocessing.Queue[int]' = multiprocessing.Queue()
+        # Warm up the pools and caches of all workers before measuring.
+        for duration in (1, args.duration):
+            until = time.monotonic() + duration
+            clients = [
+                multiprocessing.Process(target=client, args=(port, token, args.connections, until, results))
+                for _ in range(args.clients)
+            ]
+            for process in clients:
+                process.start()
+            responses = sum(results.get() for _ in clients)
+            for process in clients:
+                process.join()
+        return responses / args.duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    db_uri = os.environ['DB_URI']
+    user_id, token = prepare(db_uri, args.items)
+    try:
+        env = {**os.environ, 'HOST': '127.0.0.1', 'PORT': str(args.port), 'WEB_CONCURRENCY': str(args.workers)}
+        setups = [
+            ('uvicorn, 1 process', [
+                sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.port),
+                '--loop', 'asyncio', '--http', 'h11', '--log-level', 'warning',
+            ]),
+            (f'app.server, {args.workers} workers', [sys.executable, '-m', 'app.server']),
+        ]
+        print(f'{"":>24} {"requests/s":>12}')
+        for name, command in setups:
+            rps = measure(command, env, args.port, token, args)
+            print(f'{name:>24} {rps:>12.0f}')
+    finally:
+        cleanup(db_uri, user_id)
+
+
+if __name__ == '__main__':
+    main()
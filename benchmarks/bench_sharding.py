@@ -0,0 +1,101 @@
+"""
+Throughput of `POST /items` and `GET /items` with the users spread over 1, 2
+and 4 shards (the first shards of DB_SHARD_URIS).
+
+    DB_URI=postgresql://... DB_SHARD_URIS=postgresql://...,postgresql://... python -m benchmarks.bench_sharding
+
+Requests are made in-process against the ASGI application, so the benchmark
+shows how far the databases scale out before the single process becomes the
+bottleneck; shards only add capacity when they run on hosts of their own.
+All databases must be migrated and the shards prepared with
+`python -m app.sharding`; the benchmark creates its own users and removes them
+together with their items afterwards.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from async_asgi_testclient import TestClient
+from databases import Database
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from app import settings
+from app.models import UserModel, items, users
+from main import create_app
+
+
+async def prepare(count: int) -> List[Tuple[int, str]]:
+    user_tokens = []
+    for _ in range(count):
+        user_id = await UserModel.create(f'bench-{uuid.uuid4().hex}', 'bench')
+        token = uuid.uuid4().hex
+        await settings.database.execute(
+            users.update()
+            .where(users.c.id == user_id)
+            .values(token=token, token_expired_at=datetime.now() + timedelta(hours=1))
+        )
+        user_tokens.append((user_id, token))
+    return user_tokens
+
+
+async def cleanup(shards: List[Database], user_ids: List[int]) -> None:
+    for database in shards:
+        await database.execute(items.delete().where(items.c.user_id.in_(user_ids)))
+        await database.execute(users.delete().where(users.c.id.in_(user_ids)))
+    await settings.database.execute(users.delete().where(users.c.id.in_(user_ids)))
+
+
+async def run(shards: List[Database], users_count: int, requests: int, concurrency: int) -> None:
+    app = create_app({'shards': shards})
+    databases = [settings.database, *shards]
+    for database in databases:
+        await database.connect()
+    try:
+        # `databases` keeps a task's connection in a context variable, which
+        # tasks inherit: setup runs in a task of its own so that requests do
+        # not share its connection.
+        user_tokens = await asyncio.ensure_future(prepare(users_count))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with TestClient(app) as client:
+            async def create_and_list(number: int) -> None:
+                _, token = random.choice(user_tokens)
+                headers = {'Authorization': f'Bearer {token}'}
+                async with semaphore:
+                    response = await client.post('/items', json={'name': f'item{number}'}, headers=headers)
+                    assert response.status_code == 201, response.text
+                    response = await client.get('/items', query_string={'limit': 100}, headers=headers)
+                    assert response.status_code == 200, response.text
+
+            started = time.perf_counter()
+            await asyncio.gather(*[create_and_list(number) for number in range(requests // 2)])
+            elapsed = time.perf_counter() - started
+
+        await asyncio.ensure_future(cleanup(shards, [user_id for user_id, _ in user_tokens]))
+        print(f'{len(shards):>7} {requests / elapsed:>12.0f}')
+    finally:
+        for database in databases:
+            await database.disconnect()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+
+    shards = settings.shards
+    if not shards:
+        raise SystemExit('Set DB_SHARD_URIS')
+
+    print(f'{"shards":>7} {"requests/s":>12}')
+    for count in (1, 2, 4):
+        if count <= len(shards):
+            await run(shards[:count], args.users, args.requests, args.concurrency)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""
+Latency of the transfer stats computed from the transfer events at query
+time and read from the daily rollup that `GET /stats/...` reads.
+
+    DB_URI=postgresql://... python -m benchmarks.bench_stats
+    DB_URI=postgresql://... python -m benchmarks.bench_stats --events 10000000 --users 100000
+
+Events are spread over `--days` days and built, with their rollup, in the
+schema `bench_stats`, which is dropped afterwards; the application's tables
+are not touched. `daily` is the 30 days of one user, `top` the top 10
+senders of the last 30 days.
+"""
+import argparse
+import asyncio
+import asyncpg
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+from typing import Callable, List, Tuple
+
+SCHEMA = 'bench_stats'
+
+CREATE_TABLES = f'''
+CREATE SCHEMA {SCHEMA};
+CREATE TABLE {SCHEMA}.transfer_events (
+    id bigint PRIMARY KEY,
+    item_id integer NOT NULL,
+    from_user_id integer NOT NULL,
+    to_user_id integer NOT NULL,
+    created_at timestamp NOT NULL
+);
+CREATE TABLE {SCHEMA}.transfer_daily_stats (
+    user_id integer NOT NULL,
+    day date NOT NULL,
+    sent_count bigint NOT NULL DEFAULT 0,
+    received_count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+'''
+
+CREATE_INDEXES = f'''
+CREATE INDEX ON {SCHEMA}.transfer_events (from_user_id, id);
+CREATE INDEX ON {SCHEMA}.transfer_events (to_user_id, id);
+CREATE INDEX ON {SCHEMA}.transfer_daily_stats (day);
+'''
+
+FILL_ROLLUP = f'''
+INSERT INTO {SCHEMA}.transfer_daily_stats
+SELECT user_id, day, sum(sent), sum(received) FROM (
+    SELECT from_user_id AS user_id, CAST(created_at AS date) AS day, 1 AS sent, 0 AS received
+    FROM {SCHEMA}.transfer_events
+    UNION ALL
+    SELECT to_user_id, CAST(created_at AS date), 0, 1 FROM {SCHEMA}.transfer_events
+) AS transfers
+GROUP BY user_id, day
+'''
+
+# Queries, from events and from the rollup, with a function that picks their
+# arguments from a random user.
+QUERIES = {
+    'daily': (
+        f'''
+        SELECT day, sum(sent), sum(received) FROM (
+            SELECT CAST(created_at AS date) AS day, 1 AS sent, 0 AS received
+            FROM {SCHEMA}.transfer_events WHERE from_user_id = $1 AND created_at >= CAST($2 AS date)
+            UNION ALL
+            SELECT CAST(created_at AS date), 0, 1
+            FROM {SCHEMA}.transfer_events WHERE to_user_id = $1 AND created_at >= CAST($2 AS date)
+        ) AS transfers GROUP BY day ORDER BY day
+        ''',
+        f'''
+        SELECT day, sent_count, received_count FROM {SCHEMA}.transfer_daily_stats
+        WHERE user_id = $1 AND day >= $2 ORDER BY day
+        ''',
+        lambda user_id, since: (user_id, since),
+    ),
+    'top': (
+        f'''
+        SELECT from_user_id, count(*) AS sent_count FROM {SCHEMA}.transfer_events
+        WHERE created_at >= CAST($1 AS date) GROUP BY from_user_id ORDER BY sent_count DESC LIMIT 10
+        ''',
+        f'''
+        SELECT user_id, sum(sent_count) AS sent_count FROM {SCHEMA}.transfer_daily_stats
+        WHERE day >= $1 AND sent_count > 0 GROUP BY user_id ORDER BY sent_count DESC LIMIT 10
+        ''',
+        lambda user_id, since: (since,),
+    ),
+}
+
+
+async def load(connection: asyncpg.Connection, events: int, users: int, days: int) -> None:
+    await connection.execute(CREATE_TABLES)
+    for start in range(1, events + 1, 1000000):
+        end = min(start + 999999, events)
+        await connection.execute(
+            f"INSERT INTO {SCHEMA}.transfer_events "
+            f"SELECT g, g, (CAST(g AS bigint) * 7919) % {users} + 1, g % {users} + 1, "
+            f"now() - random() * interval '{days} days' FROM generate_series({start}, {end}) AS g"
+        )
+    await connection.execute(FILL_ROLLUP)
+    await connection.execute(CREATE_INDEXES)
+    await connection.execute(f'VACUUM ANALYZE {SCHEMA}.transfer_events')
+    await connection.execute(f'VACUUM ANALYZE {SCHEMA}.transfer_daily_stats')
+
+
+async def measure(
+    connection: asyncpg.Connection, query: str, arguments: Callable[[], Tuple], queries: int
+) -> List[float]:
+    statement = await connection.prepare(query)
+    latencies = []
+    for _ in range(queries):
+        values = arguments()
+        started = time.perf_counter()
+        await statement.fetch(*values)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    connection = await asyncpg.connect(os.environ['DB_URI'])
+    try:
+        await connection.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        started = time.perf_counter()
+        await load(connection, args.events, args.users, args.days)
+        print(f'Loaded {args.events} events in {time.perf_counter() - started:.0f} s')
+
+        since = (await connection.fetchval('SELECT CAST(now() AS date)')) - timedelta(days=29)
+        print(f'{"":>8} {"source":>8} {"p50 ms":>8} {"p99 ms":>8}')
+        for name, (events_query, rollup_query, arguments) in QUERIES.items():
+            for source, query in (('events', events_query), ('rollup', rollup_query)):
+                latencies = await measure(
+                    connection,
+                    query,
+                    lambda: arguments(random.randint(1, args.users), since),
+                    args.queries,
+                )
+                quantiles = statistics.quantiles(latencies, n=100)
+                print(f'{name:>8} {source:>8} {quantiles[49] * 1000:>8.2f} {quantiles[98] * 1000:>8.2f}')
+    finally:
+        await connection.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await connection.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
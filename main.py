@@ -1,25 +1,86 @@
 from fastapi import FastAPI
 from starlette.responses import RedirectResponse
+from typing import Any, AsyncIterator, Mapping, Optional
 
-from app.routers import router
-from app.settings import database
+from app import settings
 
-app = FastAPI()
 
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # The pools belong to the application unless they were connected already,
+    # e.g. by a test that shares its databases with the application.
+    from app.models import start_background_writers, stop_background_writers
 
-@app.on_event("startup")
-async def startup():
-    await database.connect()
+    from app.sharding import check_sequences
 
+    databases = [settings.database, *settings.shards]
+    owned_databases = [database for database in databases if not database.is_connected]
+    for database in owned_databases:
+        await database.connect()
+    try:
+        await check_sequences(settings.shards)
+        start_background_writers()
+        try:
+            yield
+        finally:
+            await stop_background_writers()
+    finally:
+        for database in owned_databases:
+            await database.disconnect()
 
-@app.on_event("shutdown")
-async def shutdown():
-    await database.disconnect()
 
+def create_app(config: Optional[Mapping[str, Any]] = None) -> FastAPI:
+    """
+    Build the application. `config` overrides settings, see `settings.configure`.
+    Nothing connects to the database before the application starts up.
 
-@app.get("/")
-async def redirect_to_docs() -> RedirectResponse:
-    return RedirectResponse(url="/docs")
+    Settings are those of the process, not of the application: models and
+    background writers read them when they run, so `config` applies to every
+    application of the process, and the last `create_app` wins. Build one
+    application per process, or several with the same `config`.
+    """
+    from app.compression import CompressionMiddleware
+    from app.profiling import ProfilingMiddleware
+    from app.routers import router
 
+    settings.configure(**(config or {}))
 
-app.include_router(router)
+    app = FastAPI()
+    app.router.lifespan_context = lifespan
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=settings.COMPRESSION_ENCODINGS,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        levels={
+            'gzip': settings.COMPRESSION_GZIP_LEVEL,
+            'br': settings.COMPRESSION_BROTLI_QUALITY,
+            'zstd': settings.COMPRESSION_ZSTD_LEVEL,
+        },
+    )
+    if settings.PROFILE_TOKEN or settings.PROFILE_SAMPLE_RATE:
+        # Outermost, so that profiles include the other middleware.
+        app.add_middleware(
+            ProfilingMiddleware,
+            directory=settings.PROFILE_DIR,
+            token=settings.PROFILE_TOKEN,
+            sample_rate=settings.PROFILE_SAMPLE_RATE,
+            max_concurrent=settings.PROFILE_MAX_CONCURRENT,
+            interval=settings.PROFILE_INTERVAL,
+        )
+
+    @app.get("/")
+    async def redirect_to_docs() -> RedirectResponse:
+        return RedirectResponse(url="/docs")
+
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name: str) -> Any:
+    # `main:app` keeps working for uvicorn and the tests, but the application
+    # is only built when it is asked for.
+    if name == 'app':
+        app = create_app()
+        globals()['app'] = app
+        return app
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -41,11 +41,17 @@ def test_db_uri() -> str:
 @pytest.fixture
 async def database(test_db_uri):
     db = settings.database
+    login_filter_capacity = settings.LOGIN_FILTER_CAPACITY
     test_db = Database(test_db_uri, force_rollback=True)
     settings.database = test_db
+    # Every task runs on the one rolled back connection, and transactions of
+    # `databases` do not wait for its queries: the login filter refresher would
+    # collide with the requests. Tests on a real `Database` keep the filter on.
+    settings.LOGIN_FILTER_CAPACITY = 0
     await test_db.connect()
     try:
         yield test_db
     finally:
         await test_db.disconnect()
         settings.database = db
+        settings.LOGIN_FILTER_CAPACITY = login_filter_capacity
@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+import pytest
+from databases import Database
+from sqlalchemy import select
+from typing import List
+
+from app import settings
+from app.batching import WriteBatcher, WriteBehindQueue
+from app.models import ItemModel, items, users
+
+
+@pytest.mark.asyncio
+async def test_write_batcher_flushes_by_size() -> None:
+    batches = []
+
+    async def flush(rows: List[int]) -> List[int]:
+        batches.append(rows)
+        return [row * 10 for row in rows]
+
+    batcher = WriteBatcher('test', flush, window=10, max_size=3)
+    results = await asyncio.gather(*[batcher.submit(row) for row in range(6)])
+
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+
+
+@pytest.mark.asyncio
+async def test_write_batcher_isolates_failing_rows() -> None:
+    async def flush(rows: List[int]) -> List[int]:
+        if 2 in rows:
+            raise ValueError(rows)
+        return rows
+
+    batcher = WriteBatcher('test', flush, window=0.001, max_size=100)
+    results = await asyncio.gather(
+        *[batcher.submit(row) for row in range(4)], return_exceptions=True
+    )
+
+    assert results[:2] == [0, 1]
+    assert isinstance(results[2], ValueError)
+    assert results[3] == 3
+
+
+@pytest.mark.asyncio
+async def test_write_batcher_flushes_in_empty_context() -> None:
+    request = contextvars.ContextVar('request')
+    contexts = []
+
+    async def flush(rows: List[int]) -> List[int]:
+        contexts.append(request.get(None))
+        return rows
+
+    batcher = WriteBatcher('test', flush, window=0.001, max_size=100)
+
+    async def submit(row: int) -> int:
+        request.set(row)
+        return await batcher.submit(row)
+
+    assert await asyncio.gather(submit(1), submit(2)) == [1, 2]
+    assert contexts == [None]
+
+
+@pytest.mark.asyncio
+async def test_write_behind_queue_batches_and_drains() -> None:
+    batches = []
+
+    async def flush(rows: List[int]) -> None:
+        batches.append(rows)
+
+    queue = WriteBehindQueue('test', flush, batch_size=3, interval=0.01, max_pending=2)
+    queue.start()
+    for row in range(7):
+        await queue.put(row)
+    await queue.close()
+    await queue.put(7)
+
+    assert [row for batch in batches for row in batch] == list(range(8))
+    assert all(len(batch) <= 3 for batch in batches)
+
+
+@pytest.mark.asyncio
+async def test_write_behind_queue_drops_only_failing_rows() -> None:
+    written = []
+
+    async def flush(rows: List[int]) -> None:
+        if 1 in rows:
+            raise ValueError(rows)
+        written.extend(rows)
+
+    queue = WriteBehindQueue('test', flush, batch_size=10, interval=0.01, max_pending=10, retries=1)
+    queue.start()
+    for row in range(3):
+        await queue.put(row)
+    await queue.close()
+
+    assert written == [0, 2]
+
+
+@pytest.mark.asyncio
+async def test_batched_item_create(database: Database, monkeypatch) -> None:
+    monkeypatch.setattr(settings, 'ITEMS_BATCH_ENABLED', True)
+    try:
+        await database.execute(users.insert().values(id=1, login='user', password='password'))
+
+        item_ids = await asyncio.gather(
+            *[ItemModel.create(name=f'item{i}', user_id=1) for i in range(10)]
+        )
+
+        rows = await database.fetch_all(select([items.c.id, items.c.name]))
+        assert {row['id']: row['name'] for row in rows} == {
+            item_id: f'item{i}' for i, item_id in enumerate(item_ids)
+        }
+
+    finally:
+        # Sequences are not rolled back together with the test transaction.
+        await database.execute("SELECT setval('items_id_seq', 1, false)")
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
@@ -0,0 +1,168 @@
+import pytest
+from async_asgi_testclient import TestClient
+from databases import Database
+from starlette import status
+
+from app import metrics, settings
+from app.bloom import BloomFilter
+from app.models import LoginFilter, UserModel, login_filter, login_filter_refresher, users
+from main import app
+
+
+def test_bloom_filter() -> None:
+    bloom_filter = BloomFilter(capacity=10000, error_rate=0.01)
+    assert bloom_filter.hashes == 7
+    assert bloom_filter.size == 11982
+
+    for number in range(10000):
+        bloom_filter.add(f'user{number}')
+    bloom_filter.add('user0')
+
+    assert all(f'user{number}' in bloom_filter for number in range(10000))
+    false_positives = sum(f'other{number}' in bloom_filter for number in range(10000))
+    assert 50 < false_positives < 200
+    assert 9900 < bloom_filter.count <= 10000
+    assert 0.009 < bloom_filter.estimated_error_rate() < 0.011
+
+
+@pytest.mark.asyncio
+async def test_login_filter(database: Database) -> None:
+    try:
+        await database.execute_many(users.insert(), values=[
+            {'id': user_id, 'login': f'user{user_id}', 'password': 'password'} for user_id in range(1, 6)
+        ])
+        login_filter_ = LoginFilter(capacity=1000, error_rate=0.01, page_size=2)
+        assert login_filter_.might_exist('user6')
+
+        await login_filter_.refresh()
+        assert all(login_filter_.might_exist(f'user{user_id}') for user_id in range(1, 6))
+        negatives = metrics.get('login_filter.negatives')
+        assert not login_filter_.might_exist('user6')
+        assert metrics.get('login_filter.negatives') == negatives + 1
+        assert metrics.get('login_filter.logins') == 5
+        assert metrics.get('login_filter.bytes') == 1199
+
+        # Registered through another process.
+        await database.execute(users.insert().values(id=6, login='user6', password='password'))
+        assert not login_filter_.might_exist('user6')
+        await login_filter_.refresh()
+        assert login_filter_.might_exist('user6')
+
+        login_filter_.add('user7')
+        assert login_filter_.might_exist('user7')
+        login_filter_.clear()
+        assert login_filter_.might_exist('user8')
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+
+
+@pytest.mark.asyncio
+async def test_login_filter_short_circuits_lookups(test_db_uri: str, monkeypatch) -> None:
+    # A registration the filter has not seen fails on the unique login, which
+    # the rolled back connection of the `database` fixture would not survive.
+    database = Database(test_db_uri)
+    await database.connect()
+    monkeypatch.setattr(settings, 'database', database)
+    monkeypatch.setattr(settings, 'LOGIN_FILTER_REFRESH_INTERVAL', 3600)
+    try:
+        async with TestClient(app) as client:
+            # Refreshed here rather than alongside the startup refresh.
+            await login_filter_refresher.close()
+            await login_filter.refresh()
+            negatives = metrics.get('login_filter.negatives')
+            assert not await UserModel.is_registered('user1')
+            assert metrics.get('login_filter.negatives') == negatives + 1
+
+            credentials = {'login': 'user1', 'password': 'password'}
+            response = await client.post('/registration', json=credentials)
+            assert response.status_code == status.HTTP_201_CREATED
+            assert await UserModel.is_registered('user1')
+            response = await client.post('/registration', json=credentials)
+            assert response.status_code == status.HTTP_409_CONFLICT
+
+            await database.execute(users.insert().values(login='user2', password='password'))
+            assert not await UserModel.is_registered('user2')
+            response = await client.post('/registration', json={'login': 'user2', 'password': 'password'})
+            assert response.status_code == status.HTTP_409_CONFLICT
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_login_filter_short_circuits_sendings(test_db_uri: str, monkeypatch) -> None:
+    database = Database(test_db_uri)
+    await database.connect()
+    monkeypatch.setattr(settings, 'database', database)
+    monkeypatch.setattr(settings, 'LOGIN_FILTER_REFRESH_INTERVAL', 3600)
+    try:
+        async with TestClient(app) as client:
+            credentials = {'login': 'user1', 'password': 'password'}
+            await client.post('/registration', json=credentials)
+            response = await client.post('/login', json=credentials)
+            headers = {'Authorization': f'Bearer {response.json()["token"]}'}
+            response = await client.post('/items', json={'name': 'item'}, headers=headers)
+            item_id = response.json()['id']
+            await login_filter_refresher.close()
+            await login_filter.refresh()
+
+            negatives = metrics.get('login_filter.negatives')
+            request = {'id': item_id, 'recipient_login': 'user2'}
+            response = await client.post('/send', json=request, headers=headers)
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+            assert response.json() == {'detail': 'Recipient has not been found'}
+            assert metrics.get('login_filter.negatives') == negatives + 1
+            assert not await database.fetch_val('SELECT count(*) FROM sendings')
+
+            response = await client.post('/send', json=request, headers={'Authorization': 'Bearer token'})
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+            await client.post('/registration', json={'login': 'user2', 'password': 'password'})
+            response = await client.post('/send', json=request, headers=headers)
+            assert response.status_code == status.HTTP_201_CREATED
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_login_filter_refreshes_beside_requests(test_db_uri: str, monkeypatch) -> None:
+    database = Database(test_db_uri)
+    await database.connect()
+    monkeypatch.setattr(settings, 'database', database)
+    monkeypatch.setattr(settings, 'LOGIN_FILTER_REFRESH_INTERVAL', 0.001)
+    monkeypatch.setattr(settings, 'ADMIN_TOKEN', 'admin-token')
+    try:
+        async with TestClient(app) as client:
+            tokens = []
+            for login in ('user1', 'user2'):
+                credentials = {'login': login, 'password': 'password'}
+                response = await client.post('/registration', json=credentials)
+                assert response.status_code == status.HTTP_201_CREATED
+                response = await client.post('/login', json=credentials)
+                tokens.append(response.json()['token'])
+            headers = {'Authorization': f'Bearer {tokens[0]}'}
+
+            for number in range(10):
+                response = await client.post(
+                    '/items/import', data=f'name\nitem{number}\n'.encode(), headers=headers,
+                )
+                assert response.status_code == status.HTTP_201_CREATED
+                response = await client.get('/items/export', headers=headers)
+                assert response.status_code == status.HTTP_200_OK
+                assert response.content.count(b'\n') == number + 2
+                response = await client.get('/admin/export/users', headers={'Authorization': 'Bearer admin-token'})
+                assert response.content == b'id,login\n1,user1\n2,user2\n'
+
+            response = await client.get('/items', headers=headers)
+            item_id = response.json()[0]['id']
+            response = await client.post('/send', json={'id': item_id, 'recipient_login': 'user2'}, headers=headers)
+            assert response.status_code == status.HTTP_201_CREATED
+            assert login_filter.might_exist('user2')
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+        await database.disconnect()
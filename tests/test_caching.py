@@ -0,0 +1,88 @@
+import time
+
+from app import metrics
+from app.caching import UserCache
+
+
+def test_user_cache_evicts_least_recently_used() -> None:
+    cache = UserCache('test_lru', max_bytes=10)
+    cache.put(1, 'a', 'a', 4, cache.generation(1))
+    cache.put(2, 'b', 'b', 4, cache.generation(2))
+    assert cache.get(1, 'a') == 'a'
+
+    cache.put(3, 'c', 'c', 4, cache.generation(3))
+
+    assert cache.get(1, 'a') == 'a'
+    assert cache.get(2, 'b') is None
+    assert cache.get(3, 'c') == 'c'
+    assert cache.size == 8
+    assert metrics.get('cache.test_lru.evictions') == 1
+    assert metrics.get('cache.test_lru.bytes') == 8
+
+
+def test_user_cache_skips_large_values() -> None:
+    cache = UserCache('test', max_bytes=10)
+    cache.put(1, 'a', 'a', 11, cache.generation(1))
+
+    assert cache.get(1, 'a') is None
+    assert cache.size == 0
+
+
+def test_user_cache_invalidate() -> None:
+    cache = UserCache('test', max_bytes=100)
+    cache.put(1, 'a', 'a', 1, cache.generation(1))
+    cache.put(1, 'b', 'b', 1, cache.generation(1))
+    cache.put(2, 'a', 'c', 1, cache.generation(2))
+
+    cache.invalidate(1)
+
+    assert cache.get(1, 'a') is None
+    assert cache.get(1, 'b') is None
+    assert cache.get(2, 'a') == 'c'
+    assert cache.size == 1
+
+
+def test_user_cache_skips_values_read_before_invalidation() -> None:
+    cache = UserCache('test', max_bytes=100)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+
+    cache.put(1, 'a', 'stale', 5, generation)
+
+    assert cache.get(1, 'a') is None
+
+
+def test_user_cache_ttl() -> None:
+    cache = UserCache('test_ttl', max_bytes=100, ttl=0.01)
+    cache.put(1, 'a', 'a', 1, cache.generation(1))
+    assert cache.get(1, 'a') == 'a'
+
+    time.sleep(0.02)
+
+    assert cache.get(1, 'a') is None
+    assert metrics.get('cache.test_ttl.hits') == 1
+    assert metrics.get('cache.test_ttl.misses') == 1
+
+
+def test_user_cache_forgets_old_invalidations() -> None:
+    cache = UserCache('test', max_bytes=100, max_invalidations=2)
+    generation = cache.generation(1)
+    for user_id in range(1, 11):
+        cache.invalidate(user_id)
+    assert len(cache._invalidations) == 2
+
+    # Read before invalidations that were forgotten.
+    cache.put(11, 'a', 'stale', 1, generation)
+    assert cache.get(11, 'a') is None
+
+    cache.put(1, 'a', 'a', 1, cache.generation(1))
+    assert cache.get(1, 'a') == 'a'
+
+
+def test_user_cache_disabled() -> None:
+    cache = UserCache('test', max_bytes=0)
+    cache.put(1, 'a', 'a', 1, cache.generation(1))
+    cache.invalidate(1, 2)
+
+    assert cache.get(1, 'a') is None
+    assert len(cache._invalidations) == 0
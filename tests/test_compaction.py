@@ -0,0 +1,76 @@
+import asyncpg
+import json
+import pytest
+from databases import Database
+from sqlalchemy import select
+
+from app import metrics
+from app.compaction import compact
+from app.models import ItemModel, items, sendings, user_counters, users
+
+
+@pytest.mark.asyncio
+async def test_deleted_items_are_compacted(database: Database) -> None:
+    try:
+        await database.execute(users.insert().values(id=1, login='user1', password='password'))
+        await database.execute(users.insert().values(id=2, login='user2', password='password'))
+        await database.execute_many(items.insert(), values=[
+            {'id': item_id, 'user_id': 1, 'name': f'item{item_id}'} for item_id in range(1, 7)
+        ])
+        await database.execute(sendings.insert().values(
+            id=1, item_id=1, from_user_id=1, to_user_id=2, item_token='token1',
+        ))
+
+        assert await ItemModel.delete_many([1, 2, 3, 4, 5], user_id=1) == [1, 2, 3, 4, 5]
+        assert await ItemModel.delete_many([1], user_id=1) == []
+        body, _ = await ItemModel.list_encoded(1)
+        assert [item['id'] for item in json.loads(body)] == [6]
+        assert await ItemModel.transfer(from_user_id=1, to_user_id=2, item_id=2) is None
+        assert await database.fetch_all(sendings.select()) == []
+        with pytest.raises(asyncpg.ForeignKeyViolationError):
+            async with database.transaction():
+                await database.execute(sendings.insert().values(
+                    id=2, item_id=2, from_user_id=1, to_user_id=2, item_token='token2',
+                ))
+        assert await database.fetch_val(
+            select([user_counters.c.items_count]).where(user_counters.c.user_id == 1)
+        ) == 1
+
+        rows = metrics.get('compaction.items.rows')
+        assert await compact(database, batch_size=2) == 5
+        assert metrics.get('compaction.items.rows') == rows + 5
+        assert await compact(database, batch_size=2) == 0
+        remaining = await database.fetch_all(select([items.c.id]))
+        assert [item['id'] for item in remaining] == [6]
+        assert await database.fetch_val(
+            select([user_counters.c.items_count]).where(user_counters.c.user_id == 1)
+        ) == 1
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+
+
+@pytest.mark.asyncio
+async def test_compaction_skips_locked_rows(test_db_uri: str) -> None:
+    # Row locks only conflict between transactions, so this test commits its
+    # rows and locks them from a second connection.
+    database = Database(test_db_uri)
+    locking_database = Database(test_db_uri)
+    await database.connect()
+    await locking_database.connect()
+    try:
+        await database.execute(users.insert().values(id=1, login='user1', password='password'))
+        await database.execute_many(items.insert(), values=[
+            {'id': item_id, 'user_id': 1, 'name': f'item{item_id}'} for item_id in range(1, 4)
+        ])
+        await database.execute('UPDATE items SET deleted_at = now()')
+
+        async with locking_database.transaction():
+            await locking_database.fetch_all('SELECT 1 FROM items WHERE id = 2 FOR UPDATE')
+            assert await compact(database) == 2
+        assert await compact(database) == 1
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+        await locking_database.disconnect()
+        await database.disconnect()
@@ -0,0 +1,127 @@
+import asyncio
+import gzip
+import pytest
+import zlib
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.types import ASGIApp, Message
+from typing import AsyncIterator, List, Optional
+
+from app.compression import CompressionMiddleware, negotiate
+
+
+async def call(app: ASGIApp, accept_encoding: Optional[str]) -> List[Message]:
+    headers = []
+    if accept_encoding is not None:
+        headers.append((b'accept-encoding', accept_encoding.encode()))
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': headers}
+    messages = []
+    disconnected = asyncio.Event()
+
+    async def receive() -> Message:
+        # Streaming responses listen for a disconnect while they send.
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message: Message) -> None:
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+def response_headers(messages: List[Message]) -> dict:
+    return {key.decode(): value.decode() for key, value in messages[0]['headers']}
+
+
+@pytest.mark.parametrize(
+    'accept_encoding, expected_encoding',
+    [
+        ('gzip', 'gzip'),
+        ('gzip, deflate, br', 'br'),
+        ('gzip;q=1.0, br;q=0.5', 'gzip'),
+        ('br;q=0, gzip;q=0.1', 'gzip'),
+        ('*', 'br'),
+        ('gzip;q=0, *', 'br'),
+        ('deflate', None),
+        ('', None),
+        ('gzip;q=oops', None),
+    ]
+)
+def test_negotiate(accept_encoding: str, expected_encoding: Optional[str]) -> None:
+    assert negotiate(accept_encoding, ['br', 'zstd', 'gzip']) == expected_encoding
+
+
+@pytest.mark.parametrize(
+    'body, accept_encoding, expected_encoding',
+    [
+        ('x' * 2000, 'gzip', 'gzip'),
+        ('x' * 2000, None, None),
+        ('x' * 2000, 'deflate', None),
+        ('x' * 100, 'gzip', None),
+    ]
+)
+@pytest.mark.asyncio
+async def test_compression(body: str, accept_encoding: Optional[str], expected_encoding: Optional[str]) -> None:
+    app = CompressionMiddleware(PlainTextResponse(body), encodings=['gzip'], minimum_size=1024)
+
+    messages = await call(app, accept_encoding)
+
+    headers = response_headers(messages)
+    assert headers.get('content-encoding') == expected_encoding
+    content = b''.join(message.get('body', b'') for message in messages[1:])
+    assert int(headers['content-length']) == len(content)
+    # Whether compressed or not depends on Accept-Encoding.
+    assert headers.get('vary') == ('Accept-Encoding' if accept_encoding else None)
+    if expected_encoding:
+        content = gzip.decompress(content)
+    assert content == body.encode()
+
+
+@pytest.mark.asyncio
+async def test_compression_streams_chunks() -> None:
+    chunks = [b'[' + b'{"id": 1, "name": "item"},' * 50, b'{"id": 2, "name": "item"}' * 50, b']']
+
+    async def stream() -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+
+    app = CompressionMiddleware(StreamingResponse(stream()), encodings=['gzip'], minimum_size=1024)
+
+    messages = await call(app, 'gzip')
+
+    headers = response_headers(messages)
+    assert headers['content-encoding'] == 'gzip'
+    assert 'content-length' not in headers
+    # Every chunk is flushed, so the client can decode it as soon as it arrives.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    bodies = [message['body'] for message in messages[1:] if message['body']]
+    assert [decompressor.decompress(body) for body in bodies[:len(chunks)]] == chunks
+    assert decompressor.decompress(b''.join(bodies[len(chunks):])) == b''
+    assert decompressor.eof
+
+
+@pytest.mark.asyncio
+async def test_compression_skips_short_streams() -> None:
+    async def stream() -> AsyncIterator[bytes]:
+        yield b'short'
+        yield b' stream'
+
+    app = CompressionMiddleware(StreamingResponse(stream()), encodings=['gzip'], minimum_size=1024)
+
+    messages = await call(app, 'gzip')
+
+    headers = response_headers(messages)
+    assert 'content-encoding' not in headers
+    assert headers['vary'] == 'Accept-Encoding'
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == b'short stream'
+
+
+@pytest.mark.asyncio
+async def test_compression_keeps_encoded_responses() -> None:
+    body = gzip.compress(b'x' * 2000)
+    response = PlainTextResponse(body, headers={'Content-Encoding': 'gzip'})
+    app = CompressionMiddleware(response, encodings=['gzip'], minimum_size=10)
+
+    messages = await call(app, 'gzip')
+
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == body
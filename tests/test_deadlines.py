@@ -0,0 +1,104 @@
+import pytest
+from async_asgi_testclient import TestClient
+from databases import Database
+from datetime import datetime, timedelta
+from starlette import status
+
+from app import metrics, settings
+from app.connections import InstrumentedDatabase, RequestConnection
+from app.deadlines import deadline
+from app.models import users
+from main import app
+
+STATEMENT_TIMEOUT_QUERY = "SELECT setting::int FROM pg_settings WHERE name = 'statement_timeout'"
+
+
+@pytest.mark.asyncio
+async def test_expired_request(test_db_uri: str, monkeypatch) -> None:
+    # The items query waits for a lock held by a second connection, so this
+    # test commits its rows. One pooled connection shows that the expired
+    # request gave its connection back.
+    database = InstrumentedDatabase(test_db_uri, min_size=1, max_size=1)
+    locking_database = Database(test_db_uri)
+    monkeypatch.setattr(settings, 'database', database)
+    monkeypatch.setattr(settings, 'REQUEST_DEADLINE', 5)
+    monkeypatch.setattr(settings, 'ROUTE_DEADLINES', {'list_items': 0.2})
+    await database.connect()
+    await locking_database.connect()
+    try:
+        await database.execute(users.insert().values(
+            id=1,
+            login='user1',
+            password='password',
+            token='token1',
+            token_expired_at=datetime.now() + timedelta(hours=1),
+        ))
+        headers = {'Authorization': 'Bearer token1'}
+
+        async with TestClient(app) as client:
+            expired = metrics.get('deadline.list_items.expired')
+            async with locking_database.transaction():
+                await locking_database.execute('LOCK TABLE items IN ACCESS EXCLUSIVE MODE')
+
+                response = await client.get('/items', headers=headers)
+                assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+                assert response.json() == {'detail': 'Deadline exceeded'}
+                assert metrics.get('deadline.list_items.expired') - expired == 1
+
+                response = await client.get('/items/summary', headers=headers)
+                assert response.status_code == status.HTTP_200_OK
+                # Postgres gave up on the items query as well.
+                assert await locking_database.fetch_val(
+                    "SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'"
+                ) == 0
+
+            response = await client.get('/items', headers=headers)
+            assert response.status_code == status.HTTP_200_OK
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+        await locking_database.disconnect()
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout(test_db_uri: str) -> None:
+    # One pooled connection shows that the pool resets the setting.
+    database = InstrumentedDatabase(test_db_uri, min_size=1, max_size=1)
+    await database.connect()
+    try:
+        connection = RequestConnection(database)
+        try:
+            assert await connection.fetch_val(STATEMENT_TIMEOUT_QUERY) == 0
+        finally:
+            await connection.release()
+
+        connection = RequestConnection(database)
+        try:
+            with deadline(5):
+                assert 4000 < await connection.fetch_val(STATEMENT_TIMEOUT_QUERY) <= 5000
+                # An earlier deadline set within a later one wins.
+                with deadline(10), deadline(1):
+                    async with connection.transaction():
+                        assert 0 < await connection.fetch_val(STATEMENT_TIMEOUT_QUERY) <= 1000
+        finally:
+            await connection.release()
+
+        # Without a connection for the request every query checks one out.
+        with deadline(5):
+            assert 4000 < await database.fetch_val(STATEMENT_TIMEOUT_QUERY) <= 5000
+            with deadline(1):
+                assert 0 < await database.fetch_val(STATEMENT_TIMEOUT_QUERY) <= 1000
+        assert await database.fetch_val(STATEMENT_TIMEOUT_QUERY) == 0
+
+    finally:
+        await database.disconnect()
+
+
+def test_parse_route_deadlines() -> None:
+    assert settings.parse_route_deadlines('list_items=2,,send_item=0.5') == {
+        'list_items': 2, 'send_item': 0.5,
+    }
+    for value in ('list_items', 'list_items=2s', '=2'):
+        with pytest.raises(ValueError, match='Invalid ROUTE_DEADLINES entry'):
+            settings.parse_route_deadlines(value)
@@ -0,0 +1,166 @@
+import pytest
+from async_asgi_testclient import TestClient
+from databases import Database
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from starlette import status
+from typing import Optional
+
+from app.encoding import JSON, MSGPACK, negotiate
+from app.models import items, users
+from main import app
+
+msgpack = pytest.importorskip('msgpack')
+
+TOKEN = 'ccc06989e67e552227cbb80f952d1ac8'
+
+
+@pytest.mark.parametrize(
+    'accept, expected_media_type',
+    [
+        (None, JSON),
+        ('application/json', JSON),
+        ('*/*', JSON),
+        ('application/msgpack', MSGPACK),
+        ('application/x-msgpack', MSGPACK),
+        ('application/json;q=0.5, application/msgpack', MSGPACK),
+        ('application/msgpack;q=0.5, application/json', JSON),
+        ('application/msgpack, */*;q=0.1', MSGPACK),
+        ('application/msgpack;q=0, */*', JSON),
+    ]
+)
+def test_negotiate(accept: Optional[str], expected_media_type: str) -> None:
+    assert negotiate(accept) == expected_media_type
+
+
+@pytest.fixture
+async def user(database: Database) -> None:
+    await database.execute(users.insert().values(
+        id=1,
+        login='user1',
+        password='password',
+        token=TOKEN,
+        token_expired_at=datetime.now() + timedelta(hours=1),
+    ))
+    try:
+        yield
+    finally:
+        await database.execute("SELECT setval('items_id_seq', 1, false)")
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+
+
+@pytest.mark.asyncio
+async def test_items_msgpack(database: Database, user: None) -> None:
+    headers = {'Authorization': f'Bearer {TOKEN}', 'Accept': MSGPACK}
+
+    async with TestClient(app) as client:
+        response = await client.post(
+            '/items',
+            data=msgpack.packb({'name': 'item1'}),
+            headers={**headers, 'Content-Type': MSGPACK},
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.headers['Content-Type'] == MSGPACK
+        created = msgpack.unpackb(response.content)
+        assert created['name'] == 'item1'
+
+        # JSON bodies and responses are still the default.
+        response = await client.post(
+            '/items', json={'name': 'item2'}, headers={'Authorization': f'Bearer {TOKEN}'},
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()['name'] == 'item2'
+
+        response = await client.post(
+            '/items', data=msgpack.packb({'title': 'item3'}), headers={**headers, 'Content-Type': MSGPACK},
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+        response = await client.get('/items', headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['Content-Type'] == MSGPACK
+        assert [item['name'] for item in msgpack.unpackb(response.content)] == ['item1', 'item2']
+
+        response = await client.get('/items', headers={'Authorization': f'Bearer {TOKEN}'})
+        assert [item['name'] for item in response.json()] == ['item1', 'item2']
+
+        response = await client.delete(
+            '/items', query_string={'ids': created['id']}, headers=headers,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert msgpack.unpackb(response.content) == {'deleted': [created['id']]}
+
+
+@pytest.mark.asyncio
+async def test_export_items_msgpack(database: Database, user: None) -> None:
+    await database.execute_many(items.insert(), values=[
+        {'id': 1, 'user_id': 1, 'name': 'item1'},
+        {'id': 2, 'user_id': 1, 'name': 'item2'},
+    ])
+
+    async with TestClient(app) as client:
+        response = await client.get(
+            '/items/export', query_string={'format': 'msgpack'}, headers={'Authorization': f'Bearer {TOKEN}'},
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['Content-Type'] == MSGPACK
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(response.content)
+    assert list(unpacker) == [{'id': 1, 'name': 'item1'}, {'id': 2, 'name': 'item2'}]
+
+
+@pytest.mark.parametrize(
+    'import_body, expected_status, expected_response, expected_names',
+    [
+        (
+            msgpack.packb({'name': 'item1'}) + msgpack.packb([1]) + msgpack.packb({'name': ''})
+            + msgpack.packb({'name': 'item2'}),
+            status.HTTP_201_CREATED,
+            {
+                'imported': 2,
+                'rejected': 2,
+                'errors': [
+                    {'line': 2, 'detail': 'Expected a MessagePack map'},
+                    {'line': 3, 'detail': 'Name must be a non-empty string'},
+                ],
+            },
+            ['item1', 'item2'],
+        ),
+        (
+            msgpack.packb({'name': 'item1'}) + msgpack.packb({'name': 'item2'})[:-1],
+            status.HTTP_400_BAD_REQUEST,
+            {'detail': 'Line 2 is incomplete'},
+            [],
+        ),
+        (
+            msgpack.packb({'name': 'item1'}) + b'\xc1',
+            status.HTTP_400_BAD_REQUEST,
+            {'detail': 'Line 2 is not valid MessagePack'},
+            [],
+        ),
+    ]
+)
+@pytest.mark.asyncio
+async def test_import_items_msgpack(
+    import_body: bytes,
+    expected_status: int,
+    expected_response: dict,
+    expected_names: list,
+    database: Database,
+    user: None,
+) -> None:
+    async with TestClient(app) as client:
+        response = await client.post(
+            '/items/import',
+            query_string={'format': 'msgpack'},
+            data=import_body,
+            headers={'Authorization': f'Bearer {TOKEN}', 'Content-Type': MSGPACK},
+        )
+
+    assert response.status_code == expected_status
+    assert response.json() == expected_response
+    names = await database.fetch_all(
+        select([items.c.name]).where(items.c.user_id == 1).order_by(items.c.id)
+    )
+    assert [name['name'] for name in names] == expected_names
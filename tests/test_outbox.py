@@ -0,0 +1,226 @@
+import json
+import pytest
+import threading
+from async_asgi_testclient import TestClient
+from databases import Database
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from starlette import status
+from typing import Any, Dict, Iterator, List
+from urllib import parse
+
+from app import models, settings
+from app.models import items, outbox, users
+from app.outbox import OutboxDispatcher, WebhookSender
+from main import app
+
+
+class WebhookReceiver:
+    """
+    A local stand-in for the webhook: records the notifications it receives
+    and answers 500 to the first `failures` requests.
+    """
+
+    def __init__(self):
+        self.notifications: List[Dict[str, Any]] = []
+        self.failures = 0
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if receiver.failures:
+                    receiver.failures -= 1
+                    self.send_response(500)
+                else:
+                    receiver.notifications.append(json.loads(body))
+                    self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/events'
+
+
+@pytest.fixture
+def receiver(monkeypatch) -> Iterator[WebhookReceiver]:
+    receiver = WebhookReceiver()
+    thread = threading.Thread(target=receiver.server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, 'OUTBOX_WEBHOOK_URL', receiver.url)
+    # The application's dispatcher is not started, so that tests dispatch
+    # when they choose to.
+    monkeypatch.setattr(models.outbox_dispatcher, 'start', lambda: None)
+    try:
+        yield receiver
+    finally:
+        receiver.server.shutdown()
+        receiver.server.server_close()
+
+
+def dispatcher(receiver: WebhookReceiver, database: Database) -> OutboxDispatcher:
+    return OutboxDispatcher(
+        lambda: [database],
+        WebhookSender(receiver.url, timeout=5),
+        batch_size=10,
+        concurrency=2,
+        backoff=60,
+        max_backoff=600,
+        interval=0.01,
+        lease=60,
+    )
+
+
+@pytest.mark.asyncio
+async def test_outbox_delivers_sendings(database: Database, receiver: WebhookReceiver) -> None:
+    try:
+        for user_id in (1, 2):
+            await database.execute(users.insert().values(
+                id=user_id,
+                login=f'user{user_id}',
+                password='password',
+                token=f'token{user_id}',
+                token_expired_at=datetime.now() + timedelta(hours=1),
+            ))
+        await database.execute(items.insert().values(id=1, user_id=1, name='item1'))
+
+        async with TestClient(app) as client:
+            response = await client.post(
+                '/send',
+                json={'id': 1, 'recipient_login': 'user2'},
+                headers={'Authorization': 'Bearer token1'},
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            item_token = parse.parse_qs(
+                parse.urlparse(response.json()['confirmation_url']).query
+            )['item_token'][0]
+            response = await client.get(
+                '/confirm', query_string={'item_token': item_token}, headers={'Authorization': 'Bearer token2'},
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+        assert receiver.notifications == []
+        assert await dispatcher(receiver, database).dispatch(database) == 2
+        # Notifications are delivered concurrently, in no particular order.
+        assert sorted(
+            (notification['event'], notification['item_id'], notification['from_user_id'], notification['to_user_id'])
+            for notification in receiver.notifications
+        ) == [('item.received', 1, 1, 2), ('item.sent', 1, 1, 2)]
+        assert len({notification['id'] for notification in receiver.notifications}) == 2
+        # Both come from OUTBOX_INSERT_QUERY, one of them within POST /send.
+        assert len({tuple(notification) for notification in receiver.notifications}) == 1
+        assert await database.fetch_all(outbox.select()) == []
+
+    finally:
+        await database.execute('TRUNCATE users, outbox RESTART IDENTITY CASCADE')
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_with_backoff(database: Database, receiver: WebhookReceiver) -> None:
+    try:
+        for number in range(3):
+            await models.OutboxModel.add(database, 'item.sent', {
+                'item_id': number, 'from_user_id': 1, 'to_user_id': 2,
+            })
+        receiver.failures = 2
+        dispatcher_ = dispatcher(receiver, database)
+
+        assert await dispatcher_.dispatch(database) == 3
+        assert [notification['item_id'] for notification in receiver.notifications] == [2]
+        rows = await database.fetch_all(
+            'SELECT attempts, available_at - now() AS delay FROM outbox ORDER BY id'
+        )
+        assert [row['attempts'] for row in rows] == [1, 1]
+        assert all(timedelta(seconds=30) <= row['delay'] <= timedelta(seconds=60) for row in rows)
+
+        # Not due yet.
+        assert await dispatcher_.dispatch(database) == 0
+
+        await database.execute('UPDATE outbox SET available_at = now()')
+        assert await dispatcher_.dispatch(database) == 2
+        assert sorted(notification['item_id'] for notification in receiver.notifications) == [0, 1, 2]
+        assert await database.fetch_all(outbox.select()) == []
+
+    finally:
+        await database.execute('TRUNCATE outbox RESTART IDENTITY')
+
+
+@pytest.mark.asyncio
+async def test_outbox_skips_locked_rows(test_db_uri: str, receiver: WebhookReceiver) -> None:
+    # Row locks only conflict between transactions, so this test commits its
+    # rows and claims them from a second connection.
+    database = Database(test_db_uri)
+    locking_database = Database(test_db_uri)
+    await database.connect()
+    await locking_database.connect()
+    try:
+        for number in range(3):
+            await models.OutboxModel.add(database, 'item.sent', {
+                'item_id': number, 'from_user_id': 1, 'to_user_id': 2,
+            })
+
+        async with locking_database.transaction():
+            await locking_database.fetch_all('SELECT 1 FROM outbox ORDER BY id LIMIT 2 FOR UPDATE')
+            assert await dispatcher(receiver, database).dispatch(database) == 1
+        assert [notification['item_id'] for notification in receiver.notifications] == [2]
+
+    finally:
+        await database.execute('TRUNCATE outbox RESTART IDENTITY')
+        await locking_database.disconnect()
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_outbox_leases_rows_while_delivering(test_db_uri: str, receiver: WebhookReceiver) -> None:
+    database = Database(test_db_uri)
+    other_database = Database(test_db_uri)
+    await database.connect()
+    await other_database.connect()
+    try:
+        for number in range(2):
+            await models.OutboxModel.add(database, 'item.sent', {
+                'item_id': number, 'from_user_id': 1, 'to_user_id': 2,
+            })
+        dispatcher_ = dispatcher(receiver, database)
+        # One delivery at a time, so that they take turns on `other_database`.
+        dispatcher_.concurrency = 1
+        send = dispatcher_.send
+
+        async def send_and_look(event: str, payload: str) -> None:
+            # No row lock is held while POSTing, and the leased rows are not
+            # due for other dispatchers.
+            assert len(await other_database.fetch_all('SELECT 1 FROM outbox FOR UPDATE NOWAIT')) == 2
+            assert await dispatcher(receiver, other_database).dispatch(other_database) == 0
+            await send(event, payload)
+
+        dispatcher_.send = send_and_look
+        assert await dispatcher_.dispatch(database) == 2
+        assert sorted(notification['item_id'] for notification in receiver.notifications) == [0, 1]
+        assert await database.fetch_all(outbox.select()) == []
+
+        # The rows of a dispatcher that died are delivered once its lease is over.
+        await models.OutboxModel.add(database, 'item.sent', {
+            'item_id': 2, 'from_user_id': 1, 'to_user_id': 2,
+        })
+        await database.execute(
+            "UPDATE outbox SET available_at = now() + interval '60 seconds' WHERE attempts = 0"
+        )
+        assert await dispatcher_.dispatch(database) == 0
+        await database.execute('UPDATE outbox SET available_at = now()')
+        dispatcher_.send = send
+        assert await dispatcher_.dispatch(database) == 1
+
+    finally:
+        await database.execute('TRUNCATE outbox RESTART IDENTITY')
+        await other_database.disconnect()
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_outbox_not_written_without_webhook(database: Database) -> None:
+    await models.OutboxModel.add(database, 'item.sent', {
+        'item_id': 1, 'from_user_id': 1, 'to_user_id': 2,
+    })
+    assert await database.fetch_all(outbox.select()) == []
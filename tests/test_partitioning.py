@@ -0,0 +1,152 @@
+import asyncpg
+import os
+import psycopg2
+import pytest
+import re
+from alembic.config import Config
+from databases import Database
+from pathlib import Path
+from typing import Any, List, Optional, Set
+from urllib import parse
+
+from alembic import command
+from app import models, sharding
+from app.models import ItemModel, SendingModel, items, sendings, users
+from app.partitioning import backfill
+from app.schemas import ItemSort, SearchMode
+
+
+class ExplainingDatabase:
+    """
+    Records the partitions of items in the plan of every query before
+    running it.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.partitions: List[Set[str]] = []
+
+    async def explain(self, query: Any) -> None:
+        async with self.database.connection() as connection:
+            sql, args, _ = connection._connection._compile(query)
+            plan = await connection.raw_connection.fetch(f'EXPLAIN (COSTS OFF) {sql}', *args)
+        self.partitions.append(set(re.findall(r'\bitems_p\d+\b', '\n'.join(row[0] for row in plan))))
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> Any:
+        await self.explain(query)
+        return await self.database.fetch_all(query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Any:
+        await self.explain(query)
+        return await self.database.fetch_one(query, values)
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        await self.explain(query)
+        return await self.database.execute(query, values)
+
+
+@pytest.mark.asyncio
+async def test_item_queries_prune_partitions(database: Database, monkeypatch) -> None:
+    try:
+        await database.execute(users.insert().values(id=1, login='user1', password='password'))
+        await database.execute(users.insert().values(id=2, login='user2', password='password'))
+        item_ids = [1, 2, 3]
+        await database.execute_many(items.insert(), values=[
+            {'id': item_id, 'user_id': 1, 'name': f'item{item_id}'} for item_id in item_ids
+        ])
+        await database.execute(sendings.insert().values(
+            id=1, item_id=1, from_user_id=1, to_user_id=2, item_token='token1',
+        ))
+        explaining = ExplainingDatabase(database)
+        monkeypatch.setattr(models, 'current_database', lambda database=None: explaining)
+        monkeypatch.setattr(sharding, 'current_database', lambda database=None: explaining)
+
+        # Queries that know the owner read a single partition.
+        await ItemModel.list_encoded(1)
+        await ItemModel.list_encoded(1, q='item', match=SearchMode.PREFIX, sort=ItemSort.NAME, limit=2)
+        await ItemModel.transfer(from_user_id=1, to_user_id=2, item_id=item_ids[1])
+        await ItemModel.delete_many([item_ids[2]], user_id=1)
+        assert [len(partitions) for partitions in explaining.partitions] == [1, 1, 1, 1]
+
+        # Lookups by item id alone probe every partition.
+        explaining.partitions.clear()
+        await SendingModel.lock('token1')
+        assert [len(partitions) for partitions in explaining.partitions] == [16]
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')
+
+
+@pytest.fixture
+def migrations_db_uri(test_db_uri: str, monkeypatch) -> str:
+    """
+    A database of its own, so that a test can migrate it step by step.
+    """
+    db_name = 'test_migrations'
+    db_uri = parse.urlunparse(parse.urlparse(test_db_uri)._replace(path=f'/{db_name}'))
+    connection = psycopg2.connect(test_db_uri)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS {db_name}')
+    cursor.execute(f'CREATE DATABASE {db_name}')
+    monkeypatch.setenv('DB_URI', db_uri)
+    try:
+        yield db_uri
+    finally:
+        cursor.execute(f'DROP DATABASE {db_name}')
+        connection.close()
+
+
+def migrate(revision: str) -> None:
+    command.upgrade(Config(Path(os.getcwd()) / 'alembic.ini'), revision)
+
+
+@pytest.mark.asyncio
+async def test_partitioning_with_backfill(migrations_db_uri: str) -> None:
+    migrate('e9357db9ca4b')
+    database = Database(migrations_db_uri)
+    await database.connect()
+
+    async def rows(query: str) -> List[tuple]:
+        return [tuple(row.values()) for row in await database.fetch_all(query)]
+
+    try:
+        await database.execute(users.insert().values(id=1, login='user1', password='password'))
+        await database.execute(users.insert().values(id=2, login='user2', password='password'))
+        await database.execute(items.insert().values(
+            [{'user_id': i % 2 + 1, 'name': f'item{i}'} for i in range(1, 51)]
+        ))
+        await database.execute(sendings.insert().values(
+            item_id=1, from_user_id=2, to_user_id=1, item_token='token1',
+        ))
+
+        migrate('3adeed8af3cb')
+        # Writes between the migrations, to rows that have not been copied yet.
+        await database.execute(items.insert().values(user_id=1, name='item51'))
+        await database.execute(items.update().where(items.c.id == 2).values(name='renamed'))
+        await database.execute(items.update().where(items.c.id == 3).values(user_id=1))
+        await database.execute(items.delete().where(items.c.id == 4))
+
+        assert await backfill(database, batch_size=7) == 47
+        assert await backfill(database, batch_size=7) == 0
+        expected_items = await rows('SELECT id, user_id, name FROM items ORDER BY id')
+        assert len(expected_items) == 50
+        assert await rows('SELECT id, user_id, name FROM items_partitioned ORDER BY id') == expected_items
+
+        migrate('head')
+        assert await rows('SELECT id, user_id, name FROM items ORDER BY id') == expected_items
+        assert await rows('SELECT user_id, items_count FROM user_counters ORDER BY user_id') == [
+            (1, 26), (2, 24),
+        ]
+        new_item_id = await database.execute(items.insert().values(user_id=2, name='item52'))
+        assert new_item_id == 52
+
+        await database.execute(items.delete().where(items.c.id == 1))
+        assert await database.fetch_all(sendings.select()) == []
+        with pytest.raises(asyncpg.ForeignKeyViolationError):
+            await database.execute(sendings.insert().values(
+                item_id=1, from_user_id=2, to_user_id=1, item_token='token2',
+            ))
+
+    finally:
+        await database.disconnect()
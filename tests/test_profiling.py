@@ -0,0 +1,76 @@
+import asyncio
+import json
+import pytest
+from pathlib import Path
+from starlette.responses import PlainTextResponse
+from starlette.types import Message, Receive, Scope, Send
+from typing import List, Optional
+
+from app import metrics
+from app.profiling import ProfilingMiddleware
+
+pytest.importorskip('pyinstrument')
+
+
+async def query_database() -> None:
+    await asyncio.sleep(0.05)
+
+
+async def endpoint(scope: Scope, receive: Receive, send: Send) -> None:
+    await query_database()
+    await PlainTextResponse('ok')(scope, receive, send)
+
+
+async def call(app: ProfilingMiddleware, profile_header: Optional[str]) -> List[Message]:
+    headers = []
+    if profile_header is not None:
+        headers.append((b'x-profile', profile_header.encode()))
+    scope = {'type': 'http', 'method': 'GET', 'path': '/items/summary', 'headers': headers}
+    messages = []
+
+    async def receive() -> Message:
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: Message) -> None:
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+@pytest.mark.parametrize(
+    'profile_header, expected_profiles',
+    [
+        ('operator-token', 1),
+        ('wrong-token', 0),
+        (None, 0),
+    ]
+)
+@pytest.mark.asyncio
+async def test_profiling(profile_header: Optional[str], expected_profiles: int, tmp_path: Path) -> None:
+    app = ProfilingMiddleware(endpoint, directory=str(tmp_path), token='operator-token')
+
+    messages = await call(app, profile_header)
+
+    headers = dict(messages[0]['headers'])
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == expected_profiles
+    if expected_profiles:
+        assert profiles[0].name == headers[b'x-profile-id'].decode() + '.speedscope.json'
+        profile = json.loads(profiles[0].read_text())
+        # Time spent awaiting is attributed to the awaiting function.
+        frames = [frame['name'] for frame in profile['shared']['frames']]
+        assert 'query_database' in frames
+    else:
+        assert b'x-profile-id' not in headers
+
+
+@pytest.mark.asyncio
+async def test_profiling_limits_concurrent_profiles(tmp_path: Path) -> None:
+    app = ProfilingMiddleware(endpoint, directory=str(tmp_path), sample_rate=1.0, max_concurrent=1)
+    skipped = metrics.get('profiling.skipped')
+
+    await asyncio.gather(*[call(app, None) for _ in range(3)])
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert metrics.get('profiling.skipped') == skipped + 2
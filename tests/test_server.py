@@ -0,0 +1,66 @@
+import os
+import pytest
+import requests
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from app import settings
+
+pytest.importorskip('gunicorn')
+pytest.importorskip('uvloop')
+pytest.importorskip('httptools')
+
+from app.server import Server, Worker, options
+
+
+def test_server_options(monkeypatch) -> None:
+    monkeypatch.setattr(settings, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(settings, 'PORT', '8081')
+    monkeypatch.setattr(settings, 'WEB_CONCURRENCY', 3)
+    monkeypatch.setattr(settings, 'SERVER_MAX_REQUESTS', 1000)
+
+    server = Server(options())
+
+    assert server.cfg.bind == ['127.0.0.1:8081']
+    assert server.cfg.workers == 3
+    assert server.cfg.worker_class is Worker
+    assert server.cfg.max_requests == 1000
+    assert server.cfg.max_requests_jitter == 100
+    assert server.cfg.backlog == settings.SERVER_BACKLOG
+    assert server.cfg.keepalive == settings.SERVER_KEEPALIVE
+    assert server.cfg.preload_app == settings.SERVER_PRELOAD
+
+
+def test_server_runs_workers(test_db_uri: str, tmp_path) -> None:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    log = tmp_path / 'server.log'
+    with log.open('wb') as errors:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.server'],
+            env={**os.environ, 'DB_URI': test_db_uri, 'HOST': '127.0.0.1', 'PORT': str(port), 'WEB_CONCURRENCY': '2'},
+            stdout=subprocess.DEVNULL,
+            stderr=errors,
+        )
+    try:
+        # Each worker runs the application's startup, i.e. opens its own
+        # pool; stopping a worker halfway through it is not what is tested.
+        deadline = time.monotonic() + 20
+        while log.read_text().count('Application startup complete') < 2:
+            assert time.monotonic() < deadline, 'The workers did not start'
+            time.sleep(0.1)
+
+        response = requests.get(f'http://127.0.0.1:{port}/openapi.json', timeout=5)
+        assert response.status_code == 200
+
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=20)
+
+    assert process.returncode == 0
+    assert log.read_text().count('Worker exiting') == 2
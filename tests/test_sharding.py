@@ -0,0 +1,254 @@
+import os
+import psycopg2
+import pytest
+from alembic.config import Config
+from async_asgi_testclient import TestClient
+from databases import Database
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from sqlalchemy import select
+from starlette import status
+from typing import Dict, List
+from urllib import parse
+
+from alembic import command
+from app import settings
+from app.models import (
+    ExportModel,
+    ItemModel,
+    TransferEventModel,
+    TransferStatsModel,
+    deliver_transfer,
+    incoming_transfers,
+    items,
+    outgoing_transfers,
+    redeliver_transfers,
+    sendings,
+    transfer_daily_stats,
+    users,
+)
+from app.rollups import rebuild
+from app.sharding import check_sequences, prepare_sequences
+from main import app
+
+DB_NAMES = ['test_directory', 'test_shard0', 'test_shard1']
+
+
+@pytest.fixture
+async def sharded_databases(test_db_uri: str, monkeypatch) -> List[Database]:
+    """
+    A directory and two shards, migrated and with prepared sequences, used
+    as the application's databases.
+    """
+    connection = psycopg2.connect(test_db_uri)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    databases = []
+    for db_name in DB_NAMES:
+        db_uri = parse.urlunparse(parse.urlparse(test_db_uri)._replace(path=f'/{db_name}'))
+        cursor.execute(f'DROP DATABASE IF EXISTS {db_name}')
+        cursor.execute(f'CREATE DATABASE {db_name}')
+        monkeypatch.setenv('DB_URI', db_uri)
+        command.upgrade(Config(Path(os.getcwd()) / 'alembic.ini'), 'head')
+        databases.append(Database(db_uri))
+    monkeypatch.setenv('DB_URI', test_db_uri)
+
+    for database in databases:
+        await database.connect()
+    directory, *shards = databases
+    monkeypatch.setattr(settings, 'database', directory)
+    monkeypatch.setattr(settings, 'shards', shards)
+    try:
+        with pytest.raises(RuntimeError):
+            await check_sequences(shards)
+        await prepare_sequences(shards)
+        yield databases
+    finally:
+        for database in databases:
+            await database.disconnect()
+        for db_name in DB_NAMES:
+            cursor.execute(f'DROP DATABASE {db_name}')
+        connection.close()
+
+
+async def rows(database: Database, query) -> List[tuple]:
+    return [tuple(row.values()) for row in await database.fetch_all(query)]
+
+
+def select_items():
+    return select([items.c.id, items.c.user_id, items.c.name]).order_by(items.c.id)
+
+
+@pytest.mark.asyncio
+async def test_send_between_shards(sharded_databases: List[Database]) -> None:
+    directory, shard0, shard1 = sharded_databases
+
+    async with TestClient(app) as client:
+        headers: Dict[int, Dict[str, str]] = {}
+        for user_id in (1, 2, 3):
+            credentials = {'login': f'user{user_id}', 'password': 'password'}
+            response = await client.post('/registration', json=credentials)
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await client.post('/login', json=credentials)
+            headers[user_id] = {'Authorization': f'Bearer {response.json()["token"]}'}
+
+        # Every shard knows every user, by id only.
+        assert await rows(shard0, 'SELECT id, login FROM users ORDER BY id') == [
+            (1, '1'), (2, '2'), (3, '3'),
+        ]
+
+        async def send(item_id: int, recipient_id: int) -> str:
+            response = await client.post(
+                '/send',
+                json={'id': item_id, 'recipient_login': f'user{recipient_id}'},
+                headers=headers[1],
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            return parse.parse_qs(parse.urlparse(response.json()['confirmation_url']).query)['item_token'][0]
+
+        async def confirm(item_token: str, user_id: int) -> int:
+            response = await client.get(
+                '/confirm', query_string={'item_token': item_token}, headers=headers[user_id],
+            )
+            return response.status_code
+
+        # Users 1 and 3 are on shard 1, user 2 on shard 0.
+        response = await client.post('/items', json={'name': 'item1'}, headers=headers[1])
+        item1_id = response.json()['id']
+        response = await client.post('/items', json={'name': 'item2'}, headers=headers[1])
+        item2_id = response.json()['id']
+        assert await rows(shard1, 'SELECT id, user_id FROM items ORDER BY id') == [
+            (item1_id, 1), (item2_id, 1),
+        ]
+
+        assert await confirm(await send(item1_id, 3), 3) == status.HTTP_200_OK
+        assert await rows(shard1, 'SELECT id, user_id FROM items ORDER BY id') == [
+            (item1_id, 3), (item2_id, 1),
+        ]
+
+        item_token = await send(item2_id, 2)
+        response = await client.get('/sendings/incoming', headers=headers[2])
+        assert [sending['item_id'] for sending in response.json()] == [item2_id]
+        response = await client.get('/items/summary', headers=headers[2])
+        assert response.json()['incoming_sendings_count'] == 1
+
+        assert await confirm(item_token, 3) == status.HTTP_401_UNAUTHORIZED
+        assert await confirm(item_token, 2) == status.HTTP_200_OK
+        assert await confirm(item_token, 2) == status.HTTP_404_NOT_FOUND
+        assert await rows(shard1, 'SELECT id, user_id FROM items ORDER BY id') == [(item1_id, 3)]
+        assert await rows(shard0, 'SELECT id, user_id, name FROM items') == [(item2_id, 2, 'item2')]
+        assert await shard1.fetch_all(outgoing_transfers.select()) == []
+        assert await shard1.fetch_all(sendings.select()) == []
+
+        response = await client.get('/items', headers=headers[2])
+        assert response.json() == [{'id': item2_id, 'name': 'item2'}]
+        response = await client.get('/items/summary', headers=headers[2])
+        assert response.json() == {
+            'items_count': 1, 'outgoing_sendings_count': 0, 'incoming_sendings_count': 0,
+        }
+
+    # Events are written behind, and to the shards of both users.
+    assert await rows(shard0, 'SELECT item_id FROM transfer_events') == [(item2_id,)]
+    assert await rows(shard1, 'SELECT item_id FROM transfer_events ORDER BY id') == [
+        (item1_id,), (item2_id,),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_create_many_keeps_order(sharded_databases: List[Database]) -> None:
+    directory, shard0, shard1 = sharded_databases
+    for user_id in (1, 2):
+        await directory.execute(users.insert().values(id=user_id, login=f'user{user_id}', password=''))
+        for shard in (shard0, shard1):
+            await shard.execute(users.insert().values(id=user_id, login=str(user_id), password=''))
+
+    item_ids = await ItemModel.create_many([('a', 1), ('b', 2), ('c', 1)])
+    assert [item_id % 2 for item_id in item_ids] == [1, 0, 1]
+    assert await rows(shard1, select_items()) == [(item_ids[0], 1, 'a'), (item_ids[2], 1, 'c')]
+    assert await rows(shard0, select_items()) == [(item_ids[1], 2, 'b')]
+
+
+@pytest.mark.asyncio
+async def test_transfer_stats(sharded_databases: List[Database]) -> None:
+    directory, shard0, shard1 = sharded_databases
+    for user_id in (1, 2, 3):
+        await directory.execute(users.insert().values(id=user_id, login=f'user{user_id}', password=''))
+        for shard in (shard0, shard1):
+            await shard.execute(users.insert().values(id=user_id, login=str(user_id), password=''))
+
+    now = datetime.now()
+    await TransferEventModel.create_many([
+        {'item_id': 1, 'from_user_id': 1, 'to_user_id': 2, 'created_at': now},
+        {'item_id': 2, 'from_user_id': 1, 'to_user_id': 3, 'created_at': now},
+        {'item_id': 1, 'from_user_id': 2, 'to_user_id': 3, 'created_at': now},
+    ])
+
+    # Stats are on the shard of their user only, although events are on both.
+    select_stats = 'SELECT user_id, sent_count, received_count FROM transfer_daily_stats ORDER BY user_id'
+    expected_stats = {shard0: [(2, 1, 1)], shard1: [(1, 2, 0), (3, 0, 2)]}
+    for shard, stats in expected_stats.items():
+        assert await rows(shard, select_stats) == stats
+
+    await shard1.execute(transfer_daily_stats.delete())
+    assert await rebuild([shard0, shard1], chunk_size=2) == 3
+    for shard, stats in expected_stats.items():
+        assert await rows(shard, select_stats) == stats
+
+    assert await TransferStatsModel.top_senders(now.date(), now.date()) == [
+        {'login': 'user1', 'sent_count': 2},
+        {'login': 'user2', 'sent_count': 1},
+    ]
+    assert await TransferStatsModel.top_senders(date(2000, 1, 1), date(2000, 1, 2)) == []
+
+
+@pytest.mark.asyncio
+async def test_export_between_shards(sharded_databases: List[Database]) -> None:
+    directory, shard0, shard1 = sharded_databases
+    for user_id in (1, 2):
+        await directory.execute(users.insert().values(id=user_id, login=f'user{user_id}', password='secret'))
+        for shard in (shard0, shard1):
+            await shard.execute(users.insert().values(id=user_id, login=str(user_id), password=''))
+    await TransferEventModel.create_many([
+        {'item_id': 1, 'from_user_id': 1, 'to_user_id': 2, 'created_at': datetime(2026, 10, 1)},
+        {'item_id': 2, 'from_user_id': 2, 'to_user_id': 1, 'created_at': datetime(2026, 10, 2)},
+    ])
+
+    async def export(table: str) -> List[str]:
+        return b''.join([chunk async for chunk in ExportModel.copy_table(table)]).decode().splitlines()
+
+    # Users come from the directory alone, without their passwords.
+    assert await export('users') == ['id,login', '1,user1', '2,user2']
+    # Every event is on both shards and exported once.
+    assert sorted(line.split(',')[1] for line in (await export('transfer_events'))[1:]) == ['1', '2']
+
+
+@pytest.mark.asyncio
+async def test_redeliver_transfers(sharded_databases: List[Database]) -> None:
+    directory, shard0, shard1 = sharded_databases
+    for shard in (shard0, shard1):
+        await shard.execute(users.insert().values(id=1, login='1', password=''))
+        await shard.execute(users.insert().values(id=2, login='2', password=''))
+
+    # Left behind by a confirmation whose delivery failed.
+    transfer = {
+        'item_id': 7,
+        'name': 'item7',
+        'from_user_id': 1,
+        'to_user_id': 2,
+        'created_at': datetime.now() - timedelta(seconds=settings.SHARD_TRANSFER_RETRY_INTERVAL + 1),
+    }
+    transfer['id'] = await shard1.execute(outgoing_transfers.insert().values(**transfer))
+
+    await redeliver_transfers()
+    await redeliver_transfers()
+    assert await rows(shard0, select_items()) == [(7, 2, 'item7')]
+    assert await shard1.fetch_all(outgoing_transfers.select()) == []
+
+    # A delivery that failed after the recipient got the item.
+    await shard1.execute(outgoing_transfers.insert().values(**transfer))
+    await deliver_transfer(transfer)
+    assert await rows(shard0, select_items()) == [(7, 2, 'item7')]
+    assert await rows(shard0, incoming_transfers.select().with_only_columns([incoming_transfers.c.id])) == [
+        (transfer['id'],),
+    ]
+    assert await shard1.fetch_all(outgoing_transfers.select()) == []
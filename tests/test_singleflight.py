@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from databases import Database
+from datetime import datetime, timedelta
+
+from app import metrics
+from app.models import UserModel, users
+from app.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result() -> None:
+    group = SingleFlight('test')
+    calls = 0
+
+    async def query() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*[group.do('key', query) for _ in range(5)])
+    assert results == [1] * 5
+
+    assert await group.do('key', query) == 2
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception() -> None:
+    group = SingleFlight('test')
+
+    async def query() -> None:
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    results = await asyncio.gather(
+        *[group.do('key', query) for _ in range(3)], return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller() -> None:
+    group = SingleFlight('test')
+
+    async def query() -> str:
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    first = asyncio.ensure_future(group.do('key', query))
+    second = asyncio.ensure_future(group.do('key', query))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 'result'
+
+
+@pytest.mark.asyncio
+async def test_get_authorized_coalesced(database: Database) -> None:
+    try:
+        await database.execute(users.insert().values(
+            id=1,
+            login='user',
+            password='password',
+            token='ccc06989e67e552227cbb80f952d1ac8',
+            token_expired_at=datetime.now() + timedelta(hours=1),
+        ))
+        coalesced = metrics.get('singleflight.UserModel.get_authorized.coalesced')
+
+        found = await asyncio.gather(*[
+            UserModel.get_authorized('ccc06989e67e552227cbb80f952d1ac8')
+            for _ in range(10)
+        ])
+
+        assert all(user['id'] == 1 for user in found)
+        assert metrics.get('singleflight.UserModel.get_authorized.coalesced') == coalesced + 9
+
+    finally:
+        await database.execute('TRUNCATE users RESTART IDENTITY CASCADE')